@@ -1,16 +1,40 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, has_app_context
+from flask import Response, stream_with_context
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
+import secrets
+import threading
+import time
+import csv
+import io
+import zlib
+import zipfile
+
+import metrics
+import registration_queue
 
 app = Flask(__name__)
-app.secret_key = 'campus_event_system_secret_key_2024'
-app.config['DATABASE'] = 'campus_events.db'
+# 部署时通过环境变量或create_app(config)设置；未设置时只有调试/测试模式能启动（见create_app()）
+app.config['SECRET_KEY'] = os.environ.get('CAMPUS_SECRET_KEY')
+app.config['DATABASE'] = os.environ.get('CAMPUS_DATABASE', 'campus_events.db')
 
 # 导入数据库模型
 try:
-    from models import init_db, get_db_connection, close_db_connection
+    from models import init_db, get_db_connection, close_db_connection, release_db_connection, db_pool, migrate_schema
+    from models import set_database, detach_db_connection, release_detached_connection
+    from models import search_active_events, has_search_index, has_search_bigrams, SEARCH_PAGE_SIZE
+    from models import fetch_keyset_page, parse_page_size, FAVORITE_KEYSET
+    from models import register_for_event, RegistrationOutcome
+    from models import withdraw_registration, remove_from_waitlist, promote_waitlist
+    from models import get_categories, get_categories_with_event_count
+    from models import get_rating_stats
+    from models import get_student_dashboard
+    from models import event_epoch, epoch_to_datetime, EVENT_TIME_FORMAT
+    from models import find_location_conflicts, find_free_slots, begin_immediate
+    from models import get_student_event_ids, forget_student_event_ids, annotate_student_events
+    from models import enable_slow_query_log
 except ImportError:
     # 如果models.py不存在，创建一个简单的版本
     def init_db():
@@ -19,40 +43,90 @@ except ImportError:
         return None
     def close_db_connection(conn):
         pass
+    def release_db_connection(exception=None):
+        pass
+    def migrate_schema(conn):
+        return 0
+    def set_database(path):
+        pass
+    def detach_db_connection():
+        return None
+    def release_detached_connection(conn):
+        pass
+    def enable_slow_query_log(path, threshold_ms=100):
+        pass
+    def get_categories():
+        return []
+    def get_categories_with_event_count():
+        return []
+    db_pool = None
+
+# 异步版学生仪表盘是可选功能，需要安装 aiosqlite 和 asgiref
+try:
+    import async_views
+except ImportError:
+    async_views = None
+
+# 请求结束时把连接归还连接池
+app.teardown_appcontext(release_db_connection)
+
+# 各路由的延迟、SQL条数和SQL耗时（/metrics 和 Server-Timing 响应头）
+request_metrics = metrics.init_app(app)
+
+# /dashboard/async：仪表盘查询在aiosqlite连接池上并发执行
+if async_views is not None:
+    async_views.init_app(app)
+
+# 慢查询日志（默认关闭）：设置 SLOW_QUERY_LOG 为日志文件路径即可开启
+app.config.setdefault('SLOW_QUERY_LOG', os.environ.get('SLOW_QUERY_LOG'))
+app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100)))
+
+# 报名高峰模式（默认关闭）：报名请求排队，由一个写线程批量提交，见 registration_queue.py
+app.config.setdefault('REGISTRATION_SURGE_MODE', os.environ.get('REGISTRATION_SURGE_MODE') == '1')
+app.config.setdefault('SURGE_BATCH_SIZE', 64)        # 每批最多提交的报名数
+app.config.setdefault('SURGE_MAX_DELAY_MS', 5)       # 第一条报名入队后最多等待多久凑批
+app.config.setdefault('SURGE_QUEUE_SIZE', 2000)      # 排队的报名数上限，超过时直接提示稍后重试
+app.config.setdefault('SURGE_TIMEOUT', 10)           # 请求等待写线程处理的最长秒数
+
+_registration_queue = None
+_registration_queue_lock = threading.Lock()
+
+def get_registration_queue():
+    """返回高峰模式的报名队列，第一次使用时按配置创建"""
+    global _registration_queue
+    with _registration_queue_lock:
+        if _registration_queue is None:
+            _registration_queue = registration_queue.RegistrationQueue(
+                batch_size=app.config['SURGE_BATCH_SIZE'],
+                max_delay_ms=app.config['SURGE_MAX_DELAY_MS'],
+                max_pending=app.config['SURGE_QUEUE_SIZE'],
+                timeout=app.config['SURGE_TIMEOUT'],
+            )
+        return _registration_queue
 
-# app.py - 修复数据库初始化部分
 def initialize_database():
-    """初始化数据库"""
-    print("检查数据库初始化...")
+    """初始化数据库：文件不存在时建库并插入示例数据，否则执行未完成的结构迁移
+
+    迁移在事务中执行，失败时回滚并抛出异常，不会删除已有数据。
+    结构已是最新时只读取一次 PRAGMA user_version。
+    """
     if not os.path.exists(app.config['DATABASE']):
         print("数据库文件不存在，开始初始化...")
         init_db()
-    else:
-        print("数据库文件已存在，跳过初始化")
-        
-    # 无论如何都检查表结构
+        return
+    
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        if conn:
-            # 检查用户表是否存在
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-            if not cursor.fetchone():
-                print("用户表不存在，重新初始化数据库...")
-                conn.close()
-                # 删除旧数据库文件重新创建
-                if os.path.exists(app.config['DATABASE']):
-                    os.remove(app.config['DATABASE'])
-                init_db()
-            else:
-                print("✓ 数据库表结构正常")
-                conn.close()
+        applied = migrate_schema(conn)
     except Exception as e:
-        print(f"数据库检查失败: {e}")
-        # 重新初始化
-        if os.path.exists(app.config['DATABASE']):
-            os.remove(app.config['DATABASE'])
-        init_db()
+        print(f"❌ 数据库迁移失败，已回滚: {e}")
+        raise
+    finally:
+        if not has_app_context():
+            close_db_connection(conn)
+    if applied:
+        print(f"✓ 完成 {applied} 项数据库迁移")
+
 # 活动状态管理函数
 def safe_update_event_statuses():
     """安全地更新活动状态，处理可能的数据库结构问题"""
@@ -63,31 +137,31 @@ def safe_update_event_statuses():
     try:
         # 检查必要的列是否存在
         cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(events)")
+        cursor.execute("PRAGMA table_xinfo(events)")
         columns = [column[1] for column in cursor.fetchall()]
         
-        if 'end_time' not in columns or 'status' not in columns:
+        if 'ends_at' not in columns or 'status' not in columns:
             print("数据库结构不完整，跳过状态更新")
             return
         
         # 获取当前时间
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        now = event_epoch(datetime.now())
         
         # 更新已开始但未标记为进行中的活动
         cursor.execute('''
             UPDATE events 
             SET status = 'ongoing' 
-            WHERE datetime(date_time) <= datetime(?) 
-            AND datetime(end_time) > datetime(?)
-            AND status = 'upcoming'
+            WHERE status = 'upcoming'
+            AND starts_at <= ?
+            AND ends_at > ?
         ''', (now, now))
         
         # 更新已结束的活动
         cursor.execute('''
             UPDATE events 
             SET status = 'completed' 
-            WHERE datetime(end_time) <= datetime(?)
-            AND status IN ('upcoming', 'ongoing')
+            WHERE status IN ('upcoming', 'ongoing')
+            AND ends_at <= ?
         ''', (now,))
         
         conn.commit()
@@ -106,10 +180,63 @@ def update_all_event_statuses():
     except Exception as e:
         print(f"活动状态更新失败: {e}")
 
-# 在应用启动时初始化数据库和更新状态
-with app.app_context():
-    initialize_database()
-    update_all_event_statuses()
+# 页面读取走events_live视图，持久化状态只需低频写回（秒）
+app.config.setdefault('STATUS_UPDATE_INTERVAL', 300)
+# 是否在create_app()的进程中启动状态回写线程；预先fork的部署要关闭，否则线程会留在fork worker的主进程中
+app.config.setdefault('STATUS_UPDATER', True)
+_status_updater = None
+
+def start_status_updater():
+    """启动后台线程，定期把推算出的活动状态写回数据库"""
+    global _status_updater
+    if _status_updater is not None:
+        return _status_updater
+    
+    def run():
+        while True:
+            time.sleep(app.config['STATUS_UPDATE_INTERVAL'])
+            with app.app_context():
+                update_all_event_statuses()
+    
+    _status_updater = threading.Thread(target=run, name='event-status-updater', daemon=True)
+    _status_updater.start()
+    return _status_updater
+
+_initialized = False
+
+def create_app(config=None):
+    """应用工厂：应用配置，并执行一次性初始化（数据库迁移、写回活动状态、启动状态回写线程）
+
+    路由注册在模块级的app上，create_app()配置并返回它，同一进程内初始化只执行一次。
+    预先fork的部署（serve.py、gunicorn --preload）由主进程调用一次，初始化结束时
+    关闭所有数据库连接，fork出的worker各自新建连接；这时应传入STATUS_UPDATER=False，
+    serve.py在fork之后由一个worker启动状态回写线程。
+    """
+    global _initialized
+    if config:
+        app.config.update(config)
+    if _initialized:
+        return app
+    
+    if not app.config['SECRET_KEY']:
+        if not (app.debug or app.testing):
+            raise RuntimeError('未设置SECRET_KEY，请设置环境变量CAMPUS_SECRET_KEY')
+        # 调试/测试时使用随机密钥：在fork worker之前生成，各worker相同，重启后原有登录失效
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+    
+    set_database(app.config['DATABASE'])
+    if app.config['SLOW_QUERY_LOG']:
+        enable_slow_query_log(app.config['SLOW_QUERY_LOG'], app.config['SLOW_QUERY_THRESHOLD_MS'])
+    with app.app_context():
+        initialize_database()
+        update_all_event_statuses()
+    # 不把打开的连接带进fork出的worker
+    if db_pool:
+        db_pool.close_all()
+    if app.config['STATUS_UPDATER']:
+        start_status_updater()
+    _initialized = True
+    return app
 
 # 首页
 @app.route('/')
@@ -231,9 +358,6 @@ def dashboard():
         flash('请先登录以访问仪表盘。', 'warning')
         return redirect(url_for('login'))
     
-    # 更新活动状态
-    safe_update_event_statuses()
-    
     conn = get_db_connection()
     if not conn:
         flash('数据库连接失败，请检查系统配置。', 'error')
@@ -245,63 +369,13 @@ def dashboard():
     if session['role'] == 'student':
         # 学生仪表盘
         try:
-            events = conn.execute('''
-                SELECT e.*, u.username as club_name, 
-                       (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count,
-                       (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id AND r.student_id = ?) as is_registered
-                FROM events e
-                JOIN users u ON e.club_id = u.id
-                WHERE (e.status = 'upcoming' OR e.status = 'ongoing')
-                ORDER BY e.date_time
-            ''', (session['user_id'],)).fetchall()
-            
-            # 获取已报名的活动
-            registered_events = conn.execute('''
-                SELECT e.*, u.username as club_name
-                FROM events e
-                JOIN registrations r ON e.id = r.event_id
-                JOIN users u ON e.club_id = u.id
-                WHERE r.student_id = ?
-                ORDER BY 
-                    CASE 
-                        WHEN e.status = 'ongoing' THEN 1
-                        WHEN e.status = 'upcoming' THEN 2
-                        WHEN e.status = 'completed' THEN 3
-                        ELSE 4
-                    END,
-                    e.date_time
-            ''', (session['user_id'],)).fetchall()
-            
-            # 获取可评价的活动（已结束且已报名但未评价）
-            reviewable_events = conn.execute('''
-                SELECT e.*, u.username as club_name
-                FROM events e
-                JOIN registrations r ON e.id = r.event_id
-                JOIN users u ON e.club_id = u.id
-                WHERE r.student_id = ? 
-                AND e.status = 'completed'
-                AND NOT EXISTS (
-                    SELECT 1 FROM reviews rev 
-                    WHERE rev.event_id = e.id AND rev.student_id = ?
-                )
-            ''', (session['user_id'], session['user_id'])).fetchall()
-            
-            # 修复：正确计算已完成评价的数量
-            reviewed_events_count = conn.execute('''
-                SELECT COUNT(DISTINCT r.event_id) 
-                FROM reviews r 
-                JOIN events e ON r.event_id = e.id 
-                WHERE r.student_id = ? AND e.status = 'completed'
-            ''', (session['user_id'],)).fetchone()[0]
+            # 仪表盘的全部数据由一条SQL取出，可报名活动按 (时间, id) 游标分页
+            data = get_student_dashboard(conn, session['user_id'], request.args.get('cursor'),
+                                         parse_page_size(request.args.get('page_size')))
             
             conn.close()
             
-            return render_template('student_dashboard.html', 
-                                  events=events, 
-                                  registered_events=registered_events,
-                                  reviewable_events=reviewable_events,
-                                  reviewed_events_count=reviewed_events_count,
-                                  now=now)
+            return render_template('student_dashboard.html', now=now, **data)
         except Exception as e:
             conn.close()
             flash(f'加载数据失败：{str(e)}', 'error')
@@ -311,9 +385,8 @@ def dashboard():
         try:
             # 获取该社团发布的活动
             events = conn.execute('''
-                SELECT e.*, 
-                       (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count
-                FROM events e
+                SELECT e.*
+                FROM events_live e
                 WHERE e.club_id = ?
                 ORDER BY 
                     CASE 
@@ -322,7 +395,7 @@ def dashboard():
                         WHEN e.status = 'completed' THEN 3
                         ELSE 4
                     END,
-                    e.date_time DESC
+                    e.starts_at DESC
             ''', (session['user_id'],)).fetchall()
             
             # 计算统计数据
@@ -336,7 +409,7 @@ def dashboard():
             recent_reviews = conn.execute('''
                 SELECT r.*, e.title as event_title, u.username as student_name
                 FROM reviews r
-                JOIN events e ON r.event_id = e.id
+                JOIN events_live e ON r.event_id = e.id
                 JOIN users u ON r.student_id = u.id
                 WHERE e.club_id = ?
                 ORDER BY r.reviewed_at DESC
@@ -366,16 +439,13 @@ def create_event():
         flash('只有社团用户可以发布活动。', 'error')
         return redirect(url_for('login'))
     
-    # 获取所有分类
-    conn = get_db_connection()
+    # 获取所有分类（带缓存）
     categories = []
     try:
-        categories = conn.execute('SELECT * FROM event_categories ORDER BY name').fetchall()
+        categories = get_categories()
     except Exception as e:
         print(f"获取分类失败: {e}")
         # 如果分类表不存在，继续执行但不显示分类
-    finally:
-        conn.close()
     
     if request.method == 'POST':
         title = request.form['title']
@@ -411,12 +481,22 @@ def create_event():
         conn = get_db_connection()
         if conn:
             try:
-                # 插入活动
+                # 先取得写锁再检查场地冲突，检查和插入之间不会有其他活动占用同一时段
+                begin_immediate(conn)
+                conflicts = find_location_conflicts(conn, location, event_epoch(start_time), event_epoch(end_time_dt))
+                if conflicts:
+                    conn.rollback()
+                    conn.close()
+                    flash('该地点在所选时间段已有其他活动，请调整时间或地点。', 'error')
+                    return render_template('create_event.html', categories=categories, conflicts=conflicts)
+                
+                # 插入活动（时间统一保存为 YYYY-MM-DD HH:MM:SS，起止时间的整数列是由它们计算的生成列）
                 cursor = conn.cursor()
                 cursor.execute('''
                     INSERT INTO events (title, description, date_time, end_time, location, max_participants, club_id, status)
                     VALUES (?, ?, ?, ?, ?, ?, ?, 'upcoming')
-                ''', (title, description, date_time, end_time, location, max_participants, session['user_id']))
+                ''', (title, description, start_time.strftime(EVENT_TIME_FORMAT), end_time_dt.strftime(EVENT_TIME_FORMAT),
+                      location, max_participants, session['user_id']))
                 
                 event_id = cursor.lastrowid
                 
@@ -438,6 +518,7 @@ def create_event():
                 flash('活动发布成功！', 'success')
                 return redirect(url_for('dashboard'))
             except Exception as e:
+                conn.rollback()
                 conn.close()
                 flash(f'发布活动失败：{str(e)}', 'error')
         else:
@@ -518,7 +599,7 @@ def edit_event(event_id):
     
     # 验证活动属于当前社团
     event = conn.execute(
-        'SELECT * FROM events WHERE id = ? AND club_id = ?',
+        'SELECT * FROM events_live WHERE id = ? AND club_id = ?',
         (event_id, session['user_id'])
     ).fetchone()
     
@@ -528,9 +609,7 @@ def edit_event(event_id):
         return redirect(url_for('dashboard'))
     
     # 获取当前报名人数
-    registered_count = conn.execute(
-        'SELECT COUNT(*) FROM registrations WHERE event_id = ?', (event_id,)
-    ).fetchone()[0]
+    registered_count = event['registered_count']
     
     if request.method == 'POST':
         title = request.form['title']
@@ -557,13 +636,39 @@ def edit_event(event_id):
             conn.close()
             return render_template('edit_event.html', event=event, registered_count=registered_count)
         
+        # 编辑页没有结束时间，结束时间随开始时间平移，保持原来的时长；
+        # 原时长无效（早期编辑只改开始时间留下的数据）时按2小时计
+        duration = timedelta(hours=2)
+        if event['ends_at'] > event['starts_at']:
+            duration = timedelta(seconds=event['ends_at'] - event['starts_at'])
+        end_time_dt = event_time + duration
+        
         try:
+            # 与发布活动相同，在写事务中检查场地冲突
+            begin_immediate(conn)
+            conflicts = find_location_conflicts(conn, location, event_epoch(event_time), event_epoch(end_time_dt),
+                                                exclude_event_id=event_id)
+            if conflicts:
+                conn.rollback()
+                conn.close()
+                flash('该地点在所选时间段已有其他活动，请调整时间或地点。', 'error')
+                # 保留用户填写的内容
+                form_event = dict(event)
+                form_event.update(title=title, description=description, location=location,
+                                  date_time=event_time.strftime(EVENT_TIME_FORMAT),
+                                  end_time=end_time_dt.strftime(EVENT_TIME_FORMAT), max_participants=max_participants)
+                return render_template('edit_event.html', event=form_event, registered_count=registered_count,
+                                       conflicts=conflicts)
+            
             # 更新活动信息
             conn.execute('''
                 UPDATE events 
-                SET title = ?, description = ?, date_time = ?, location = ?, max_participants = ?
+                SET title = ?, description = ?, date_time = ?, end_time = ?, location = ?, max_participants = ?
                 WHERE id = ?
-            ''', (title, description, date_time, location, max_participants, event_id))
+            ''', (title, description, event_time.strftime(EVENT_TIME_FORMAT), end_time_dt.strftime(EVENT_TIME_FORMAT),
+                  location, max_participants, event_id))
+            # 扩容后空出的名额按顺序分给候补名单中的学生
+            promote_waitlist(conn, event_id)
             conn.commit()
             
             flash('活动更新成功！', 'success')
@@ -636,73 +741,39 @@ def register_event(event_id):
         flash('数据库连接失败，请检查系统配置。', 'error')
         return redirect(url_for('dashboard'))
     
-    # 检查是否已报名
-    existing = conn.execute(
-        'SELECT * FROM registrations WHERE student_id = ? AND event_id = ?',
-        (session['user_id'], event_id)
-    ).fetchone()
-    
-    if existing:
-        flash('您已报名此活动。', 'info')
-        conn.close()
-        return redirect(url_for('dashboard'))
-    
-    # 检查活动是否存在
-    event = conn.execute(
-        'SELECT * FROM events WHERE id = ?', (event_id,)
-    ).fetchone()
-    
-    if not event:
-        flash('活动不存在。', 'error')
+    try:
+        if app.config['REGISTRATION_SURGE_MODE']:
+            # 高峰模式：报名交给写线程批量提交，请求线程不再争抢写锁
+            outcome = get_registration_queue().submit(session['user_id'], event_id)
+            forget_student_event_ids(session['user_id'])
+        else:
+            # 单条语句完成存在性、状态、容量和重复报名检查，并发报名不会超员
+            outcome = register_for_event(conn, session['user_id'], event_id)
+    except Exception as e:
         conn.close()
+        flash(f'报名失败：{str(e)}', 'error')
         return redirect(url_for('dashboard'))
     
-    # 检查活动状态
-    if event['status'] != 'upcoming' and event['status'] != 'ongoing':
-        flash('该活动已结束或取消，无法报名。', 'error')
+    if outcome == RegistrationOutcome.WAITLISTED:
+        # 报满后加入候补名单，有人取消时按顺序自动转为报名，不需要反复刷新抢名额
+        position = get_student_event_ids(conn, session['user_id'])[2].get(event_id)
         conn.close()
+        flash(f'活动人数已满，已加入候补名单（第{position}位），有名额空出时将自动为您报名。', 'info')
         return redirect(url_for('dashboard'))
     
-    # 检查活动是否已开始
-    try:
-        event_time = datetime.strptime(event['date_time'], '%Y-%m-%d %H:%M:%S')
-        if datetime.now() > event_time:
-            flash('活动已开始，无法报名。', 'error')
-            conn.close()
-            return redirect(url_for('dashboard'))
-    except:
-        # 如果时间格式不匹配，尝试其他格式
-        try:
-            event_time = datetime.strptime(event['date_time'], '%Y-%m-%d %H:%M')
-            if datetime.now() > event_time:
-                flash('活动已开始，无法报名。', 'error')
-                conn.close()
-                return redirect(url_for('dashboard'))
-        except:
-            pass
-    
-    # 检查活动人数是否已满
-    registered_count = conn.execute(
-        'SELECT COUNT(*) FROM registrations WHERE event_id = ?', (event_id,)
-    ).fetchone()[0]
-    
-    if registered_count >= event['max_participants']:
-        flash('活动人数已满，无法报名。', 'error')
-        conn.close()
-        return redirect(url_for('dashboard'))
-    
-    try:
-        conn.execute(
-            'INSERT INTO registrations (student_id, event_id) VALUES (?, ?)',
-            (session['user_id'], event_id)
-        )
-        conn.commit()
-        conn.close()
-        
+    conn.close()
+    if outcome == RegistrationOutcome.OK:
         flash('报名成功！', 'success')
-    except Exception as e:
-        conn.close()
-        flash(f'报名失败：{str(e)}', 'error')
+    elif outcome == RegistrationOutcome.DUPLICATE:
+        flash('您已报名此活动。', 'info')
+    elif outcome == RegistrationOutcome.NOT_FOUND:
+        flash('活动不存在。', 'error')
+    elif outcome == RegistrationOutcome.CLOSED:
+        flash('该活动已开始、结束或取消，无法报名。', 'error')
+    elif outcome == RegistrationOutcome.BUSY:
+        flash('报名人数过多，请求未能及时处理，请稍后在仪表盘确认报名结果或重试。', 'warning')
+    else:
+        flash('活动人数已满，无法报名。', 'error')
     
     return redirect(url_for('dashboard'))
 
@@ -732,31 +803,17 @@ def cancel_registration(event_id):
     
     # 检查活动是否已开始
     event = conn.execute(
-        'SELECT date_time FROM events WHERE id = ?', (event_id,)
+        'SELECT starts_at FROM events WHERE id = ?', (event_id,)
     ).fetchone()
     
-    try:
-        event_time = datetime.strptime(event['date_time'], '%Y-%m-%d %H:%M:%S')
-        if datetime.now() > event_time:
-            flash('活动已开始，无法取消报名。', 'error')
-            conn.close()
-            return redirect(url_for('dashboard'))
-    except:
-        try:
-            event_time = datetime.strptime(event['date_time'], '%Y-%m-%d %H:%M')
-            if datetime.now() > event_time:
-                flash('活动已开始，无法取消报名。', 'error')
-                conn.close()
-                return redirect(url_for('dashboard'))
-        except:
-            pass
+    if event and event_epoch(datetime.now()) > event['starts_at']:
+        flash('活动已开始，无法取消报名。', 'error')
+        conn.close()
+        return redirect(url_for('dashboard'))
     
     try:
-        conn.execute(
-            'DELETE FROM registrations WHERE student_id = ? AND event_id = ?',
-            (session['user_id'], event_id)
-        )
-        conn.commit()
+        # 取消报名和候补转正在同一个事务中完成，空出的名额不会被别人抢先
+        withdraw_registration(conn, session['user_id'], event_id)
         conn.close()
         
         flash('取消报名成功！', 'success')
@@ -766,6 +823,31 @@ def cancel_registration(event_id):
     
     return redirect(url_for('dashboard'))
 
+# 退出候补名单
+@app.route('/leave_waitlist/<int:event_id>')
+def leave_waitlist(event_id):
+    """学生退出活动的候补名单"""
+    if 'user_id' not in session or session['role'] != 'student':
+        flash('只有学生可以退出候补。', 'error')
+        return redirect(url_for('login'))
+    
+    conn = get_db_connection()
+    if not conn:
+        flash('数据库连接失败，请检查系统配置。', 'error')
+        return redirect(url_for('dashboard'))
+    
+    try:
+        if remove_from_waitlist(conn, session['user_id'], event_id):
+            flash('已退出候补名单。', 'success')
+        else:
+            flash('您不在此活动的候补名单中。', 'info')
+    except Exception as e:
+        flash(f'退出候补失败：{str(e)}', 'error')
+    finally:
+        conn.close()
+    
+    return redirect(request.referrer or url_for('dashboard'))
+
 # 手动结束活动
 @app.route('/end_event/<int:event_id>')
 def end_event(event_id):
@@ -781,7 +863,7 @@ def end_event(event_id):
     
     # 验证活动属于当前社团
     event = conn.execute(
-        'SELECT * FROM events WHERE id = ? AND club_id = ?',
+        'SELECT * FROM events_live WHERE id = ? AND club_id = ?',
         (event_id, session['user_id'])
     ).fetchone()
     
@@ -907,7 +989,7 @@ def review_event(event_id):
     # 检查是否有资格评价（已报名且活动已结束且未评价过）
     event = conn.execute('''
         SELECT e.*, u.username as club_name
-        FROM events e
+        FROM events_live e
         JOIN users u ON e.club_id = u.id
         WHERE e.id = ? AND e.status = 'completed'
         AND EXISTS (
@@ -937,7 +1019,7 @@ def review_event(event_id):
             return render_template('review_event.html', event=event)
         
         try:
-            # 插入评价记录
+            # 插入评价记录（触发器在同一事务中更新活动和社团的评分汇总）
             conn.execute('''
                 INSERT INTO reviews (student_id, event_id, content_score, organization_score, comment)
                 VALUES (?, ?, ?, ?, ?)
@@ -959,7 +1041,9 @@ def review_event(event_id):
     conn.close()
     return render_template('review_event.html', event=event)
 
-# 活动报告
+# 活动报告（页面上只列出最新的若干条评价，完整评价可导出）
+REPORT_REVIEW_LIMIT = 50
+
 @app.route('/event_report/<int:event_id>')
 def event_report(event_id):
     """查看活动详细报告"""
@@ -974,7 +1058,7 @@ def event_report(event_id):
     
     # 验证活动属于当前社团
     event = conn.execute(
-        'SELECT * FROM events WHERE id = ? AND club_id = ?',
+        'SELECT * FROM events_live WHERE id = ? AND club_id = ?',
         (event_id, session['user_id'])
     ).fetchone()
     
@@ -993,21 +1077,16 @@ def event_report(event_id):
             ORDER BY r.registered_at
         ''', (event_id,)).fetchall()
         
-        # 获取评价数据
+        # 评价数、平均分和评分分布取自汇总表，页面只列出最新的若干条评价
+        rating = get_rating_stats(conn, 'event', event_id)
         reviews = conn.execute('''
             SELECT r.content_score, r.organization_score, r.comment, r.reviewed_at, u.username
             FROM reviews r
             JOIN users u ON r.student_id = u.id
             WHERE r.event_id = ?
             ORDER BY r.reviewed_at DESC
-        ''', (event_id,)).fetchall()
-        
-        # 计算平均分
-        avg_content = 0
-        avg_organization = 0
-        if reviews:
-            avg_content = sum([r['content_score'] for r in reviews]) / len(reviews)
-            avg_organization = sum([r['organization_score'] for r in reviews]) / len(reviews)
+            LIMIT ?
+        ''', (event_id, REPORT_REVIEW_LIMIT)).fetchall()
         
         conn.close()
         
@@ -1015,20 +1094,42 @@ def event_report(event_id):
                              event=event, 
                              registrations=registrations,
                              reviews=reviews,
-                             avg_content=round(avg_content, 2),
-                             avg_organization=round(avg_organization, 2))
+                             rating=rating,
+                             avg_content=round(rating['avg_content'], 2),
+                             avg_organization=round(rating['avg_organization'], 2))
     except Exception as e:
         conn.close()
         flash(f'生成报告失败：{str(e)}', 'error')
         return redirect(url_for('dashboard'))
 
 # API: 获取报名趋势数据
+# 分桶粒度 -> strftime格式（registered_at为UTC时间，与原先按DATE()分组一致）
+TREND_BUCKETS = {
+    'day': '%Y-%m-%d',
+    'hour': '%Y-%m-%d %H:00',
+}
+
+def parse_trend_date(value):
+    """解析趋势接口的日期参数（YYYY-MM-DD），为空返回None，格式错误抛出ValueError"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d')
+
 @app.route('/api/registration_trend/<int:event_id>')
 def registration_trend(event_id):
-    """API接口：获取活动报名趋势数据"""
+    """API接口：获取活动报名趋势数据，可选参数 bucket=day|hour、start/end=YYYY-MM-DD（含两端）"""
     if 'user_id' not in session:
         return jsonify({'error': '未登录'}), 401
     
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in TREND_BUCKETS:
+        return jsonify({'error': 'bucket参数只能是day或hour'}), 400
+    try:
+        start = parse_trend_date(request.args.get('start'))
+        end = parse_trend_date(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': '日期格式应为YYYY-MM-DD'}), 400
+    
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': '数据库连接失败'}), 500
@@ -1036,45 +1137,133 @@ def registration_trend(event_id):
     # 验证活动属于当前社团（如果是社团用户）
     if session['role'] == 'club':
         event = conn.execute(
-            'SELECT * FROM events WHERE id = ? AND club_id = ?',
+            'SELECT id, registration_version FROM events WHERE id = ? AND club_id = ?',
             (event_id, session['user_id'])
         ).fetchone()
         
         if not event:
             conn.close()
             return jsonify({'error': '无权访问此活动数据'}), 403
+    else:
+        event = conn.execute(
+            'SELECT id, registration_version FROM events WHERE id = ?', (event_id,)
+        ).fetchone()
+        
+        if not event:
+            conn.close()
+            return jsonify({'error': '活动不存在'}), 404
+    
+    # 报名数据没有变化时直接返回304
+    start_key = start.strftime('%Y-%m-%d') if start else ''
+    end_key = end.strftime('%Y-%m-%d') if end else ''
+    etag = f"trend-{event_id}-{event['registration_version']}-{bucket}-{start_key}-{end_key}"
+    if request.if_none_match.contains(etag):
+        conn.close()
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     
     try:
-        # 获取按日期分组的报名人数
-        registrations_by_date = conn.execute('''
-            SELECT DATE(registered_at) as date, COUNT(*) as count
-            FROM registrations
-            WHERE event_id = ?
-            GROUP BY DATE(registered_at)
-            ORDER BY date
-        ''', (event_id,)).fetchall()
+        # 一次查询同时得到每个时间段的报名数和累计报名数；
+        # 累计值从活动的第一条报名算起，时间段过滤放在窗口函数之后
+        end_bound = (end + timedelta(days=1)).strftime('%Y-%m-%d') if end else None
+        rows = conn.execute('''
+            SELECT bucket, count, cumulative
+            FROM (
+                SELECT strftime(?, registered_at) as bucket,
+                       COUNT(*) as count,
+                       SUM(COUNT(*)) OVER (ORDER BY strftime(?, registered_at)) as cumulative
+                FROM registrations
+                WHERE event_id = ? AND registered_at < COALESCE(?, '9999-12-31')
+                GROUP BY bucket
+            )
+            WHERE bucket >= ?
+            ORDER BY bucket
+        ''', (TREND_BUCKETS[bucket], TREND_BUCKETS[bucket], event_id, end_bound, start_key)).fetchall()
         
         conn.close()
         
-        # 准备图表数据
-        dates = [row['date'] for row in registrations_by_date]
-        counts = [row['count'] for row in registrations_by_date]
-        
-        cumulative_counts = []
-        total = 0
-        for count in counts:
-            total += count
-            cumulative_counts.append(total)
-        
-        return jsonify({
-            'dates': dates,
-            'daily_counts': counts,
-            'cumulative_counts': cumulative_counts
+        response = jsonify({
+            'bucket': bucket,
+            'dates': [row['bucket'] for row in rows],
+            'daily_counts': [row['count'] for row in rows],
+            'cumulative_counts': [row['cumulative'] for row in rows]
         })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         conn.close()
         return jsonify({'error': str(e)}), 500
 
+# API: 查询地点的空闲时段
+FREE_SLOTS_MAX_LOCATIONS = 20
+
+@app.route('/api/free_slots')
+def free_slots():
+    """API接口：一天内各地点的空闲时段
+    
+    参数 location（可重复，一次查询多个地点）、date=YYYY-MM-DD，
+    可选 open/close=HH:MM（默认08:00~22:00）、min_minutes（只返回不短于该时长的时段，默认30）
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    
+    locations = [name.strip() for name in request.args.getlist('location') if name.strip()]
+    if not locations:
+        return jsonify({'error': '缺少location参数'}), 400
+    if len(locations) > FREE_SLOTS_MAX_LOCATIONS:
+        return jsonify({'error': f'一次最多查询{FREE_SLOTS_MAX_LOCATIONS}个地点'}), 400
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d')
+        opens = datetime.strptime(request.args.get('open', '08:00'), '%H:%M')
+        closes = datetime.strptime(request.args.get('close', '22:00'), '%H:%M')
+        min_minutes = int(request.args.get('min_minutes', 30))
+    except ValueError:
+        return jsonify({'error': '日期格式应为YYYY-MM-DD，时间格式应为HH:MM，min_minutes应为整数'}), 400
+    window_start = event_epoch(day.replace(hour=opens.hour, minute=opens.minute))
+    window_end = event_epoch(day.replace(hour=closes.hour, minute=closes.minute))
+    if window_end <= window_start:
+        return jsonify({'error': 'close必须晚于open'}), 400
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': '数据库连接失败'}), 500
+    
+    def format_time(value):
+        return epoch_to_datetime(value).strftime('%H:%M')
+    
+    try:
+        results = []
+        for location in locations:
+            busy, free = find_free_slots(conn, location, window_start, window_end, max(min_minutes, 0) * 60)
+            results.append({
+                'location': location,
+                'busy': [{
+                    'event_id': event['id'],
+                    'title': event['title'],
+                    'club_name': event['club_name'],
+                    'start': event['date_time'],
+                    'end': event['end_time'],
+                } for event in busy],
+                'free': [{
+                    'start': format_time(start),
+                    'end': format_time(end),
+                    'minutes': (end - start) // 60,
+                } for start, end in free],
+            })
+        return jsonify({
+            'date': day.strftime('%Y-%m-%d'),
+            'open': opens.strftime('%H:%M'),
+            'close': closes.strftime('%H:%M'),
+            'locations': results,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
 # 搜索活动
 @app.route('/search_events')
 def search_events():
@@ -1083,7 +1272,8 @@ def search_events():
         flash('请先登录以搜索活动。', 'warning')
         return redirect(url_for('login'))
     
-    query = request.args.get('q', '')
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
     
     conn = get_db_connection()
     if not conn:
@@ -1092,29 +1282,28 @@ def search_events():
     
     try:
         if query:
-            events = conn.execute('''
-                SELECT e.*, u.username as club_name, 
-                       (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count,
-                       (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id AND r.student_id = ?) as is_registered
-                FROM events e
-                JOIN users u ON e.club_id = u.id
-                WHERE (e.title LIKE ? OR e.description LIKE ? OR u.username LIKE ?)
-                AND (e.status = 'upcoming' OR e.status = 'ongoing')
-                ORDER BY e.date_time
-            ''', (session['user_id'], f'%{query}%', f'%{query}%', f'%{query}%')).fetchall()
+            # 全文索引检索，按相关度排序分页
+            events, total = search_active_events(
+                conn, query, session['user_id'], page=page, use_fts=has_search_index(conn),
+                use_bigrams=has_search_bigrams(conn)
+            )
+            next_cursor = None
         else:
-            events = conn.execute('''
-                SELECT e.*, u.username as club_name, 
-                       (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count,
-                       (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id AND r.student_id = ?) as is_registered
-                FROM events e
+            # 未输入关键词时按时间列出，游标分页
+            events, next_cursor = fetch_keyset_page(conn, '''
+                SELECT e.*, u.username as club_name
+                FROM events_live e
                 JOIN users u ON e.club_id = u.id
-                WHERE (e.status = 'upcoming' OR e.status = 'ongoing')
-                ORDER BY e.date_time
-            ''', (session['user_id'],)).fetchall()
+                WHERE (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+            ''', (), request.args.get('cursor'), parse_page_size(request.args.get('page_size')))
+            events = annotate_student_events(events, *get_student_event_ids(conn, session['user_id']))
+            # 游标分页不需要总数，页面也只在有关键词时显示总数，这里不再额外执行COUNT
+            total = None
         
         conn.close()
-        return render_template('search_events.html', events=events, query=query)
+        return render_template('search_events.html', events=events, query=query,
+                               total=total, page=page, page_size=SEARCH_PAGE_SIZE,
+                               next_cursor=next_cursor)
     except Exception as e:
         conn.close()
         flash(f'搜索失败：{str(e)}', 'error')
@@ -1220,22 +1409,14 @@ def profile():
                 (session['user_id'],)
             ).fetchone()[0]
             
-            total_participants = conn.execute('''
-                SELECT COUNT(*) as total
-                FROM registrations r
-                JOIN events e ON r.event_id = e.id
-                WHERE e.club_id = ?
-            ''', (session['user_id'],)).fetchone()[0]
-            
-            # 计算平均评分
-            avg_rating_result = conn.execute('''
-                SELECT AVG((content_score + organization_score) / 2.0) as avg_rating
-                FROM reviews r
-                JOIN events e ON r.event_id = e.id
-                WHERE e.club_id = ?
-            ''', (session['user_id'],)).fetchone()
+            total_participants = conn.execute(
+                'SELECT COALESCE(SUM(registered_count), 0) FROM events WHERE club_id = ?',
+                (session['user_id'],)
+            ).fetchone()[0]
             
-            avg_rating = round(avg_rating_result[0], 2) if avg_rating_result[0] is not None else 0
+            # 平均评分取自社团评分汇总
+            rating = get_rating_stats(conn, 'club', session['user_id'])
+            avg_rating = round(rating['avg_overall'], 2)
             
             conn.close()
             return render_template('club_profile.html', 
@@ -1249,37 +1430,74 @@ def profile():
             return render_template('club_profile.html', user=user, events_count=0, total_participants=0, avg_rating=0)
 
 # 活动收藏功能
+def wants_json():
+    """请求方（前端fetch）要求返回JSON而不是重定向"""
+    return request.accept_mimetypes.best_match(('text/html', 'application/json')) == 'application/json'
+
+def student_event_ids_response(conn, student_id):
+    """当前学生已报名和已收藏的活动id、候补位置（JSON）"""
+    registered, favorited, waitlist = get_student_event_ids(conn, student_id)
+    response = jsonify({
+        'registered': sorted(registered),
+        'favorited': sorted(favorited),
+        'waitlist': {str(event_id): position for event_id, position in sorted(waitlist.items())},
+    })
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/my_event_ids')
+def my_event_ids():
+    """API接口：当前学生已报名和已收藏的活动id、候补位置，前端据此切换按钮状态，无需重新渲染页面"""
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    if session['role'] != 'student':
+        return jsonify({'error': '只有学生有报名和收藏'}), 403
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': '数据库连接失败'}), 500
+    
+    try:
+        return student_event_ids_response(conn, session['user_id'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
 @app.route('/favorite_event/<int:event_id>')
 def favorite_event(event_id):
-    """收藏活动"""
+    """收藏活动；请求JSON时返回最新的报名/收藏id"""
     if 'user_id' not in session or session['role'] != 'student':
+        if wants_json():
+            return jsonify({'error': '只有学生可以收藏活动'}), 403
         flash('只有学生可以收藏活动。', 'error')
         return redirect(url_for('login'))
     
     conn = get_db_connection()
     if not conn:
+        if wants_json():
+            return jsonify({'error': '数据库连接失败'}), 500
         flash('数据库连接失败，请检查系统配置。', 'error')
         return redirect(url_for('dashboard'))
     
     try:
-        # 检查是否已收藏
-        existing = conn.execute(
-            'SELECT * FROM favorites WHERE student_id = ? AND event_id = ?',
+        # 已收藏时不插入，检查和收藏在同一条语句中完成
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO favorites (student_id, event_id) VALUES (?, ?)',
             (session['user_id'], event_id)
-        ).fetchone()
+        )
+        conn.commit()
+        forget_student_event_ids(session['user_id'])
+        if wants_json():
+            return student_event_ids_response(conn, session['user_id'])
         
-        if existing:
-            flash('您已收藏此活动。', 'info')
-        else:
-            # 添加收藏
-            conn.execute(
-                'INSERT INTO favorites (student_id, event_id) VALUES (?, ?)',
-                (session['user_id'], event_id)
-            )
-            conn.commit()
+        if cursor.rowcount:
             flash('活动收藏成功！', 'success')
-            
+        else:
+            flash('您已收藏此活动。', 'info')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'收藏失败：{str(e)}', 'error')
     finally:
         conn.close()
@@ -1288,13 +1506,17 @@ def favorite_event(event_id):
 
 @app.route('/unfavorite_event/<int:event_id>')
 def unfavorite_event(event_id):
-    """取消收藏活动"""
+    """取消收藏活动；请求JSON时返回最新的报名/收藏id"""
     if 'user_id' not in session or session['role'] != 'student':
+        if wants_json():
+            return jsonify({'error': '只有学生可以取消收藏活动'}), 403
         flash('只有学生可以取消收藏活动。', 'error')
         return redirect(url_for('login'))
     
     conn = get_db_connection()
     if not conn:
+        if wants_json():
+            return jsonify({'error': '数据库连接失败'}), 500
         flash('数据库连接失败，请检查系统配置。', 'error')
         return redirect(url_for('dashboard'))
     
@@ -1304,8 +1526,13 @@ def unfavorite_event(event_id):
             (session['user_id'], event_id)
         )
         conn.commit()
+        forget_student_event_ids(session['user_id'])
+        if wants_json():
+            return student_event_ids_response(conn, session['user_id'])
         flash('已取消收藏活动。', 'success')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'取消收藏失败：{str(e)}', 'error')
     finally:
         conn.close()
@@ -1325,20 +1552,31 @@ def favorites():
         return render_template('favorites.html', events=[])
     
     try:
-        events = conn.execute('''
-            SELECT e.*, u.username as club_name, 
-                   (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count,
-                   (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id AND r.student_id = ?) as is_registered,
-                   f.created_at
-            FROM events e
+        # 按收藏时间倒序，游标分页
+        events, next_cursor = fetch_keyset_page(conn, '''
+            SELECT e.*, u.username as club_name,
+                   f.created_at as favorited_at, f.id as favorite_id
+            FROM events_live e
             JOIN users u ON e.club_id = u.id
             JOIN favorites f ON e.id = f.event_id
-            WHERE f.student_id = ? AND (e.status = 'upcoming' OR e.status = 'ongoing')
-            ORDER BY f.created_at DESC
-        ''', (session['user_id'], session['user_id'])).fetchall()
+            WHERE f.student_id = ? AND (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+        ''', (session['user_id'],), request.args.get('cursor'),
+            parse_page_size(request.args.get('page_size')), keys=FAVORITE_KEYSET, descending=True)
+        events = annotate_student_events(events, *get_student_event_ids(conn, session['user_id']))
+        
+        # 统计全部收藏，而不只是当前页
+        stats = conn.execute('''
+            SELECT COUNT(*) as total,
+                   COALESCE(SUM(EXISTS (SELECT 1 FROM registrations r
+                                        WHERE r.event_id = f.event_id AND r.student_id = f.student_id)), 0) as registered
+            FROM favorites f
+            JOIN events_live e ON e.id = f.event_id
+            WHERE f.student_id = ? AND (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+        ''', (session['user_id'],)).fetchone()
         
         conn.close()
-        return render_template('favorites.html', events=events)
+        return render_template('favorites.html', events=events, next_cursor=next_cursor,
+                               favorites_total=stats['total'], registered_total=stats['registered'])
     except Exception as e:
         conn.close()
         flash(f'加载收藏失败：{str(e)}', 'error')
@@ -1354,20 +1592,13 @@ def categories():
         return render_template('categories.html', categories=[])
     
     try:
-        # 修复：获取分类及其活动数量
-        categories = conn.execute('''
-            SELECT ec.*, COUNT(ecr.event_id) as event_count
-            FROM event_categories ec
-            LEFT JOIN event_category_relations ecr ON ec.id = ecr.category_id
-            LEFT JOIN events e ON ecr.event_id = e.id AND (e.status = 'upcoming' OR e.status = 'ongoing')
-            GROUP BY ec.id
-            ORDER BY ec.name
-        ''').fetchall()
+        # 获取分类及其活动数量（带缓存，活动或分类变化时失效）
+        categories = get_categories_with_event_count()
         conn.close()
         return render_template('categories.html', categories=categories)
     except Exception as e:
         conn.close()
-        print(f"加载分类错误: {e}")  # 调试信息
+        app.logger.exception('加载分类失败')
         flash(f'加载分类失败：{str(e)}', 'error')
         return render_template('categories.html', categories=[])
 @app.route('/events_by_category/<int:category_id>')
@@ -1388,32 +1619,150 @@ def events_by_category(category_id):
             'SELECT * FROM event_categories WHERE id = ?', (category_id,)
         ).fetchone()
         
-        # 获取该分类下的活动
-        events = conn.execute('''
-            SELECT e.*, u.username as club_name, 
-                   (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count,
-                   (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id AND r.student_id = ?) as is_registered
-            FROM events e
+        # 获取该分类下的活动（游标分页）
+        events, next_cursor = fetch_keyset_page(conn, '''
+            SELECT e.*, u.username as club_name
+            FROM events_live e
             JOIN users u ON e.club_id = u.id
             JOIN event_category_relations ecr ON e.id = ecr.event_id
-            WHERE ecr.category_id = ? AND (e.status = 'upcoming' OR e.status = 'ongoing')
-            ORDER BY e.date_time
-        ''', (session['user_id'], category_id)).fetchall()
+            WHERE ecr.category_id = ? AND (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+        ''', (category_id,), request.args.get('cursor'),
+            parse_page_size(request.args.get('page_size')))
+        events = annotate_student_events(events, *get_student_event_ids(conn, session['user_id']))
+        
+        events_total = conn.execute('''
+            SELECT COUNT(*)
+            FROM event_category_relations ecr
+            JOIN events_live e ON e.id = ecr.event_id
+            WHERE ecr.category_id = ? AND (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+        ''', (category_id,)).fetchone()[0]
         
         conn.close()
         return render_template('category_events.html', 
                              events=events, 
+                             events_total=events_total,
+                             next_cursor=next_cursor,
                              category=category,
-                             category_id=category_id)
+                             category_id=category_id,
+                             categories=get_categories_with_event_count())
     except Exception as e:
         conn.close()
         flash(f'加载活动失败：{str(e)}', 'error')
         return render_template('search_events.html', events=[], category_id=category_id)
 
 # 数据导出功能
+EXPORT_BATCH_SIZE = 500
+app.config.setdefault('EXPORT_GZIP', True)
+
+def iter_batches(cursor, batch_size=EXPORT_BATCH_SIZE):
+    """按批次从游标读取结果，避免fetchall()把所有行放进内存"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+def iter_event_csv(event, registration_batches, review_batches):
+    """逐批生成单个活动的CSV文本，报名人数和平均分在遍历时累计"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+    
+    # 写入表头
+    writer.writerow(['活动数据导出 - ' + event['title']])
+    writer.writerow(['导出时间', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+    writer.writerow([])
+    writer.writerow(['活动信息'])
+    writer.writerow(['标题', event['title']])
+    writer.writerow(['描述', event['description'] or ''])
+    writer.writerow(['开始时间', event['date_time']])
+    writer.writerow(['结束时间', event['end_time']])
+    writer.writerow(['地点', event['location']])
+    writer.writerow(['最大参与人数', event['max_participants']])
+    writer.writerow(['状态', event['status']])
+    writer.writerow([])
+    
+    # 报名数据
+    writer.writerow(['报名名单'])
+    writer.writerow(['用户名', '邮箱', '报名时间'])
+    yield flush()
+    
+    registration_total = 0
+    for batch in registration_batches:
+        for reg in batch:
+            writer.writerow([reg['username'], reg['email'] or '', reg['registered_at']])
+        registration_total += len(batch)
+        yield flush()
+    
+    writer.writerow([])
+    writer.writerow(['总计报名人数', registration_total])
+    writer.writerow(['报名率', f"{(registration_total / event['max_participants'] * 100):.1f}%"])
+    writer.writerow([])
+    
+    # 评价数据
+    writer.writerow(['评价数据'])
+    writer.writerow(['用户名', '内容丰富度', '组织有序性', '评价内容', '评价时间'])
+    yield flush()
+    
+    review_total = 0
+    content_sum = 0
+    organization_sum = 0
+    for batch in review_batches:
+        for review in batch:
+            writer.writerow([
+                review['username'],
+                review['content_score'],
+                review['organization_score'],
+                review['comment'] or '',
+                review['reviewed_at']
+            ])
+            content_sum += review['content_score']
+            organization_sum += review['organization_score']
+        review_total += len(batch)
+        yield flush()
+    
+    writer.writerow([])
+    writer.writerow(['总计评价数', review_total])
+    
+    if review_total:
+        avg_content = content_sum / review_total
+        avg_organization = organization_sum / review_total
+        writer.writerow(['平均内容评分', f"{avg_content:.2f}"])
+        writer.writerow(['平均组织评分', f"{avg_organization:.2f}"])
+        writer.writerow(['综合评分', f"{(avg_content + avg_organization) / 2:.2f}"])
+    yield flush()
+
+def gzip_stream(chunks):
+    """把文本块流式压缩为gzip字节流"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def streaming_response(conn, body, **kwargs):
+    """流式输出body的响应，响应关闭时归还detach_db_connection()取出的连接
+    
+    用call_on_close()而不是在生成器的finally中归还：HEAD请求、客户端在开始输出前断开时
+    生成器不会被启动，finally也不会执行。响应关闭时先关闭生成器，再归还连接。
+    """
+    response = Response(stream_with_context(body), **kwargs)
+    response.call_on_close(lambda: release_detached_connection(conn))
+    return response
+
+def client_accepts_gzip():
+    """客户端是否接受gzip编码的响应"""
+    return app.config['EXPORT_GZIP'] and 'gzip' in request.accept_encodings
+
 @app.route('/export_event_data/<int:event_id>')
 def export_event_data(event_id):
-    """导出活动数据为CSV"""
+    """导出活动数据为CSV（流式输出，内存占用与报名人数无关）"""
     if 'user_id' not in session or session['role'] != 'club':
         flash('只有社团用户可以导出数据。', 'error')
         return redirect(url_for('login'))
@@ -1425,7 +1774,7 @@ def export_event_data(event_id):
     
     # 验证活动属于当前社团
     event = conn.execute(
-        'SELECT * FROM events WHERE id = ? AND club_id = ?',
+        'SELECT * FROM events_live WHERE id = ? AND club_id = ?',
         (event_id, session['user_id'])
     ).fetchone()
     
@@ -1434,97 +1783,174 @@ def export_event_data(event_id):
         conn.close()
         return redirect(url_for('dashboard'))
     
-    try:
-        import csv
-        import io
-        from datetime import datetime
-        
-        # 创建内存文件
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # 写入表头
-        writer.writerow(['活动数据导出 - ' + event['title']])
-        writer.writerow(['导出时间', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-        writer.writerow([])
-        writer.writerow(['活动信息'])
-        writer.writerow(['标题', event['title']])
-        writer.writerow(['描述', event['description'] or ''])
-        writer.writerow(['开始时间', event['date_time']])
-        writer.writerow(['结束时间', event['end_time']])
-        writer.writerow(['地点', event['location']])
-        writer.writerow(['最大参与人数', event['max_participants']])
-        writer.writerow(['状态', event['status']])
-        writer.writerow([])
-        
-        # 报名数据
-        writer.writerow(['报名名单'])
-        writer.writerow(['用户名', '邮箱', '报名时间'])
-        
-        registrations = conn.execute('''
+    # 响应体在视图返回后才输出，连接由生成器持有到输出结束
+    conn = detach_db_connection()
+    
+    def query_batches(sql):
+        # 生成器在响应迭代到这里时才执行查询
+        yield from iter_batches(conn.execute(sql, (event_id,)))
+    
+    def generate():
+        registrations = query_batches('''
             SELECT u.username, u.email, r.registered_at
             FROM registrations r
             JOIN users u ON r.student_id = u.id
             WHERE r.event_id = ?
             ORDER BY r.registered_at
-        ''', (event_id,)).fetchall()
-        
-        for reg in registrations:
-            writer.writerow([reg['username'], reg['email'] or '', reg['registered_at']])
-        
-        writer.writerow([])
-        writer.writerow(['总计报名人数', len(registrations)])
-        writer.writerow(['报名率', f"{(len(registrations) / event['max_participants'] * 100):.1f}%"])
-        writer.writerow([])
-        
-        # 评价数据
-        writer.writerow(['评价数据'])
-        writer.writerow(['用户名', '内容丰富度', '组织有序性', '评价内容', '评价时间'])
-        
-        reviews = conn.execute('''
+        ''')
+        reviews = query_batches('''
             SELECT u.username, r.content_score, r.organization_score, r.comment, r.reviewed_at
             FROM reviews r
             JOIN users u ON r.student_id = u.id
             WHERE r.event_id = ?
             ORDER BY r.reviewed_at DESC
-        ''', (event_id,)).fetchall()
-        
-        for review in reviews:
-            writer.writerow([
-                review['username'],
-                review['content_score'],
-                review['organization_score'],
-                review['comment'] or '',
-                review['reviewed_at']
-            ])
-        
-        writer.writerow([])
-        writer.writerow(['总计评价数', len(reviews)])
-        
-        if reviews:
-            avg_content = sum([r['content_score'] for r in reviews]) / len(reviews)
-            avg_organization = sum([r['organization_score'] for r in reviews]) / len(reviews)
-            writer.writerow(['平均内容评分', f"{avg_content:.2f}"])
-            writer.writerow(['平均组织评分', f"{avg_organization:.2f}"])
-            writer.writerow(['综合评分', f"{(avg_content + avg_organization) / 2:.2f}"])
-        
-        conn.close()
-        
-        # 准备下载响应
-        output.seek(0)
-        filename = f"event_{event_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        from flask import Response
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-Disposition": f"attachment;filename={filename}"}
-        )
-        
-    except Exception as e:
-        conn.close()
-        flash(f'导出数据失败：{str(e)}', 'error')
-        return redirect(url_for('event_report', event_id=event_id))
+        ''')
+        try:
+            yield from iter_event_csv(event, registrations, reviews)
+        except Exception as e:
+            # 响应头已发出，无法再重定向，只能记录错误并中断下载
+            print(f"导出活动 {event_id} 数据失败: {e}")
+            raise
+    
+    filename = f"event_{event_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    headers = {"Content-Disposition": f"attachment;filename={filename}", "Vary": "Accept-Encoding"}
+    body = generate()
+    if client_accepts_gzip():
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    
+    return streaming_response(conn, body, mimetype="text/csv", headers=headers)
+
+class ZipStreamBuffer(io.RawIOBase):
+    """zipfile的写入目标：收集写入的字节，由生成器逐段取走"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def rows_of_event(rows, event_id):
+    """从按活动顺序排列的行迭代器（peekable）中取出属于某个活动的行，按批次返回"""
+    batch = []
+    while rows.peek() is not None and rows.peek()['event_id'] == event_id:
+        batch.append(next(rows))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class PeekableRows:
+    """可以预读一行的结果迭代器，结束时peek()返回None"""
+
+    def __init__(self, batches):
+        self._rows = (row for batch in batches for row in batch)
+        self._next = next(self._rows, None)
+
+    def peek(self):
+        return self._next
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._next is None:
+            raise StopIteration
+        row = self._next
+        self._next = next(self._rows, None)
+        return row
+
+def safe_filename(name):
+    """去掉文件名中不能使用的字符"""
+    return ''.join('_' if ch in '\\/:*?"<>|' else ch for ch in name).strip() or 'event'
+
+@app.route('/export_club_data')
+def export_club_data():
+    """把社团所有活动的数据导出为一个ZIP（每个活动一个CSV，外加汇总CSV），流式输出"""
+    if 'user_id' not in session or session['role'] != 'club':
+        flash('只有社团用户可以导出数据。', 'error')
+        return redirect(url_for('login'))
+    
+    conn = get_db_connection()
+    if not conn:
+        flash('数据库连接失败，请检查系统配置。', 'error')
+        return redirect(url_for('dashboard'))
+    
+    club_id = session['user_id']
+    # 响应体在视图返回后才输出，连接由生成器持有到输出结束
+    conn = detach_db_connection()
+    
+    def generate():
+        # 每张表只查询一次，三个结果集按相同的 (开始时间, 活动id) 顺序排列，边读边合并
+        events = conn.execute('''
+            SELECT e.*
+            FROM events_live e
+            WHERE e.club_id = ?
+            ORDER BY e.starts_at, e.id
+        ''', (club_id,))
+        registrations = PeekableRows(iter_batches(conn.execute('''
+            SELECT r.event_id, u.username, u.email, r.registered_at
+            FROM events e
+            JOIN registrations r ON r.event_id = e.id
+            JOIN users u ON r.student_id = u.id
+            WHERE e.club_id = ?
+            ORDER BY e.starts_at, e.id, r.registered_at
+        ''', (club_id,))))
+        reviews = PeekableRows(iter_batches(conn.execute('''
+            SELECT r.event_id, u.username, r.content_score, r.organization_score, r.comment, r.reviewed_at
+            FROM events e
+            JOIN reviews r ON r.event_id = e.id
+            JOIN users u ON r.student_id = u.id
+            WHERE e.club_id = ?
+            ORDER BY e.starts_at, e.id, r.reviewed_at DESC
+        ''', (club_id,))))
+        
+        buffer = ZipStreamBuffer()
+        summary = [['活动ID', '标题', '开始时间', '结束时间', '地点', '状态',
+                    '最大参与人数', '报名人数', '评价数', '平均内容评分', '平均组织评分']]
+        
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for batch in iter_batches(events):
+                for event in batch:
+                    name = f"event_{event['id']}_{safe_filename(event['title'])}.csv"
+                    with archive.open(name, 'w') as entry:
+                        for chunk in iter_event_csv(event,
+                                                    rows_of_event(registrations, event['id']),
+                                                    rows_of_event(reviews, event['id'])):
+                            entry.write(chunk.encode('utf-8'))
+                            yield buffer.drain()
+                    
+                    # 汇总数据直接取自计数列
+                    review_count = event['review_count']
+                    summary.append([
+                        event['id'], event['title'], event['date_time'], event['end_time'],
+                        event['location'], event['status'], event['max_participants'],
+                        event['registered_count'], review_count,
+                        f"{event['content_score_sum'] / review_count:.2f}" if review_count else '',
+                        f"{event['organization_score_sum'] / review_count:.2f}" if review_count else '',
+                    ])
+            
+            text = io.StringIO()
+            csv.writer(text).writerows(summary)
+            archive.writestr('summary.csv', text.getvalue().encode('utf-8'))
+        yield buffer.drain()
+    
+    filename = f"club_{club_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return streaming_response(
+        conn, generate(),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
 
 # 登出
 @app.route('/logout')
@@ -1573,11 +1999,8 @@ def help_page():
     return render_template('help.html')
 
 if __name__ == '__main__':
-    # 确保数据库存在
-    initialize_database()
-    
-    # 运行应用
-    app.run(
+    # 单进程开发服务器；多进程部署使用 serve.py
+    create_app({'DEBUG': True}).run(
         host='0.0.0.0',
         port=5000,
         debug=True,
@@ -0,0 +1,225 @@
+# async_views.py
+"""学生仪表盘的异步版本 /dashboard/async：仪表盘的几条查询互不依赖，
+用aiosqlite在连接池的多个连接上并发执行，页面与 /dashboard 相同
+
+需要安装 aiosqlite 和 asgiref（pip install aiosqlite "flask[async]"），未安装时app.py不注册这些路由。
+aiosqlite为每个连接配一个后台线程执行查询，连接池限制了连接数，也就限制了这些线程的数量；
+Flask仍是WSGI应用，每个请求占用服务器的一个线程，异步带来的是单个请求内的查询并发。
+"""
+import asyncio
+import collections
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import aiosqlite
+import asgiref  # noqa: F401  Flask执行async视图需要asgiref
+from flask import flash, redirect, render_template, request, session, url_for
+
+import models
+
+class AsyncConnectionPool:
+    """aiosqlite连接池，最多size个连接
+
+    Flask的async视图每个请求运行在各自的事件循环中，所以连接池不能绑定某个事件循环：
+    状态用线程锁保护，没有空闲连接时请求在自己的事件循环里等待一个Future，
+    归还连接时直接交给等待最久的请求。
+    """
+
+    def __init__(self, size=8):
+        self.size = size
+        self._idle = []
+        self._created = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """连接的后台线程不会出现在fork出的子进程中，子进程重新建立连接"""
+        self._idle = []
+        self._created = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    async def _connect(self):
+        # 底层连接使用PooledConnection，SQL同样进入慢查询日志
+        conn = aiosqlite.connect(models.DATABASE, check_same_thread=False,
+                                 factory=models.PooledConnection)
+        # aiosqlite的后台线程不是守护线程，池中的空闲连接会阻止进程退出
+        getattr(conn, '_thread', conn).daemon = True
+        await conn
+        conn.row_factory = sqlite3.Row
+        for pragma in models.CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def acquire(self):
+        """取出一个空闲连接；连接数未满时新建，否则等待其他请求归还"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            if self._created < self.size:
+                self._created += 1
+                waiter = None
+            else:
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+
+        if waiter is None:
+            try:
+                return await self._connect()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+
+    def release(self, conn):
+        """归还连接，有请求在等待时直接交给它"""
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.done():
+                    continue
+                try:
+                    waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter, conn)
+                    return
+                except RuntimeError:
+                    # 等待者的事件循环已经关闭
+                    continue
+            self._idle.append(conn)
+
+    def _hand_over(self, waiter, conn):
+        """在等待者的事件循环中执行"""
+        if waiter.done():
+            # 等待的请求已被取消，连接交给下一个
+            self.release(conn)
+        else:
+            waiter.set_result(conn)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            self.release(conn)
+
+pool = None
+
+async def fetch_all(sql, params=()):
+    """从连接池取一个连接执行查询，返回全部结果"""
+    async with pool.connection() as conn:
+        start = time.perf_counter()
+        rows = await conn.execute_fetchall(sql, params)
+    models.record_request_sql(time.perf_counter() - start)
+    return rows
+
+async def fetch_value(sql, params=()):
+    """执行查询，返回第一行第一列"""
+    rows = await fetch_all(sql, params)
+    return rows[0][0] if rows else None
+
+def init_app(app):
+    """创建连接池并注册异步路由"""
+    global pool
+    app.config.setdefault('ASYNC_DB_POOL_SIZE', 8)
+    pool = AsyncConnectionPool(app.config['ASYNC_DB_POOL_SIZE'])
+
+    @app.route('/dashboard/async')
+    async def async_dashboard():
+        """学生仪表盘（异步版本）"""
+        if 'user_id' not in session:
+            flash('请先登录以访问仪表盘。', 'warning')
+            return redirect(url_for('login'))
+        if session['role'] != 'student':
+            return redirect(url_for('dashboard'))
+
+        student_id = session['user_id']
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        page_size = models.parse_page_size(request.args.get('page_size'))
+        events_sql, events_params = models.keyset_query('''
+            SELECT e.*, u.username as club_name
+            FROM events_live e
+            JOIN users u ON e.club_id = u.id
+            WHERE (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+        ''', (), request.args.get('cursor'), page_size)
+
+        try:
+            # 各条查询各用一个连接并发执行
+            (event_rows, events_total, registered_events, reviewable_events, reviewed_events_count,
+             registered_ids, favorited_ids, waitlist) = \
+                await asyncio.gather(
+                    fetch_all(events_sql, events_params),
+                    fetch_value('''
+                        SELECT COUNT(*) FROM events_live e
+                        WHERE (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+                    '''),
+                    fetch_all('''
+                        SELECT e.*, u.username as club_name
+                        FROM events_live e
+                        JOIN registrations r ON e.id = r.event_id
+                        JOIN users u ON e.club_id = u.id
+                        WHERE r.student_id = ?
+                        ORDER BY
+                            CASE
+                                WHEN e.status = 'ongoing' THEN 1
+                                WHEN e.status = 'upcoming' THEN 2
+                                WHEN e.status = 'completed' THEN 3
+                                ELSE 4
+                            END,
+                            e.starts_at
+                    ''', (student_id,)),
+                    fetch_all('''
+                        SELECT e.*, u.username as club_name
+                        FROM events_live e
+                        JOIN registrations r ON e.id = r.event_id
+                        JOIN users u ON e.club_id = u.id
+                        WHERE r.student_id = ?
+                        AND e.status = 'completed'
+                        AND NOT EXISTS (
+                            SELECT 1 FROM reviews rev
+                            WHERE rev.event_id = e.id AND rev.student_id = ?
+                        )
+                    ''', (student_id, student_id)),
+                    fetch_value('''
+                        SELECT COUNT(DISTINCT r.event_id)
+                        FROM reviews r
+                        JOIN events_live e ON r.event_id = e.id
+                        WHERE r.student_id = ? AND e.status = 'completed'
+                    ''', (student_id,)),
+                    fetch_all(models.STUDENT_REGISTERED_IDS_SQL, (student_id,)),
+                    fetch_all(models.STUDENT_FAVORITED_IDS_SQL, (student_id,)),
+                    fetch_all(models.STUDENT_WAITLIST_SQL, (student_id,)),
+                )
+        except Exception as e:
+            flash(f'加载数据失败：{str(e)}', 'error')
+            return render_template('student_dashboard.html', events=[], registered_events=[],
+                                   reviewable_events=[], reviewed_events_count=0, now=now)
+
+        events, next_cursor = models.keyset_page(event_rows, page_size)
+        # 报名/收藏/候补状态用内存中的id集合标注
+        memberships = ({row[0] for row in registered_ids}, {row[0] for row in favorited_ids},
+                       {row[0]: row[1] for row in waitlist})
+        return render_template('student_dashboard.html',
+                               events=models.annotate_student_events(events, *memberships),
+                               events_total=events_total,
+                               next_cursor=next_cursor,
+                               registered_events=models.annotate_student_events(registered_events, *memberships),
+                               reviewable_events=models.annotate_student_events(reviewable_events, *memberships),
+                               reviewed_events_count=reviewed_events_count,
+                               now=now)
+
+    return pool
@@ -0,0 +1,539 @@
+# benchmark.py
+"""主要页面的压测：在合成的大数据量数据库上回放混合负载，
+统计各路由的p50/p95/p99延迟和每秒请求数，并与保存的基线比较
+
+用法:
+    python benchmark.py                         # 测试客户端 + 真实HTTP 两种模式
+    python benchmark.py --mode http -c 16       # 只跑真实HTTP，16个并发客户端
+    python benchmark.py --save-baseline         # 把本次结果保存为基线
+    python benchmark.py --mode workers --workers 1,2,4,8 -c 32
+                                                # serve.py 多进程部署的吞吐随worker数的变化
+    python benchmark.py --mode async -c 16      # 学生仪表盘：同步版与aiosqlite异步版对比
+    python benchmark.py --mode surge -c 64 -n 2000
+                                                # 开放报名高峰：逐个提交与高峰模式批量提交的报名/秒对比
+"""
+import argparse
+import contextlib
+import http.client
+import http.cookiejar
+import io
+import json
+import logging
+import math
+import os
+import platform
+import random
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+import generate_data
+import models
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = generate_data.PASSWORD
+BASELINE_FILE = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+
+# 混合负载：操作 -> 权重
+WORKLOAD = {
+    'student_dashboard': 30,
+    'search': 25,
+    'register_cancel': 20,
+    'club_report': 15,
+    'csv_export': 10,
+}
+
+# p95超过基线的比例达到该值即视为性能回退
+DEFAULT_TOLERANCE = 0.25
+
+SEARCH_TERMS = ('机器人', '工作坊', '分享会', '训练营', '编程', '篮球', '志愿服务', '不存在的活动')
+
+def populate(conn, scale, seed=42):
+    """用generate_data按规模生成合成数据，返回压测需要的用户名和活动ID"""
+    counts = generate_data.generate(
+        conn, students=2000 * scale, clubs=20 * scale, events=400 * scale,
+        registrations=25000 * scale, reviews=5000 * scale, favorites=6000 * scale,
+        seed=seed, days_back=60, log=lambda message: None
+    )
+    prefix = generate_data.USER_PREFIX
+    club_events = {}
+    for event_id, club_name in conn.execute(
+        'SELECT e.id, u.username FROM events e JOIN users u ON e.club_id = u.id WHERE u.username LIKE ?',
+        (prefix + 'club%',)
+    ):
+        club_events.setdefault(club_name, []).append(event_id)
+    upcoming_events = [row[0] for row in conn.execute(
+        "SELECT id FROM events WHERE status = 'upcoming' AND registered_count < max_participants"
+    )]
+    students = [row[0] for row in conn.execute(
+        "SELECT username FROM users WHERE role = 'student' AND username LIKE ?", (prefix + 'student%',)
+    )]
+    return {
+        'students': students,
+        'club_events': club_events,
+        'upcoming_events': upcoming_events,
+        'counts': counts,
+    }
+
+class Recorder:
+    """线程安全地收集各路由的延迟（毫秒）"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, elapsed, status):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed * 1000)
+            if status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+class ClientSession:
+    """Flask测试客户端"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        response.get_data()
+        return response.status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class HttpSession:
+    """带Cookie的真实HTTP客户端，不跟随重定向（只计当前路由的耗时）"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+        except (http.client.HTTPException, OSError):
+            # 连接被服务端中断，计为错误
+            return 599
+
+    def get(self, path):
+        return self._open(self.base_url + path)
+
+    def post(self, path, data):
+        return self._open(urllib.request.Request(
+            self.base_url + path, data=urllib.parse.urlencode(data).encode('utf-8')
+        ))
+
+def timed(recorder, route, call, *args):
+    start = time.perf_counter()
+    status = call(*args)
+    recorder.record(route, time.perf_counter() - start, status)
+
+def run_operation(name, student_session, club_session, club_name, context, rnd, recorder):
+    """执行一次负载操作（报名/取消报名算两个请求）"""
+    if name == 'student_dashboard':
+        timed(recorder, 'student_dashboard', student_session.get, '/dashboard')
+    elif name == 'search':
+        query = urllib.parse.urlencode({'q': rnd.choice(SEARCH_TERMS)})
+        timed(recorder, 'search', student_session.get, f'/search_events?{query}')
+    elif name == 'register_cancel':
+        event_id = rnd.choice(context['upcoming_events'])
+        timed(recorder, 'register', student_session.get, f'/register_event/{event_id}')
+        timed(recorder, 'cancel', student_session.get, f'/cancel_registration/{event_id}')
+    elif name == 'club_report':
+        event_id = rnd.choice(context['club_events'][club_name])
+        timed(recorder, 'club_report', club_session.get, f'/event_report/{event_id}')
+    elif name == 'csv_export':
+        event_id = rnd.choice(context['club_events'][club_name])
+        timed(recorder, 'csv_export', club_session.get, f'/export_event_data/{event_id}')
+
+def run_workload(make_session, context, total, concurrency, seed):
+    """用concurrency个客户端并发执行total次操作，返回 (记录器, 总耗时秒)"""
+    recorder = Recorder()
+    names = list(WORKLOAD)
+    weights = [WORKLOAD[name] for name in names]
+    remaining = [total]
+    lock = threading.Lock()
+
+    def worker(index):
+        rnd = random.Random(seed + index)
+        student_name = rnd.choice(context['students'])
+        club_name = rnd.choice(sorted(context['club_events']))
+        student_session, club_session = make_session(), make_session()
+        student_session.post('/login', {'username': student_name, 'password': PASSWORD})
+        club_session.post('/login', {'username': club_name, 'password': PASSWORD})
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            name = rnd.choices(names, weights)[0]
+            run_operation(name, student_session, club_session, club_name, context, rnd, recorder)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start
+
+def percentile(sorted_values, p):
+    """最近秩法求百分位数"""
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize(recorder, elapsed):
+    """把延迟记录汇总成 路由 -> 统计值"""
+    results = {}
+    all_latencies = []
+    for route, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        all_latencies.extend(values)
+        results[route] = {
+            'count': len(values),
+            'errors': recorder.errors.get(route, 0),
+            'p50_ms': round(percentile(values, 50), 2),
+            'p95_ms': round(percentile(values, 95), 2),
+            'p99_ms': round(percentile(values, 99), 2),
+            'rps': round(len(values) / elapsed, 1),
+        }
+    all_latencies.sort()
+    if all_latencies:
+        results['ALL'] = {
+            'count': len(all_latencies),
+            'errors': sum(recorder.errors.values()),
+            'p50_ms': round(percentile(all_latencies, 50), 2),
+            'p95_ms': round(percentile(all_latencies, 95), 2),
+            'p99_ms': round(percentile(all_latencies, 99), 2),
+            'rps': round(len(all_latencies) / elapsed, 1),
+        }
+    return results
+
+def print_results(title, results):
+    print(f"\n== {title} ==")
+    print(f"{'路由':<20}{'请求数':>8}{'错误':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'req/s':>10}")
+    for route, stats in results.items():
+        print(f"{route:<20}{stats['count']:>8}{stats['errors']:>6}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['rps']:>10.1f}")
+
+def compare_with_baseline(mode, results, baseline, tolerance):
+    """与基线比较p95，返回回退的路由数"""
+    previous = baseline.get('results', {}).get(mode)
+    if not previous:
+        print(f"（基线中没有 {mode} 模式的结果，跳过比较）")
+        return 0
+    regressions = 0
+    for route, stats in results.items():
+        old = previous.get(route)
+        if not old:
+            continue
+        ratio = stats['p95_ms'] / old['p95_ms'] if old['p95_ms'] else 1
+        if ratio > 1 + tolerance:
+            regressions += 1
+            print(f"❌ {mode} {route}: p95 {old['p95_ms']:.2f}ms -> {stats['p95_ms']:.2f}ms (+{(ratio - 1) * 100:.0f}%)")
+    if not regressions:
+        print(f"✓ {mode} 模式各路由p95均未超过基线 {tolerance * 100:.0f}%")
+    return regressions
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(app):
+    """在后台线程中以 app.run(threaded=True) 启动应用，返回基础URL"""
+    port = free_port()
+    thread = threading.Thread(
+        target=app.run,
+        kwargs={'host': '127.0.0.1', 'port': port, 'threaded': True, 'debug': False, 'use_reloader': False},
+        daemon=True
+    )
+    thread.start()
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base_url + '/health', timeout=1).read()
+            return base_url
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('测试服务器启动失败')
+
+def start_prefork_server(workers):
+    """以子进程启动 serve.py（使用当前目录的数据库），返回 (进程, 基础URL)"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, 'serve.py'), '--host', '127.0.0.1',
+         '--port', str(port), '--workers', str(workers), '--quiet'],
+        env=dict(os.environ, CAMPUS_DATABASE=os.path.abspath(models.DATABASE), PYTHONPATH=BASE_DIR),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(base_url + '/health', timeout=1).read()
+            return process, base_url
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('serve.py 启动失败')
+
+# 同一页面的同步版与异步版
+DASHBOARD_VARIANTS = (('threaded', '/dashboard'), ('async', '/dashboard/async'))
+
+def run_dashboard_comparison(make_session, context, total, concurrency, seed):
+    """concurrency个学生客户端并发请求仪表盘的各个版本（各total次），返回 版本 -> 汇总结果"""
+    results = {}
+    for name, path in DASHBOARD_VARIANTS:
+        recorder = Recorder()
+        remaining = [total]
+        lock = threading.Lock()
+
+        def worker(index):
+            session = make_session()
+            student = random.Random(seed + index).choice(context['students'])
+            session.post('/login', {'username': student, 'password': PASSWORD})
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                timed(recorder, name, session.get, path)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[name] = summarize(recorder, time.perf_counter() - start)[name]
+    return results
+
+def run_worker_scaling(context, worker_counts, total, concurrency, seed):
+    """依次用不同的worker数启动serve.py并回放相同的负载，返回 worker数 -> 汇总结果"""
+    results = {}
+    for workers in worker_counts:
+        process, base_url = start_prefork_server(workers)
+        try:
+            recorder, elapsed = run_workload(lambda: HttpSession(base_url), context, total,
+                                             concurrency, seed)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        results[workers] = summarize(recorder, elapsed)
+    return results
+
+def print_scaling(results):
+    print("\n== 多进程扩展（serve.py） ==")
+    print(f"{'worker数':<10}{'请求数':>8}{'错误':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'req/s':>10}{'加速比':>8}")
+    base_rps = None
+    for workers, stats in results.items():
+        total = stats['ALL']
+        base_rps = base_rps or total['rps']
+        print(f"{workers:<10}{total['count']:>8}{total['errors']:>6}{total['p50_ms']:>10.2f}"
+              f"{total['p95_ms']:>10.2f}{total['rps']:>10.1f}{total['rps'] / base_rps:>8.2f}")
+    print(f"（本机 {os.cpu_count()} 个CPU核心，worker数超过核心数后吞吐不再增长）")
+
+def create_surge_events(count, capacity):
+    """新建count个同时开放报名的活动（一周后开始，容量capacity），返回活动id列表"""
+    conn = sqlite3.connect(models.DATABASE)
+    club_id = conn.execute("SELECT id FROM users WHERE role = 'club' ORDER BY id LIMIT 1").fetchone()[0]
+    start = datetime.now() + timedelta(days=7)
+    event_ids = []
+    for i in range(count):
+        cursor = conn.execute('''
+            INSERT INTO events (title, description, date_time, end_time, location, max_participants, club_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (f'开放报名压测{i + 1}', '高峰模式压测', start.strftime(models.EVENT_TIME_FORMAT),
+              (start + timedelta(hours=2)).strftime(models.EVENT_TIME_FORMAT), '体育馆', capacity, club_id))
+        event_ids.append(cursor.lastrowid)
+    conn.commit()
+    conn.close()
+    return event_ids
+
+def run_registration_surge(app, base_url, context, total, concurrency, seed, surge):
+    """模拟开放报名：concurrency个学生同时开始，依次报名一批新活动，共total次报名
+
+    返回延迟统计以及实际写入的报名数（失败的报名只会重定向并提示，按写入数计算成功与失败）。
+    """
+    app.config['REGISTRATION_SURGE_MODE'] = surge
+    name = 'surge' if surge else 'direct'
+    event_ids = create_surge_events(math.ceil(total / concurrency), concurrency)
+    students = random.Random(seed).sample(context['students'], concurrency)
+    recorder = Recorder()
+    remaining = [total]
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        session = HttpSession(base_url)
+        session.post('/login', {'username': students[index], 'password': PASSWORD})
+        barrier.wait()
+        for event_id in event_ids:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            timed(recorder, name, session.get, f'/register_event/{event_id}')
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(models.DATABASE)
+    registered = conn.execute(
+        f"SELECT COUNT(*) FROM registrations WHERE event_id IN ({','.join('?' * len(event_ids))})", event_ids
+    ).fetchone()[0]
+    conn.close()
+    stats = summarize(recorder, elapsed)[name]
+    stats.update(registered=registered, failed=stats['count'] - registered,
+                 registrations_per_s=round(registered / elapsed, 1))
+    if surge:
+        import app as app_module
+        stats['avg_batch_size'] = app_module.get_registration_queue().stats()['avg_batch_size']
+    return stats
+
+def print_surge(results, concurrency):
+    print(f"\n== 开放报名高峰（真实HTTP，{concurrency} 个学生同时报名） ==")
+    print(f"{'模式':<10}{'请求数':>8}{'成功':>8}{'失败':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+          f"{'报名/秒':>10}{'平均批大小':>10}")
+    for name, stats in results.items():
+        print(f"{name:<10}{stats['count']:>8}{stats['registered']:>8}{stats['failed']:>6}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['registrations_per_s']:>10.1f}"
+              f"{stats.get('avg_batch_size', 1):>10}")
+
+def prepare_app(scale):
+    """在临时目录中建立合成数据库并导入应用，返回 (app, 压测上下文)"""
+    work_dir = tempfile.mkdtemp(prefix='campus_bench_')
+    os.chdir(work_dir)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        models.init_db()
+        conn = sqlite3.connect(models.DATABASE)
+        context = populate(conn, scale)
+        conn.close()
+        # 应用要求设置密钥；写入环境变量，子进程启动的serve.py也使用同一个
+        os.environ.setdefault('CAMPUS_SECRET_KEY', secrets.token_hex(32))
+        from app import create_app
+        app = create_app({'STATUS_UPDATER': False})
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    return app, context
+
+def main():
+    parser = argparse.ArgumentParser(description='校园活动系统压测')
+    parser.add_argument('--mode', choices=('client', 'http', 'both', 'workers', 'async', 'surge'), default='both')
+    parser.add_argument('--scale', type=int, default=1, help='数据规模倍数（1倍为400个活动、2000名学生、2.5万条报名）')
+    parser.add_argument('-n', '--requests', type=int, default=400, help='每种模式执行的操作数')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='真实HTTP模式的并发客户端数')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='p95允许超过基线的比例')
+    parser.add_argument('--workers', default='1,2,4,8', help='workers模式依次测试的worker数')
+    parser.add_argument('--batch-size', type=int, help='surge模式：每批最多提交的报名数')
+    parser.add_argument('--max-delay-ms', type=float, help='surge模式：凑批的最长等待毫秒数')
+    args = parser.parse_args()
+
+    print(f"准备合成数据库（规模 {args.scale}）...")
+    app, context = prepare_app(args.scale)
+    print(f"✓ {context['counts']['events']} 个活动，{context['counts']['registrations']} 条报名，"
+          f"{context['counts']['reviews']} 条评价")
+
+    if args.mode == 'workers':
+        worker_counts = [int(value) for value in args.workers.split(',')]
+        print_scaling(run_worker_scaling(context, worker_counts, args.requests, args.concurrency, args.seed))
+        return 0
+
+    if args.mode == 'async':
+        import app as app_module
+        if app_module.async_views is None:
+            print("❌ 未安装 aiosqlite 或 asgiref，无法测试异步仪表盘")
+            return 1
+        base_url = start_server(app)
+        results = run_dashboard_comparison(lambda: HttpSession(base_url), context, args.requests,
+                                           args.concurrency, args.seed)
+        print_results(f'学生仪表盘（真实HTTP，{args.concurrency} 个并发客户端）', results)
+        return 0
+
+    if args.mode == 'surge':
+        if args.batch_size:
+            app.config['SURGE_BATCH_SIZE'] = args.batch_size
+        if args.max_delay_ms is not None:
+            app.config['SURGE_MAX_DELAY_MS'] = args.max_delay_ms
+        base_url = start_server(app)
+        results = {}
+        for surge in (False, True):
+            stats = run_registration_surge(app, base_url, context, args.requests, args.concurrency,
+                                           args.seed, surge)
+            results['surge' if surge else 'direct'] = stats
+        print_surge(results, args.concurrency)
+        print(f"（高峰模式：每批最多 {app.config['SURGE_BATCH_SIZE']} 条，"
+              f"凑批最多等待 {app.config['SURGE_MAX_DELAY_MS']}ms）")
+        return 0
+
+    results = {}
+    if args.mode in ('client', 'both'):
+        recorder, elapsed = run_workload(lambda: ClientSession(app), context, args.requests, 1, args.seed)
+        results['client'] = summarize(recorder, elapsed)
+        print_results('Flask测试客户端（单线程）', results['client'])
+    if args.mode in ('http', 'both'):
+        base_url = start_server(app)
+        recorder, elapsed = run_workload(lambda: HttpSession(base_url), context, args.requests,
+                                         args.concurrency, args.seed)
+        results['http'] = summarize(recorder, elapsed)
+        print_results(f'真实HTTP（{args.concurrency} 个并发客户端）', results['http'])
+
+    settings = {'scale': args.scale, 'requests': args.requests, 'concurrency': args.concurrency}
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'settings': settings,
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n✓ 基线已保存到 {BASELINE_FILE}")
+        return 0
+
+    if not os.path.exists(BASELINE_FILE):
+        print("\n（没有基线文件，使用 --save-baseline 保存本次结果）")
+        return 0
+    with open(BASELINE_FILE, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print()
+    if baseline.get('settings') != settings:
+        print(f"⚠ 本次参数 {settings} 与基线参数 {baseline.get('settings')} 不同，比较结果仅供参考")
+    regressions = sum(compare_with_baseline(mode, stats, baseline, args.tolerance)
+                      for mode, stats in results.items())
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
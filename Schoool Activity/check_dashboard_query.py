@@ -0,0 +1,228 @@
+# check_dashboard_query.py
+"""校验 models.get_student_dashboard() 与最初版本 dashboard() 的学生仪表盘结果一致
+
+在临时数据库中生成合成数据，对每个学生逐页取完可报名活动，与最初版本（不分页、按events表
+存储的状态查询）的四条SQL比较可报名活动、活动总数、已报名活动、可评价活动和已评价活动数；
+并检查活动行上的is_favorited、waitlist_position与按学生单独查询的结果一致。
+发现差异时返回非0退出码。
+
+用法: python check_dashboard_query.py [--students 300] [--page-size 20]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import generate_data
+import models
+
+STATUS_ORDER = {'ongoing': 1, 'upcoming': 2, 'completed': 3}
+
+# 最初版本的活动表只有这些列；原查询中的 e.* 通过同名临时视图只取这些列，
+# 否则之后添加的registered_count计数列会和子查询算出的registered_count重名
+BASELINE_EVENTS_VIEW_SQL = '''
+    CREATE TEMP VIEW events AS
+    SELECT id, title, description, date_time, end_time, location, max_participants, club_id,
+           status, created_at
+    FROM main.events
+'''
+
+def baseline_update_statuses(conn):
+    """最初版本在每次打开仪表盘前执行的update_event_statuses()：把状态写回events表，原查询依赖存储的状态"""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute('''
+        UPDATE events
+        SET status = 'ongoing'
+        WHERE datetime(date_time) <= datetime(?)
+        AND datetime(end_time) > datetime(?)
+        AND status = 'upcoming'
+    ''', (now, now))
+    conn.execute('''
+        UPDATE events
+        SET status = 'completed'
+        WHERE datetime(end_time) <= datetime(?)
+        AND status IN ('upcoming', 'ongoing')
+    ''', (now,))
+    conn.commit()
+
+def baseline_dashboard(conn, student_id):
+    """最初版本 dashboard() 中学生分支的四条查询（原样保留）"""
+    events = conn.execute('''
+        SELECT e.*, u.username as club_name,
+               (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count,
+               (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id AND r.student_id = ?) as is_registered
+        FROM events e
+        JOIN users u ON e.club_id = u.id
+        WHERE (e.status = 'upcoming' OR e.status = 'ongoing')
+        ORDER BY e.date_time
+    ''', (student_id,)).fetchall()
+
+    # 获取已报名的活动
+    registered_events = conn.execute('''
+        SELECT e.*, u.username as club_name
+        FROM events e
+        JOIN registrations r ON e.id = r.event_id
+        JOIN users u ON e.club_id = u.id
+        WHERE r.student_id = ?
+        ORDER BY
+            CASE
+                WHEN e.status = 'ongoing' THEN 1
+                WHEN e.status = 'upcoming' THEN 2
+                WHEN e.status = 'completed' THEN 3
+                ELSE 4
+            END,
+            e.date_time
+    ''', (student_id,)).fetchall()
+
+    # 获取可评价的活动（已结束且已报名但未评价）
+    reviewable_events = conn.execute('''
+        SELECT e.*, u.username as club_name
+        FROM events e
+        JOIN registrations r ON e.id = r.event_id
+        JOIN users u ON e.club_id = u.id
+        WHERE r.student_id = ?
+        AND e.status = 'completed'
+        AND NOT EXISTS (
+            SELECT 1 FROM reviews rev
+            WHERE rev.event_id = e.id AND rev.student_id = ?
+        )
+    ''', (student_id, student_id)).fetchall()
+
+    # 修复：正确计算已完成评价的数量
+    reviewed_events_count = conn.execute('''
+        SELECT COUNT(DISTINCT r.event_id)
+        FROM reviews r
+        JOIN events e ON r.event_id = e.id
+        WHERE r.student_id = ? AND e.status = 'completed'
+    ''', (student_id,)).fetchone()[0]
+    return {
+        'events': events,
+        'events_total': len(events),
+        'registered_events': registered_events,
+        'reviewable_events': reviewable_events,
+        'reviewed_events_count': reviewed_events_count,
+    }
+
+def current_dashboard(conn, student_id, page_size):
+    """逐页调用get_student_dashboard()直到最后一页，把可报名活动拼在一起，返回 (结果, 页数)"""
+    cursor = None
+    events = []
+    pages = 0
+    while True:
+        data = models.get_student_dashboard(conn, student_id, cursor, page_size)
+        events.extend(data['events'])
+        pages += 1
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    data['events'] = events
+    return data, pages
+
+def project(rows, columns):
+    """只比较原查询返回的列"""
+    return [tuple(row[column] for column in columns) for row in rows]
+
+def compare(old, new):
+    """返回不一致的项目列表"""
+    problems = []
+    for key in ('events_total', 'reviewed_events_count'):
+        if old[key] != new[key]:
+            problems.append(f"{key}: {old[key]!r} != {new[key]!r}")
+
+    for key in ('events', 'registered_events', 'reviewable_events'):
+        rows = old[key]
+        if not rows:
+            if new[key]:
+                problems.append(f"{key}: 原查询为空，新查询 {len(new[key])} 行")
+            continue
+        columns = rows[0].keys()
+        new_rows = new[key]
+        if key == 'events':
+            # 原查询只按开始时间排序，相同时间的先后不确定，新查询再按id排
+            rows = sorted(rows, key=lambda row: (row['date_time'], row['id']))
+        elif key == 'registered_events':
+            rows = sorted(rows, key=lambda row: (STATUS_ORDER.get(row['status'], 4), row['date_time'], row['id']))
+        else:
+            # 原查询没有ORDER BY，按id比较
+            rows = sorted(rows, key=lambda row: row['id'])
+            new_rows = sorted(new_rows, key=lambda row: row['id'])
+        if project(rows, columns) != project(new_rows, columns):
+            problems.append(f"{key}: 结果不同")
+    return problems
+
+def check_annotations(conn, student_id, new):
+    """活动行上的is_favorited、waitlist_position应与按学生单独查询的结果一致"""
+    _, favorited, waitlist = models.get_student_event_ids(conn, student_id)
+    for key in ('events', 'registered_events'):
+        for row in new[key]:
+            if row['is_favorited'] != int(row['id'] in favorited) or row['waitlist_position'] != waitlist.get(row['id']):
+                return [f"{key}: 活动 {row['id']} 的收藏/候补标注不同"]
+    return []
+
+def add_waitlist(conn, student_ids, seed=42):
+    """给部分学生加上候补记录（合成数据不生成候补名单）"""
+    rnd = random.Random(seed)
+    event_ids = [row[0] for row in conn.execute("SELECT id FROM events WHERE status = 'upcoming'")]
+    rows = [(event_id, student_id) for student_id in rnd.sample(student_ids, len(student_ids) // 3)
+            for event_id in rnd.sample(event_ids, min(3, len(event_ids)))]
+    conn.executemany('INSERT OR IGNORE INTO waitlist (event_id, student_id) VALUES (?, ?)', rows)
+    conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='校验单条SQL的学生仪表盘查询')
+    parser.add_argument('--students', type=int, default=300, help='参与比较的学生数')
+    parser.add_argument('--page-size', type=int, default=20)
+    args = parser.parse_args()
+
+    models.DATABASE = os.path.join(tempfile.mkdtemp(), 'dashboard_check.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        models.init_db()
+    conn = sqlite3.connect(models.DATABASE)
+    generate_data.generate(conn, students=args.students, clubs=10, events=150, registrations=args.students * 12,
+                           reviews=args.students * 4, favorites=args.students * 5, days_back=30, days_ahead=30,
+                           log=lambda message: None)
+    # 批量导入使用独占锁模式，重新连接后其他连接才能读写
+    conn.close()
+
+    baseline_conn = sqlite3.connect(models.DATABASE)
+    baseline_conn.row_factory = sqlite3.Row
+    baseline_update_statuses(baseline_conn)
+    baseline_conn.execute(BASELINE_EVENTS_VIEW_SQL)
+
+    conn = sqlite3.connect(models.DATABASE)
+    conn.row_factory = sqlite3.Row
+    student_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'student' ORDER BY id")]
+    add_waitlist(conn, student_ids)
+
+    failures = 0
+    elapsed = {'baseline': 0.0, 'single': 0.0}
+    pages = 0
+    for student_id in student_ids:
+        start = time.perf_counter()
+        old = baseline_dashboard(baseline_conn, student_id)
+        elapsed['baseline'] += time.perf_counter() - start
+        start = time.perf_counter()
+        new, student_pages = current_dashboard(conn, student_id, args.page_size)
+        elapsed['single'] += time.perf_counter() - start
+        pages += student_pages
+
+        problems = compare(old, new) + check_annotations(conn, student_id, new)
+        if problems:
+            failures += 1
+            print(f"❌ 学生 {student_id}: {'; '.join(problems)}")
+    baseline_conn.close()
+    conn.close()
+
+    print(f"共比较 {len(student_ids)} 名学生，发现 {failures} 处不一致")
+    print(f"最初版本（4条SQL，不分页）用时 {elapsed['baseline'] * 1000:.0f}ms，"
+          f"get_student_dashboard()（每页1条SQL，共 {pages} 页）用时 {elapsed['single'] * 1000:.0f}ms")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# check_location_conflicts.py
+"""校验发布/编辑活动时的场地冲突检测：在临时数据库中通过页面发布和编辑活动，
+检查冲突是否被报告、场地占用索引是否与活动的起止时间一致，发现问题时返回非0退出码
+
+用法: python check_location_conflicts.py
+"""
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import models
+
+ROOM = '冲突检测教室'
+DAY = (datetime.now() + timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def at(hour, minute=0):
+    """检测日当天的时间，转成表单使用的格式"""
+    return (DAY + timedelta(hours=hour, minutes=minute)).strftime('%Y-%m-%dT%H:%M')
+
+def create(client, title, start, end, location=ROOM):
+    """通过发布活动页面提交，返回响应页面"""
+    response = client.post('/create_event', data={
+        'title': title, 'description': '', 'date_time': start, 'end_time': end,
+        'location': location, 'max_participants': '10',
+    }, follow_redirects=True)
+    return response.get_data(as_text=True)
+
+def edit(client, event_id, title, start, location=ROOM):
+    """通过编辑活动页面提交，返回响应页面"""
+    response = client.post(f'/edit_event/{event_id}', data={
+        'title': title, 'description': '', 'date_time': start,
+        'location': location, 'max_participants': '10',
+    }, follow_redirects=True)
+    return response.get_data(as_text=True)
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    with contextlib.redirect_stdout(io.StringIO()):
+        from app import create_app
+        app = create_app({'DATABASE': os.path.join(tmp_dir, 'conflict_check.db'), 'STATUS_UPDATER': False,
+                          'TESTING': True})
+    conn = sqlite3.connect(models.DATABASE)
+    club = conn.execute("SELECT username FROM users WHERE role = 'club' ORDER BY id LIMIT 1").fetchone()[0]
+    client = app.test_client()
+    client.post('/login', data={'username': club, 'password': 'password123'})
+
+    def event_id(title):
+        return conn.execute('SELECT id FROM events WHERE title = ?', (title,)).fetchone()[0]
+
+    def slot(title):
+        return conn.execute('''
+            SELECT e.starts_at, e.ends_at, s.starts_at, s.ends_at
+            FROM events e JOIN event_slots s ON s.id = e.id
+            WHERE e.title = ?
+        ''', (title,)).fetchone()
+
+    checks = []
+
+    def check(name, ok):
+        checks.append(ok)
+        print(f"{'✓' if ok else '❌'} {name}")
+
+    check('发布不冲突的活动', '活动发布成功' in create(client, '活动A', at(10), at(12)))
+    check('发布不冲突的活动', '活动发布成功' in create(client, '活动B', at(13), at(14)))
+    check('首尾相接不算冲突', '活动发布成功' in create(client, '活动C', at(12), at(13), ROOM + ' '))
+    check('时间重叠的发布被拒绝', '场地时间冲突' in create(client, '活动D', at(11), at(13)))
+
+    # 把A移到原结束时间之后：结束时间随之平移（12:30~14:30），与B重叠
+    page = edit(client, event_id('活动A'), '活动A', at(12, 30))
+    check('移到原结束时间之后仍能发现重叠', '场地时间冲突' in page and '活动B' in page)
+
+    # 移到空闲时段后，A在索引中的矩形与新的起止时间一致，之后的发布会与它冲突
+    page = edit(client, event_id('活动A'), '活动A', at(15))
+    check('编辑到空闲时段成功', '活动更新成功' in page)
+    starts_at, ends_at, slot_start, slot_end = slot('活动A')
+    check('结束时间随开始时间平移', ends_at - starts_at == 2 * 3600)
+    check('场地占用索引覆盖整个时段', slot_start <= starts_at and slot_end >= ends_at and slot_end > slot_start)
+    check('与移动后的活动重叠的发布被拒绝', '场地时间冲突' in create(client, '活动E', at(16), at(18)))
+    check('其他地点不受影响', '活动发布成功' in create(client, '活动F', at(16), at(18), '另一间教室'))
+
+    conn.close()
+    failures = checks.count(False)
+    print(f"共 {len(checks)} 项检查，{failures} 项失败")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
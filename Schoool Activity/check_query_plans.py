@@ -0,0 +1,307 @@
+# check_query_plans.py
+"""对app.py、models.py、async_views.py中的SQL和数据库中的触发器执行EXPLAIN QUERY PLAN，
+发现热点查询全表扫描时返回非0退出码
+
+用法: python check_query_plans.py [-v]
+"""
+import ast
+import contextlib
+import io
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import models
+
+SOURCE_FILES = ('app.py', 'models.py', 'async_views.py', 'registration_queue.py')
+
+# 允许全表扫描的小表（行数固定且很少）
+SMALL_TABLES = {'event_categories', 'ec', 'sqlite_master'}
+
+# 已知且可以接受的全表扫描：(文件, 函数, 表) -> 原因
+ALLOWED_SCANS = {
+    ('models.py', 'find_location_conflicts', 'e'): '没有R*Tree扩展时的兼容实现，有场地占用索引时不会执行',
+}
+
+# 接收SQL参数的辅助函数：函数名 -> SQL参数的位置
+QUERY_HELPER_FUNCTIONS = {
+    'fetch_keyset_page': 1,
+    'query_batches': 0,
+    'keyset_query': 0,
+    'fetch_all': 0,
+    'fetch_value': 0,
+}
+
+# 不经过路由调用、但同样处在请求路径上的入口函数。
+# 路由函数、这里列出的函数以及它们直接或间接调用（或作为回调引用）的函数都视为热点
+HOT_FUNCTIONS = {
+    ('registration_queue.py', '_commit_batch'): '报名高峰模式的写线程',
+}
+
+def is_request_handler(func):
+    """函数是否被@app.route、@app.errorhandler等装饰"""
+    for decorator in func.decorator_list:
+        if isinstance(decorator, ast.Call):
+            decorator = decorator.func
+        if isinstance(decorator, ast.Attribute) and isinstance(decorator.value, ast.Name):
+            if decorator.value.id == 'app':
+                return True
+    return False
+
+def referenced_names(func):
+    """函数中调用或引用的名字（foo()、models.foo()、self.foo、作为回调传入的foo都记为foo）"""
+    names = set()
+    for node in ast.walk(func):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+    return names
+
+def resolve_sql(node, names):
+    """把SQL参数还原成字符串：支持字符串常量、变量/常量名、models.常量、f-string、+拼接和 `x or '默认值'`，
+    无法还原时返回None
+    """
+    if isinstance(node, ast.Constant):
+        return node.value if isinstance(node.value, str) else None
+    if isinstance(node, ast.Name):
+        return names.get(node.id)
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'models':
+        value = getattr(models, node.attr, None)
+        return value if isinstance(value, str) else None
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.FormattedValue):
+                value = value.value
+            part = resolve_sql(value, names)
+            if part is None:
+                return None
+            parts.append(part)
+        return ''.join(parts)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = resolve_sql(node.left, names)
+        right = resolve_sql(node.right, names)
+        return None if left is None or right is None else left + right
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or):
+        for value in node.values:
+            resolved = resolve_sql(value, names)
+            if resolved is not None:
+                return resolved
+    return None
+
+def module_constants(tree):
+    """模块级的字符串常量：名字 -> 值"""
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            value = resolve_sql(node.value, constants)
+            if value is not None:
+                constants[node.targets[0].id] = value
+    return constants
+
+def names_before(func, lineno, constants):
+    """第lineno行之前函数内最后一次赋值的字符串变量，加上模块级常量"""
+    assignments = sorted(
+        (node.lineno, node.targets[0].id, node.value) for node in ast.walk(func)
+        if isinstance(node, ast.Assign) and len(node.targets) == 1
+        and isinstance(node.targets[0], ast.Name) and node.lineno < lineno
+    )
+    names = dict(constants)
+    for _, name, value in assignments:
+        resolved = resolve_sql(value, names)
+        if resolved is None:
+            names.pop(name, None)
+        else:
+            names[name] = resolved
+    return names
+
+def parse_sources(base_dir):
+    """解析源文件，返回 [(文件名, 语法树)]"""
+    trees = []
+    for filename in SOURCE_FILES:
+        with open(os.path.join(base_dir, filename), encoding='utf-8') as f:
+            trees.append((filename, ast.parse(f.read(), filename=filename)))
+    return trees
+
+def functions(tree):
+    return [node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+
+def hot_functions(trees):
+    """从请求处理函数和HOT_FUNCTIONS出发，沿调用/引用关系找出所有热点函数，返回 {(文件名, 函数名)}"""
+    defined = {}
+    pending = []
+    for filename, tree in trees:
+        for func in functions(tree):
+            defined.setdefault(func.name, []).append((filename, func))
+            if is_request_handler(func) or (filename, func.name) in HOT_FUNCTIONS:
+                pending.append((filename, func))
+
+    for filename, name in HOT_FUNCTIONS:
+        if name not in defined:
+            raise SystemExit(f"❌ HOT_FUNCTIONS中的 {filename}:{name} 不存在，请更新列表")
+
+    hot = set()
+    while pending:
+        filename, func = pending.pop()
+        if (filename, func.name) in hot:
+            continue
+        hot.add((filename, func.name))
+        for name in referenced_names(func):
+            pending.extend(defined.get(name, ()))
+    return hot
+
+def extract_statements(filename, tree, hot):
+    """从源码中提取 (函数名, 行号, SQL, 是否热点)，以及无法还原的SQL参数的 (函数名, 行号)"""
+    constants = module_constants(tree)
+    statements = []
+    unresolved = []
+    for func in functions(tree):
+        for node in ast.walk(func):
+            if not isinstance(node, ast.Call):
+                continue
+            if isinstance(node.func, ast.Attribute) and node.func.attr in ('execute', 'executemany'):
+                position = 0
+            elif isinstance(node.func, ast.Name) and node.func.id in QUERY_HELPER_FUNCTIONS:
+                position = QUERY_HELPER_FUNCTIONS[node.func.id]
+            elif isinstance(node.func, ast.Attribute) and node.func.attr in QUERY_HELPER_FUNCTIONS:
+                position = QUERY_HELPER_FUNCTIONS[node.func.attr]
+            else:
+                continue
+            if len(node.args) <= position:
+                continue
+            # 已发布迁移冻结的定义（*_V1）针对发布时的表结构，在当前结构上无法执行
+            argument = node.args[position]
+            if isinstance(argument, ast.Name) and re.search(r'_V\d+$', argument.id):
+                continue
+            sql = resolve_sql(argument, names_before(func, node.lineno, constants))
+            if sql is None:
+                unresolved.append((func.name, node.lineno))
+                continue
+            statements.append((func.name, node.lineno, sql, (filename, func.name) in hot))
+    return statements, unresolved
+
+def trigger_statements(conn):
+    """数据库中触发器体内的语句（NEW.列、OLD.列换成参数），返回 [(触发器名, SQL)]；写入时都会执行，视为热点"""
+    statements = []
+    for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name"):
+        body = sql[sql.upper().index('BEGIN') + len('BEGIN'):sql.upper().rindex('END')]
+        for statement in body.split(';'):
+            if statement.strip():
+                statements.append((name, re.sub(r'\b(?:NEW|OLD)\.\w+', '?', statement)))
+    return statements
+
+def build_schema(path):
+    """在临时文件中建立完整的表结构（不含示例数据）"""
+    models.DATABASE = path
+    with contextlib.redirect_stdout(io.StringIO()):
+        models.init_db()
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    # 清空示例数据，避免规划器依据实际行数
+    for table in ('favorites', 'reviews', 'registrations', 'event_category_relations', 'events'):
+        cursor.execute(f'DELETE FROM {table}')
+    conn.commit()
+    return conn
+
+def explain(conn, sql):
+    """返回查询计划的detail列表"""
+    stripped = sql.strip()
+    keyword = stripped.split(None, 1)[0].upper()
+    if keyword not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+        return None
+    params = (None,) * stripped.count('?')
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + stripped, params)]
+
+def cte_names(sql):
+    """WITH子句定义的公用表表达式名（包括WITH RECURSIVE和带列名的 name(列, ...) AS）"""
+    return set(re.findall(r'(?:\bWITH(?:\s+RECURSIVE)?|,)\s*(\w+)\s*(?:\([\w\s,]*\))?\s+AS\s*\(',
+                          sql, re.IGNORECASE))
+
+def rtree_tables(conn):
+    """数据库中的R*Tree表名"""
+    return {name for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+            if sql and re.search(r'USING\s+rtree', sql, re.IGNORECASE)}
+
+def full_scans(plan, ctes=(), rtrees=()):
+    """找出计划中对大表的全表扫描，返回 [(表, detail)]"""
+    scans = []
+    for detail in plan:
+        if not detail.startswith('SCAN '):
+            continue
+        table = detail.split()[1]
+        if table in SMALL_TABLES or table == 'CONSTANT':
+            continue
+        # 扫描的是子查询或WITH子句的中间结果，不是表
+        if table.startswith('(subquery-') or table in ctes:
+            continue
+        # 虚拟表（全文索引、R*Tree）带约束的查找，如 VIRTUAL TABLE INDEX 0:M3、INDEX 2:B0D1
+        match = re.search(r'VIRTUAL TABLE INDEX (\d+):(\S*)', detail)
+        if match and match.group(2):
+            continue
+        # R*Tree按id查找显示为 INDEX 1:
+        if match and match.group(1) == '1' and table in rtrees:
+            continue
+        scans.append((table, detail))
+    return scans
+
+def main():
+    verbose = '-v' in sys.argv[1:]
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    tmp_dir = tempfile.mkdtemp()
+    conn = build_schema(os.path.join(tmp_dir, 'plan_check.db'))
+
+    trees = parse_sources(base_dir)
+    hot = hot_functions(trees)
+    statements = []
+    unresolved = []
+    for filename, tree in trees:
+        found, skipped = extract_statements(filename, tree, hot)
+        statements.extend((filename, *statement) for statement in found)
+        unresolved.extend((filename, *statement) for statement in skipped)
+    statements.extend(('触发器', name, 0, sql, True) for name, sql in trigger_statements(conn))
+
+    if verbose:
+        for filename, func_name, lineno in unresolved:
+            print(f"{filename}:{lineno} {func_name}: SQL是动态拼接的，未检查")
+    
+    rtrees = rtree_tables(conn)
+    failures = 0
+    checked = 0
+    for filename, func_name, lineno, sql, is_hot in statements:
+        location = f"{filename}:{lineno}" if lineno else filename
+        try:
+            plan = explain(conn, sql)
+        except sqlite3.Error as e:
+            print(f"❌ {location} {func_name}: SQL无法解析: {e}")
+            failures += 1
+            continue
+        if plan is None:
+            continue
+        checked += 1
+
+        scans = full_scans(plan, cte_names(sql), rtrees)
+        if verbose:
+            print(f"{location} {func_name}{' [热点]' if is_hot else ''}")
+            for detail in plan:
+                print(f"    {detail}")
+        if not is_hot:
+            continue
+
+        for table, detail in scans:
+            reason = ALLOWED_SCANS.get((filename, func_name, table))
+            if reason:
+                print(f"⚠ {location} {func_name}: 已知全表扫描（{reason}）")
+                continue
+            failures += 1
+            print(f"❌ {location} {func_name}: {detail}")
+
+    conn.close()
+    print(f"共检查 {checked} 条SQL（{len(hot)} 个热点函数），{len(unresolved)} 处动态拼接的SQL未检查，发现 {failures} 个问题")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+# generate_data.py
+"""生成大数据量的合成数据，用于在本地复现生产规模的性能问题
+
+用法:
+    python generate_data.py                          # 默认规模：5万学生、500社团、20万活动、500万报名、100万评价
+    python generate_data.py --events 20000 --registrations 500000 --reviews 100000
+    python generate_data.py --database big.db --fresh  # 删除已有文件后重新生成
+
+报名数量按活动热度服从Zipf分布（少数热门活动报名人数很多），评价只出现在已结束的活动上。
+数据先导入数据库的副本，完成后替换原文件，运行前需先停止使用该数据库的应用。
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+import models
+
+PASSWORD = 'password123'
+USER_PREFIX = 'gen_'
+
+TOPICS = ('编程', '摄影', '篮球', '合唱', '街舞', '机器人', '辩论', '绘画', '志愿服务', '创业',
+          '话剧', '足球', '书法', '电竞', '天文', '心理健康', '模拟联合国', '羽毛球', '吉他', '动漫')
+KINDS = ('讲座', '工作坊', '比赛', '分享会', '训练营', '交流会', '展览', '公开课')
+LOCATIONS = ('学术报告厅', '体育馆', '图书馆报告厅', '计算机学院101', '艺术楼201', '学生活动中心',
+             '大学生活动中心多功能厅', '东区操场', '信息楼301', '音乐厅')
+COMMENTS = ('活动很不错', '收获很多', '组织得很好', '内容有点少', '时间安排紧张', '希望多举办', '', '')
+
+# 批量导入时的连接设置：不写日志、不等待落盘、加大缓存
+BULK_PRAGMAS = (
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA locking_mode = EXCLUSIVE',
+)
+
+def zipf_counts(total, buckets, exponent, cap, rnd):
+    """把total个报名按Zipf权重分给buckets个活动（每个活动不超过cap），返回打乱后的数量列表"""
+    weights = [1 / (rank ** exponent) for rank in range(1, buckets + 1)]
+    suffix_sums = [0.0] * (buckets + 1)
+    for i in range(buckets - 1, -1, -1):
+        suffix_sums[i] = suffix_sums[i + 1] + weights[i]
+    
+    # 权重从大到小排列，超过上限的一定是最热门的前几个：它们取上限，其余名额按权重分给剩下的活动
+    capped = 0
+    while capped < buckets and (total - capped * cap) * weights[capped] / suffix_sums[capped] > cap:
+        capped += 1
+    remaining = max(0, total - capped * cap)
+    counts = [cap] * capped + [
+        int(remaining * weights[i] / suffix_sums[capped]) for i in range(capped, buckets)
+    ]
+    # 取整丢掉的名额逐个补给未达上限的热门活动
+    leftover = remaining - sum(counts[capped:])
+    for i in range(capped, min(buckets, capped + leftover)):
+        counts[i] += 1
+    rnd.shuffle(counts)
+    return counts
+
+def prepare_bulk_load(cursor):
+    """删除触发器、二级索引和派生表，导入完成后由finish_bulk_load()统一重建"""
+    for pragma in BULK_PRAGMAS:
+        cursor.execute(pragma).fetchall()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    cursor.execute('DROP TABLE IF EXISTS events_fts')
+    cursor.execute('DROP TABLE IF EXISTS event_search_bigrams')
+    cursor.execute('DROP TABLE IF EXISTS rating_stats')
+    cursor.execute('DROP TABLE IF EXISTS event_slots')
+
+def finish_bulk_load(cursor):
+    """重建索引、触发器、全文索引、短关键词索引、评分汇总和场地占用索引，回填计数列"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        models.upgrade_schema(cursor)
+    models.rebuild_event_counters(cursor)
+    models.rebuild_event_times(cursor)
+    cursor.execute('UPDATE cache_generations SET generation = generation + 1')
+
+def insert_users(cursor, role, count):
+    """批量插入用户，返回新用户的id列表"""
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM users')
+    first_id = cursor.fetchone()[0] + 1
+    cursor.executemany(
+        'INSERT INTO users (id, username, password, role, email) VALUES (?, ?, ?, ?, ?)',
+        ((first_id + i, f'{USER_PREFIX}{role}{i}', PASSWORD, role, f'{USER_PREFIX}{role}{i}@campus.edu')
+         for i in range(count))
+    )
+    return list(range(first_id, first_id + count))
+
+def generate(conn, students=50000, clubs=500, events=200000, registrations=5000000, reviews=1000000,
+             favorites=500000, seed=42, zipf=1.1, days_back=365, days_ahead=60, log=print):
+    """向数据库追加合成数据，返回各表插入的行数
+
+    导入期间删除了触发器、索引和派生表，且journal_mode=OFF下无法可靠回滚；中途失败时
+    也会重建这些结构（已写入的数据保留，计数列等按现有数据回填），然后重新抛出异常。
+    """
+    cursor = conn.cursor()
+    prepare_bulk_load(cursor)
+    try:
+        counts = insert_rows(conn, cursor, students, clubs, events, registrations, reviews, favorites,
+                             random.Random(seed), zipf, days_back, days_ahead, log)
+    finally:
+        step_start = time.perf_counter()
+        finish_bulk_load(cursor)
+        conn.commit()
+        # 导入完成后恢复应用使用的WAL模式
+        conn.execute('PRAGMA journal_mode = WAL').fetchone()
+        log(f"✓ 重建索引、触发器、全文索引和汇总数据 ({time.perf_counter() - step_start:.1f}s)")
+    return counts
+
+def insert_rows(conn, cursor, students, clubs, events, registrations, reviews, favorites,
+                rnd, zipf, days_back, days_ahead, log):
+    """插入各表的合成数据（在prepare_bulk_load()之后调用），返回各表插入的行数"""
+    now = datetime.now()
+    counts = {}
+
+    step_start = time.perf_counter()
+    club_ids = insert_users(cursor, 'club', clubs)
+    student_ids = insert_users(cursor, 'student', students)
+    counts['users'] = clubs + students
+    log(f"✓ 用户 {counts['users']} 个 ({time.perf_counter() - step_start:.1f}s)")
+
+    # 活动：开始时间均匀分布在过去days_back天到未来days_ahead天之间，社团的活跃程度也有偏斜
+    step_start = time.perf_counter()
+    per_event = zipf_counts(registrations, events, zipf, max(1, int(students * 0.8)), rnd)
+    club_weights = [1 / (rank ** 0.8) for rank in range(1, clubs + 1)]
+    event_clubs = rnd.choices(club_ids, club_weights, k=events)
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM events')
+    first_event_id = cursor.fetchone()[0] + 1
+    event_info = []
+
+    def event_rows():
+        for i in range(events):
+            start = now + timedelta(hours=rnd.randint(-days_back * 24, days_ahead * 24 - 1), minutes=rnd.choice((0, 30)))
+            end = start + timedelta(hours=rnd.choice((1, 2, 2, 3, 4)))
+            created = start - timedelta(days=rnd.randint(3, 30))
+            status = 'completed' if end <= now else ('ongoing' if start <= now else 'upcoming')
+            if status == 'upcoming' and rnd.random() < 0.02:
+                status = 'cancelled'
+            # 报名人数不超过上限；未开始的活动留一些空位
+            capacity = max(20, int(per_event[i] * rnd.uniform(1.0, 1.5)) + 5)
+            event_info.append((first_event_id + i, status, int(created.timestamp()), int(start.timestamp())))
+            title = f'{rnd.choice(TOPICS)}{rnd.choice(KINDS)} 第{i + 1}期'
+            yield (first_event_id + i, title, f'{title}，欢迎同学们参加。',
+                   start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'),
+                   rnd.choice(LOCATIONS), capacity, event_clubs[i], status,
+                   created.strftime('%Y-%m-%d %H:%M:%S'))
+
+    cursor.executemany('''
+        INSERT INTO events (id, title, description, date_time, end_time, location, max_participants,
+                            club_id, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', event_rows())
+    counts['events'] = events
+    log(f"✓ 活动 {events} 个 ({time.perf_counter() - step_start:.1f}s)")
+
+    step_start = time.perf_counter()
+    cursor.execute('SELECT id FROM event_categories')
+    category_ids = [row[0] for row in cursor.fetchall()]
+    if category_ids:
+        cursor.executemany(
+            'INSERT OR IGNORE INTO event_category_relations (event_id, category_id) VALUES (?, ?)',
+            ((event_id, category_id)
+             for event_id, _, _, _ in event_info
+             for category_id in rnd.sample(category_ids, rnd.randint(1, min(2, len(category_ids)))))
+        )
+    log(f"✓ 活动分类关联 ({time.perf_counter() - step_start:.1f}s)")
+
+    # 报名：每个活动的报名人数来自Zipf分配，报名时间在活动发布到开始之间
+    step_start = time.perf_counter()
+    completed = {event_id for event_id, status, _, _ in event_info if status == 'completed'}
+    completed_registrations = sum(per_event[i] for i, info in enumerate(event_info) if info[0] in completed)
+    review_rate = min(1.0, reviews / completed_registrations) if completed_registrations else 0
+    review_rows = []
+
+    def registration_rows():
+        for i, (event_id, status, created, start) in enumerate(event_info):
+            window = max(1, min(start, int(now.timestamp())) - created)
+            registrants = rnd.sample(student_ids, per_event[i])
+            if event_id in completed and review_rate:
+                quality = rnd.uniform(2.5, 4.8)
+                review_rows.extend(
+                    (student_id, event_id,
+                     min(5, max(1, round(rnd.gauss(quality, 0.8)))),
+                     min(5, max(1, round(rnd.gauss(quality, 0.9)))),
+                     rnd.choice(COMMENTS), start + 7200 + rnd.randint(0, 7 * 86400))
+                    for student_id in registrants if rnd.random() < review_rate
+                )
+            for student_id in registrants:
+                yield student_id, event_id, created + int(rnd.random() * window)
+
+    cursor.executemany('''
+        INSERT INTO registrations (student_id, event_id, registered_at)
+        VALUES (?, ?, datetime(?, 'unixepoch'))
+    ''', registration_rows())
+    counts['registrations'] = sum(per_event)
+    log(f"✓ 报名 {counts['registrations']} 条 ({time.perf_counter() - step_start:.1f}s)")
+
+    step_start = time.perf_counter()
+    cursor.executemany('''
+        INSERT INTO reviews (student_id, event_id, content_score, organization_score, comment, reviewed_at)
+        VALUES (?, ?, ?, ?, ?, datetime(?, 'unixepoch'))
+    ''', review_rows)
+    counts['reviews'] = len(review_rows)
+    del review_rows[:]
+    log(f"✓ 评价 {counts['reviews']} 条 ({time.perf_counter() - step_start:.1f}s)")
+
+    # 收藏：热门活动被收藏得更多
+    step_start = time.perf_counter()
+    event_weights = [count + 1 for count in per_event]
+    favorite_events = rnd.choices([info[0] for info in event_info], event_weights, k=favorites)
+    changes_before = conn.total_changes
+    cursor.executemany(
+        'INSERT OR IGNORE INTO favorites (student_id, event_id) VALUES (?, ?)',
+        ((rnd.choice(student_ids), event_id) for event_id in favorite_events)
+    )
+    counts['favorites'] = conn.total_changes - changes_before
+    log(f"✓ 收藏 {counts['favorites']} 条 ({time.perf_counter() - step_start:.1f}s)")
+    return counts
+
+def copy_database(source_path, target_path):
+    """用SQLite在线备份把数据库复制到target_path（已存在时覆盖）"""
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def replace_database(work_path, target_path):
+    """用导入完成的work_path替换target_path
+
+    替换前把目标库的WAL合并回主文件并切到DELETE模式（会删除-wal文件），
+    否则旧的-wal文件会被应用到新文件上。应用还在使用目标库时这一步会因为锁而失败。
+    """
+    if os.path.exists(target_path):
+        conn = sqlite3.connect(target_path, timeout=1)
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            conn.execute('PRAGMA journal_mode = DELETE').fetchone()
+        finally:
+            conn.close()
+    os.replace(work_path, target_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='生成校园活动系统的大规模合成数据')
+    parser.add_argument('--database', default=models.DATABASE, help='数据库文件（默认 campus_events.db）')
+    parser.add_argument('--fresh', action='store_true', help='删除已有数据库文件后重新建表')
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--clubs', type=int, default=500)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--registrations', type=int, default=5000000)
+    parser.add_argument('--reviews', type=int, default=1000000)
+    parser.add_argument('--favorites', type=int, default=500000)
+    parser.add_argument('--zipf', type=float, default=1.1, help='活动热度的Zipf指数，越大越集中')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.fresh and os.path.exists(args.database):
+        os.remove(args.database)
+    models.DATABASE = args.database
+    if not os.path.exists(args.database):
+        print("建立数据库表结构...")
+        with contextlib.redirect_stdout(io.StringIO()):
+            models.init_db()
+
+    total_start = time.perf_counter()
+    # 在副本上导入，全部完成后再替换原文件；中途失败时原数据库保持不变
+    work_path = args.database + '.generating'
+    copy_database(args.database, work_path)
+    conn = sqlite3.connect(work_path)
+    try:
+        models.migrate_schema(conn)
+        generate(conn, students=args.students, clubs=args.clubs, events=args.events,
+                 registrations=args.registrations, reviews=args.reviews, favorites=args.favorites,
+                 seed=args.seed, zipf=args.zipf)
+        conn.close()
+        replace_database(work_path, args.database)
+    except Exception as e:
+        conn.close()
+        if os.path.exists(work_path):
+            os.remove(work_path)
+        print(f"❌ 生成数据失败，原数据库未改动: {e}")
+        return 1
+    print(f"🎉 数据生成完成，用时 {time.perf_counter() - total_start:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# metrics.py
+"""请求级性能指标：按路由统计延迟直方图、每个请求的SQL条数和SQL耗时，
+以Prometheus文本格式暴露在 /metrics，并在响应头Server-Timing中返回当前请求的数据
+
+指标保存在进程内存中，多进程部署时每个进程分别统计。
+"""
+import threading
+import time
+
+from flask import g, request
+
+# 请求耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 每个请求SQL条数直方图的桶，条数随列表长度增长的路由（N+1查询）会落在高位的桶里
+SQL_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+class Histogram:
+    """累积直方图（Prometheus语义：每个桶统计小于等于上界的观测数）"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+class RequestMetrics:
+    """各路由的请求指标"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}       # (endpoint, method, status) -> 请求数
+        self.latency = {}        # endpoint -> Histogram（秒）
+        self.sql_queries = {}    # endpoint -> Histogram（每个请求的SQL条数）
+        self.sql_seconds = {}    # endpoint -> SQL总耗时（秒）
+
+    def observe(self, endpoint, method, status, elapsed, sql_count, sql_time):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.sql_queries[endpoint] = Histogram(SQL_COUNT_BUCKETS)
+                self.sql_seconds[endpoint] = 0.0
+            self.latency[endpoint].observe(elapsed)
+            self.sql_queries[endpoint].observe(sql_count)
+            self.sql_seconds[endpoint] += sql_time
+
+    def render(self):
+        """输出Prometheus文本格式"""
+        lines = []
+        with self.lock:
+            lines.append('# HELP campus_http_requests_total 请求数')
+            lines.append('# TYPE campus_http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'campus_http_requests_total{{endpoint="{endpoint}",method="{method}",'
+                             f'status="{status}"}} {count}')
+
+            self._render_histograms(lines, 'campus_http_request_duration_seconds',
+                                    '请求处理耗时（流式响应只计到开始输出为止）', self.latency)
+            self._render_histograms(lines, 'campus_sql_queries_per_request',
+                                    '每个请求执行的SQL条数', self.sql_queries)
+
+            lines.append('# HELP campus_sql_duration_seconds_total SQL执行总耗时')
+            lines.append('# TYPE campus_sql_duration_seconds_total counter')
+            for endpoint, seconds in sorted(self.sql_seconds.items()):
+                lines.append(f'campus_sql_duration_seconds_total{{endpoint="{endpoint}"}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines, name, help_text, histograms):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+def init_app(app, metrics=None):
+    """给应用注册请求计时钩子和 /metrics 路由，返回使用的RequestMetrics"""
+    metrics = metrics or RequestMetrics()
+    app.config.setdefault('METRICS_ENABLED', True)
+
+    @app.before_request
+    def start_request_timer():
+        g._request_start = time.perf_counter()
+        g._sql_count = 0
+        g._sql_time = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('_request_start')
+        if start is None or not app.config['METRICS_ENABLED']:
+            return response
+        elapsed = time.perf_counter() - start
+        sql_count = g.get('_sql_count', 0)
+        sql_time = g.get('_sql_time', 0.0)
+
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint != 'metrics':
+            metrics.observe(endpoint, request.method, response.status_code, elapsed, sql_count, sql_time)
+        response.headers.add(
+            'Server-Timing',
+            f'sql;dur={sql_time * 1000:.2f};desc="{sql_count} queries", app;dur={elapsed * 1000:.2f}'
+        )
+        return response
+
+    def metrics_endpoint():
+        """Prometheus指标"""
+        if not app.config['METRICS_ENABLED']:
+            return '指标收集未开启', 404
+        return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    return metrics
@@ -0,0 +1,46 @@
+# migrate_db.py
+"""查看数据库结构版本并执行未完成的迁移（替代原来删库重建的fix_database脚本，不会删除已有数据）
+
+用法: python migrate_db.py [--database campus_events.db] [--status]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+import models
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库结构迁移')
+    parser.add_argument('--database', default=models.DATABASE)
+    parser.add_argument('--status', action='store_true', help='只显示版本和待执行的迁移')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"❌ 数据库文件不存在: {args.database}（新建数据库请运行 python models.py）")
+        return 1
+
+    conn = sqlite3.connect(args.database)
+    try:
+        current = models.schema_version(conn)
+        pending = [(version, description) for version, description, _ in models.MIGRATIONS
+                   if version > current]
+        print(f"当前结构版本: {current}，最新版本: {models.SCHEMA_VERSION}")
+        for version, description in pending:
+            print(f"  待执行 {version}: {description}")
+        if args.status or not pending:
+            if not pending:
+                print("✓ 数据库结构已是最新")
+            return 0
+
+        applied = models.migrate_schema(conn)
+        print(f"🎉 完成 {applied} 项迁移")
+        return 0
+    except Exception as e:
+        print(f"❌ 迁移失败，已回滚未完成的迁移: {e}")
+        return 1
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,253 @@
 import sqlite3
 from datetime import datetime, timedelta
+import calendar
 import random
 import os
+import threading
+import time
+import json
+import base64
+from enum import Enum
 
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect('campus_events.db', check_same_thread=False)
+from slow_queries import SlowQueryLog
+
+try:
+    from flask import g, has_app_context
+except ImportError:
+    # 脚本环境下没有Flask，退化为每次新建连接
+    g = None
+    def has_app_context():
+        return False
+
+DATABASE = 'campus_events.db'
+
+# 每个连接建立时执行一次的PRAGMA
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',      # 读写互不阻塞
+    'PRAGMA synchronous=NORMAL',    # WAL模式下足够安全，减少fsync
+    'PRAGMA busy_timeout=5000',     # 写锁冲突时最多等待5秒
+    'PRAGMA cache_size=-16000',     # 页缓存约16MB
+    'PRAGMA temp_store=MEMORY',
+)
+
+# 慢查询日志，默认关闭，由enable_slow_query_log()开启
+slow_query_log = None
+
+def enable_slow_query_log(path, threshold_ms=100):
+    """开启慢查询日志：超过threshold_ms毫秒的SQL写入path（JSONL，按大小轮转）"""
+    global slow_query_log
+    slow_query_log = SlowQueryLog(path, threshold_ms)
+    return slow_query_log
+
+def _record_sql(cursor, sql, parameters, elapsed):
+    """把一条SQL的耗时累计到当前请求上（供metrics统计SQL条数和总耗时），慢查询写入日志"""
+    if slow_query_log is not None:
+        slow_query_log.record(cursor.connection, sql, parameters, elapsed)
+    record_request_sql(elapsed)
+
+def record_request_sql(elapsed):
+    """把一条SQL的耗时累计到当前请求上；不在应用上下文中时忽略"""
+    if not has_app_context():
+        return
+    g._sql_count = g.get('_sql_count', 0) + 1
+    g._sql_time = g.get('_sql_time', 0.0) + elapsed
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """记录每条SQL执行耗时的游标"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(self, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # 批量执行只记录语句，不记录各组参数
+            _record_sql(self, sql, None, time.perf_counter() - start)
+
+class PooledConnection(sqlite3.Connection):
+    """连接池中的连接：请求内调用close()只是空操作，请求结束时统一归还连接池"""
+
+    pooled = False
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute()不经过cursor()，这里改为通过带统计的游标执行
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pooled:
+            return
+        super().close()
+
+    def force_close(self):
+        """真正关闭底层连接"""
+        self.pooled = False
+        super().close()
+
+def _connect(database=None):
+    """新建连接并应用PRAGMA设置"""
+    conn = sqlite3.connect(database or DATABASE, check_same_thread=False,
+                           factory=PooledConnection)
     conn.row_factory = sqlite3.Row  # 使返回的行像字典一样工作
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+class ConnectionPool:
+    """SQLite连接池，连接只在第一次创建时执行PRAGMA，之后在请求间复用
+
+    SQLite连接不能跨fork使用：fork出的子进程丢弃继承来的空闲连接，自己新建连接。
+    """
+
+    def __init__(self, database=None, max_idle=8):
+        self.database = database
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        # 继承自父进程的连接只保留引用不关闭，关闭会释放父进程仍在使用的文件锁
+        self._inherited = []
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """在fork出的子进程中执行（此时子进程只有一个线程）"""
+        self._inherited.extend(self._idle)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取出一个空闲连接，没有则新建"""
+        with self._lock:
+            if self._idle:
+                conn = self._idle.pop()
+                conn.pooled = True
+                return conn
+        conn = _connect(self.database)
+        conn.pooled = True
+        return conn
+
+    def release(self, conn):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.force_close()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.force_close()
+
+    def close_all(self):
+        """关闭所有空闲连接（重建数据库文件前调用）"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.force_close()
+
+db_pool = ConnectionPool()
+
+def set_database(path):
+    """切换数据库文件，关闭连接池中指向旧文件的连接"""
+    global DATABASE
+    DATABASE = path
+    db_pool.close_all()
+
+def get_db_connection():
+    """获取数据库连接
+
+    在Flask应用上下文中返回当前请求共用的连接池连接（保存在g中），
+    上下文结束时由release_db_connection()归还；否则新建一个独立连接。
+    """
+    if not has_app_context():
+        return _connect()
+    conn = getattr(g, '_database', None)
+    if conn is None:
+        conn = g._database = db_pool.acquire()
+    return conn
+
+def release_db_connection(exception=None):
+    """归还当前应用上下文占用的连接（注册为teardown_appcontext）"""
+    if not has_app_context():
+        return
+    conn = g.pop('_database', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+def detach_db_connection():
+    """把当前应用上下文占用的连接交给流式响应使用
+
+    Flask在视图返回后、输出响应体之前就会执行teardown归还连接，流式生成器
+    若继续使用g中的连接，会和之后的请求共用同一个连接。取出的连接不再随上下文归还，
+    由生成器结束时调用release_detached_connection()归还。
+    """
+    conn = get_db_connection()
+    if has_app_context():
+        g.pop('_database', None)
+    return conn
+
+def release_detached_connection(conn):
+    """归还detach_db_connection()取出的连接"""
+    if conn.pooled:
+        db_pool.release(conn)
+    else:
+        conn.close()
+
 def close_db_connection(conn):
     """关闭数据库连接"""
     if conn:
         conn.close()
 
+def begin_immediate(conn):
+    """开启写事务并立即取得写锁（BEGIN IMMEDIATE）
+    
+    连接上已有未提交的事务时抛出sqlite3.ProgrammingError，不会替调用方提交；
+    需要并入调用方事务的写入使用register_in_transaction()、promote_waitlist()等不提交的函数。
+    """
+    if conn.in_transaction:
+        raise sqlite3.ProgrammingError('连接上有未提交的事务，不能开启新的写事务')
+    conn.execute('BEGIN IMMEDIATE')
+
 def init_db():
-    """初始化数据库，创建所有表并插入示例数据"""
-    conn = sqlite3.connect('campus_events.db', check_same_thread=False)
+    """初始化数据库：执行全部迁移建立表结构，再插入示例数据"""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False)
     cursor = conn.cursor()
     
     print("开始创建数据库表...")
+    migrate_schema(conn)
+    
+    # 插入初始分类数据
+    insert_initial_categories(cursor)
     
+    # 插入初始用户和示例数据
+    insert_initial_data(cursor)
+    
+    conn.commit()
+    conn.close()
+    print("🎉 数据库初始化完成！")
+
+def create_triggers(cursor, statements):
+    """创建（或重建）触发器：先删除同名触发器再执行CREATE TRIGGER，修改定义后重新执行即可生效"""
+    for sql in statements:
+        name = sql.split('IF NOT EXISTS', 1)[1].split()[0]
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(sql)
+
+def create_base_tables(cursor):
+    """创建基础表；补齐早期数据库缺少的end_time、status列"""
     # 创建用户表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -64,6 +291,22 @@ def init_db():
     ''')
     print("✓ 活动表创建完成")
     
+    # 早期版本的活动表没有结束时间和状态列，结束时间按开始时间后2小时补上
+    cursor.execute("PRAGMA table_info(events)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'end_time' not in columns:
+        cursor.execute('ALTER TABLE events ADD COLUMN end_time TEXT')
+        cursor.execute('''
+            UPDATE events
+            SET end_time = COALESCE(datetime(replace(date_time, 'T', ' '), '+2 hours'), date_time)
+            WHERE end_time IS NULL
+        ''')
+        print("✓ 添加 end_time 列")
+    if 'status' not in columns:
+        cursor.execute("ALTER TABLE events ADD COLUMN status TEXT DEFAULT 'upcoming'")
+        cursor.execute("UPDATE events SET status = 'upcoming' WHERE status IS NULL")
+        print("✓ 添加 status 列")
+    
     # 创建活动-分类关联表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS event_category_relations (
@@ -120,16 +363,1202 @@ def init_db():
         )
     ''')
     print("✓ 收藏表创建完成")
+
+# 活动起止时间的整数列：本地时间按 strftime('%s') 换算的秒数，是由date_time/end_time计算的
+# VIRTUAL生成列（不占存储空间，写入时不需要额外的UPDATE，可以建索引）。
+# 时间范围过滤和排序都用这两列（可以走索引），date_time/end_time只用于显示。
+# 两列不能为空：date_time/end_time无法解析的活动不能写入，所有按 (starts_at, id) 的游标分页口径一致
+EVENT_TIME_COLUMNS = ('starts_at', 'ends_at')
+EVENT_TIME_COLUMN_DEFINITIONS = (
+    ('starts_at', "INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', date_time) AS INTEGER)) VIRTUAL NOT NULL"),
+    ('ends_at', "INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', end_time) AS INTEGER)) VIRTUAL NOT NULL"),
+)
+# date_time/end_time统一保存的格式
+EVENT_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# SQL中与starts_at/ends_at同一口径的当前时间
+SQL_NOW_EPOCH = "CAST(strftime('%s', 'now', 'localtime') AS INTEGER)"
+
+# 迁移9发布时的定义（起止时间是普通列，由触发器回写、可以为NULL），只供迁移9使用，不能修改
+EVENT_TIME_TRIGGERS_SQL_V1 = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_after_insert_times AFTER INSERT ON events
+    BEGIN
+        UPDATE events
+        SET starts_at = CAST(strftime('%s', NEW.date_time) AS INTEGER),
+            ends_at = CAST(strftime('%s', NEW.end_time) AS INTEGER)
+        WHERE id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_after_update_times AFTER UPDATE OF date_time, end_time ON events
+    BEGIN
+        UPDATE events
+        SET starts_at = CAST(strftime('%s', NEW.date_time) AS INTEGER),
+            ends_at = CAST(strftime('%s', NEW.end_time) AS INTEGER)
+        WHERE id = NEW.id;
+    END
+    ''',
+)
+
+EVENT_TIMES_BACKFILL_SQL_V1 = '''
+    UPDATE events
+    SET date_time = COALESCE(datetime(date_time), date_time),
+        end_time = COALESCE(datetime(end_time), end_time),
+        starts_at = CAST(strftime('%s', date_time) AS INTEGER),
+        ends_at = CAST(strftime('%s', end_time) AS INTEGER)
+    WHERE date_time IS NOT COALESCE(datetime(date_time), date_time)
+       OR end_time IS NOT COALESCE(datetime(end_time), end_time)
+       OR starts_at IS NOT CAST(strftime('%s', date_time) AS INTEGER)
+       OR ends_at IS NOT CAST(strftime('%s', end_time) AS INTEGER)
+'''
+
+def event_epoch(value):
+    """把本地时间（datetime）换算成starts_at/ends_at使用的秒数"""
+    return calendar.timegm(value.timetuple())
+
+def epoch_to_datetime(value):
+    """event_epoch()的逆运算"""
+    return datetime(1970, 1, 1) + timedelta(seconds=value)
+
+def rebuild_event_times(cursor):
+    """把date_time/end_time统一为EVENT_TIME_FORMAT格式（修复用），返回修正的活动数；starts_at/ends_at随之重新计算"""
+    cursor.execute('''
+        UPDATE events
+        SET date_time = COALESCE(datetime(date_time), date_time),
+            end_time = COALESCE(datetime(end_time), end_time)
+        WHERE date_time IS NOT COALESCE(datetime(date_time), date_time)
+           OR end_time IS NOT COALESCE(datetime(end_time), end_time)
+    ''')
+    return cursor.rowcount
+
+def fix_unparseable_event_times(cursor):
+    """修正date_time/end_time无法解析的活动：开始时间取创建时间，结束时间取开始时间，返回修正的活动id
     
-    # 插入初始分类数据
-    insert_initial_categories(cursor)
+    这类活动不会出现在任何按时间的列表中，也无法报名；修正后按已结束的活动处理。
+    """
+    cursor.execute('SELECT id FROM events WHERE datetime(date_time) IS NULL OR datetime(end_time) IS NULL ORDER BY id')
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute('''
+        UPDATE events
+        SET date_time = COALESCE(datetime(date_time), datetime(created_at), '1970-01-01 00:00:00')
+        WHERE datetime(date_time) IS NULL
+    ''')
+    cursor.execute('''
+        UPDATE events
+        SET end_time = datetime(date_time)
+        WHERE datetime(end_time) IS NULL
+    ''')
+    return ids
+
+# 读取活动时使用的视图：status列根据存储的起止时间和当前时间推算，
+# 页面读取不再需要先UPDATE events，持久化的状态由后台任务低频写回。
+# stored_status是数据库中保存的状态，推算出的status只可能从它向后推进，
+# 列表查询先用stored_status过滤以便使用索引
+EVENTS_LIVE_VIEW_SQL = f'''
+    CREATE VIEW events_live AS
+    SELECT id, title, description, date_time, end_time, starts_at, ends_at,
+           location, max_participants, club_id,
+           CASE
+               WHEN status IN ('upcoming', 'ongoing')
+                    AND ends_at <= {SQL_NOW_EPOCH} THEN 'completed'
+               WHEN status = 'upcoming'
+                    AND starts_at <= {SQL_NOW_EPOCH} THEN 'ongoing'
+               ELSE status
+           END AS status,
+           status AS stored_status,
+           created_at,
+           registered_count, review_count, content_score_sum, organization_score_sum
+    FROM events
+'''
+
+# 迁移5发布时的视图（按date_time/end_time字符串比较），只供迁移5使用，不能修改
+EVENTS_LIVE_VIEW_SQL_V1 = '''
+    CREATE VIEW events_live AS
+    SELECT id, title, description, date_time, end_time, location, max_participants, club_id,
+           CASE
+               WHEN status IN ('upcoming', 'ongoing')
+                    AND datetime(end_time) <= datetime('now', 'localtime') THEN 'completed'
+               WHEN status = 'upcoming'
+                    AND datetime(date_time) <= datetime('now', 'localtime') THEN 'ongoing'
+               ELSE status
+           END AS status,
+           status AS stored_status,
+           created_at,
+           registered_count, review_count, content_score_sum, organization_score_sum
+    FROM events
+'''
+
+def create_views(cursor, view_sql=EVENTS_LIVE_VIEW_SQL):
+    """创建（或重建）数据库视图"""
+    cursor.execute('DROP VIEW IF EXISTS events_live')
+    cursor.execute(view_sql)
+    print("✓ 活动状态视图创建完成")
+
+# events表上的冗余计数列，由下面的触发器在报名/评价变化时精确维护
+EVENT_COUNTER_COLUMNS = ('registered_count', 'review_count', 'content_score_sum', 'organization_score_sum')
+# 报名数据的版本号：每次报名、取消报名都递增（只增不减），用作报名趋势接口的ETag
+EVENT_VERSION_COLUMNS = ('registration_version',)
+
+COUNTER_TRIGGERS_SQL = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS registrations_after_insert AFTER INSERT ON registrations
+    BEGIN
+        UPDATE events
+        SET registered_count = registered_count + 1,
+            registration_version = registration_version + 1
+        WHERE id = NEW.event_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS registrations_after_delete AFTER DELETE ON registrations
+    BEGIN
+        UPDATE events
+        SET registered_count = registered_count - 1,
+            registration_version = registration_version + 1
+        WHERE id = OLD.event_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS registrations_after_update
+    AFTER UPDATE OF event_id, registered_at ON registrations
+    BEGIN
+        UPDATE events
+        SET registered_count = registered_count - 1,
+            registration_version = registration_version + 1
+        WHERE id = OLD.event_id;
+        UPDATE events
+        SET registered_count = registered_count + 1,
+            registration_version = registration_version + 1
+        WHERE id = NEW.event_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS reviews_after_insert AFTER INSERT ON reviews
+    BEGIN
+        UPDATE events
+        SET review_count = review_count + 1,
+            content_score_sum = content_score_sum + NEW.content_score,
+            organization_score_sum = organization_score_sum + NEW.organization_score
+        WHERE id = NEW.event_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS reviews_after_delete AFTER DELETE ON reviews
+    BEGIN
+        UPDATE events
+        SET review_count = review_count - 1,
+            content_score_sum = content_score_sum - OLD.content_score,
+            organization_score_sum = organization_score_sum - OLD.organization_score
+        WHERE id = OLD.event_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS reviews_after_update
+    AFTER UPDATE OF event_id, content_score, organization_score ON reviews
+    BEGIN
+        UPDATE events
+        SET review_count = review_count - 1,
+            content_score_sum = content_score_sum - OLD.content_score,
+            organization_score_sum = organization_score_sum - OLD.organization_score
+        WHERE id = OLD.event_id;
+        UPDATE events
+        SET review_count = review_count + 1,
+            content_score_sum = content_score_sum + NEW.content_score,
+            organization_score_sum = organization_score_sum + NEW.organization_score
+        WHERE id = NEW.event_id;
+    END
+    ''',
+)
+
+def create_counter_triggers(cursor):
+    """创建（或重建）维护活动计数列的触发器"""
+    create_triggers(cursor, COUNTER_TRIGGERS_SQL)
+    print("✓ 计数器触发器创建完成")
+
+def rebuild_event_counters(cursor):
+    """根据报名表和评价表重新计算所有活动的计数列（回填/修复用），返回修正的活动数"""
+    cursor.execute('''
+        UPDATE events
+        SET registered_count = (SELECT COUNT(*) FROM registrations r WHERE r.event_id = events.id),
+            review_count = (SELECT COUNT(*) FROM reviews rev WHERE rev.event_id = events.id),
+            content_score_sum = (SELECT COALESCE(SUM(rev.content_score), 0)
+                                 FROM reviews rev WHERE rev.event_id = events.id),
+            organization_score_sum = (SELECT COALESCE(SUM(rev.organization_score), 0)
+                                      FROM reviews rev WHERE rev.event_id = events.id)
+        WHERE registered_count != (SELECT COUNT(*) FROM registrations r WHERE r.event_id = events.id)
+           OR review_count != (SELECT COUNT(*) FROM reviews rev WHERE rev.event_id = events.id)
+           OR content_score_sum != (SELECT COALESCE(SUM(rev.content_score), 0)
+                                    FROM reviews rev WHERE rev.event_id = events.id)
+           OR organization_score_sum != (SELECT COALESCE(SUM(rev.organization_score), 0)
+                                         FROM reviews rev WHERE rev.event_id = events.id)
+    ''')
+    return cursor.rowcount
+
+# 评分汇总：每个活动(scope='event')和每个社团(scope='club')一行，保存1~5分的分布，
+# 社团行还保存评价数和两项评分之和，由评价表上的触发器增量维护。活动的评价数和评分之和
+# 已经是events表的计数列，活动行不再重复维护，这几列保持为0
+RATING_SCORES = (1, 2, 3, 4, 5)
+RATING_DIMENSIONS = ('content', 'organization')
+RATING_HISTOGRAM_COLUMNS = tuple(
+    f'{dimension}_{score}' for dimension in RATING_DIMENSIONS for score in RATING_SCORES
+)
+
+RATING_STATS_SQL = f'''
+    CREATE TABLE IF NOT EXISTS rating_stats (
+        scope TEXT NOT NULL, -- 'event' or 'club'
+        scope_id INTEGER NOT NULL,
+        review_count INTEGER NOT NULL DEFAULT 0,
+        content_score_sum INTEGER NOT NULL DEFAULT 0,
+        organization_score_sum INTEGER NOT NULL DEFAULT 0,
+        {', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in RATING_HISTOGRAM_COLUMNS)},
+        PRIMARY KEY (scope, scope_id)
+    ) WITHOUT ROWID
+'''
+
+def _rating_delta(row, sign, totals=True):
+    """生成把一条评价（NEW或OLD）加到/减出汇总行的SET子句；totals=False时只更新分布"""
+    parts = []
+    if totals:
+        parts += [
+            f'review_count = review_count {sign} 1',
+            f'content_score_sum = content_score_sum {sign} {row}.content_score',
+            f'organization_score_sum = organization_score_sum {sign} {row}.organization_score',
+        ]
+    for dimension in RATING_DIMENSIONS:
+        for score in RATING_SCORES:
+            column = f'{dimension}_{score}'
+            parts.append(f'{column} = {column} {sign} ({row}.{dimension}_score = {score})')
+    return ',\n            '.join(parts)
+
+def _rating_apply(row, sign):
+    """生成把一条评价计入/移出其活动和社团汇总行的语句"""
+    sql = '''
+        UPDATE rating_stats SET
+            {histogram}
+        WHERE scope = 'event' AND scope_id = {row}.event_id;
+        UPDATE rating_stats SET
+            {delta}
+        WHERE scope = 'club' AND scope_id = (SELECT club_id FROM events WHERE id = {row}.event_id);
+    '''.format(histogram=_rating_delta(row, sign, totals=False), delta=_rating_delta(row, sign), row=row)
+    if sign == '+':
+        sql = f'''
+        INSERT OR IGNORE INTO rating_stats (scope, scope_id)
+        SELECT 'event', {row}.event_id
+        UNION ALL
+        SELECT 'club', club_id FROM events WHERE id = {row}.event_id;''' + sql
+    return sql.rstrip()
+
+RATING_TRIGGERS_SQL = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS reviews_after_insert_rating AFTER INSERT ON reviews
+    BEGIN{_rating_apply('NEW', '+')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS reviews_after_delete_rating AFTER DELETE ON reviews
+    BEGIN{_rating_apply('OLD', '-')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS reviews_after_update_rating
+    AFTER UPDATE OF event_id, content_score, organization_score ON reviews
+    BEGIN{_rating_apply('OLD', '-')}{_rating_apply('NEW', '+')}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_after_delete_rating AFTER DELETE ON events
+    BEGIN
+        DELETE FROM rating_stats WHERE scope = 'event' AND scope_id = OLD.id;
+    END
+    ''',
+)
+
+def create_rating_stats(cursor):
+    """创建评分汇总表，创建（或重建）其触发器；首次创建时从现有评价回填"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rating_stats'")
+    exists = cursor.fetchone() is not None
     
-    # 插入初始用户和示例数据
-    insert_initial_data(cursor)
+    cursor.execute(RATING_STATS_SQL)
+    create_triggers(cursor, RATING_TRIGGERS_SQL)
+    if not exists:
+        rebuild_rating_stats(cursor)
+    print("✓ 评分汇总表创建完成")
+
+def rebuild_rating_stats(cursor):
+    """根据评价表重新计算全部评分汇总（回填/修复用），返回汇总行数"""
+    histogram = ', '.join(
+        f'SUM(r.{dimension}_score = {score})' for dimension in RATING_DIMENSIONS for score in RATING_SCORES
+    )
+    histogram_columns = ', '.join(RATING_HISTOGRAM_COLUMNS)
+    cursor.execute('DELETE FROM rating_stats')
+    cursor.execute(f'''
+        INSERT INTO rating_stats (scope, scope_id, {histogram_columns})
+        SELECT 'event', r.event_id, {histogram}
+        FROM reviews r
+        GROUP BY r.event_id
+    ''')
+    cursor.execute(f'''
+        INSERT INTO rating_stats (scope, scope_id, review_count, content_score_sum, organization_score_sum,
+                                  {histogram_columns})
+        SELECT 'club', e.club_id, COUNT(*), SUM(r.content_score), SUM(r.organization_score), {histogram}
+        FROM reviews r
+        JOIN events e ON r.event_id = e.id
+        GROUP BY e.club_id
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM rating_stats')
+    return cursor.fetchone()[0]
+
+def get_rating_stats(conn, scope, scope_id):
+    """读取活动或社团的评分汇总，返回评价数、平均分和1~5分的分布
     
-    conn.commit()
-    conn.close()
-    print("🎉 数据库初始化完成！")
+    活动的评价数和评分之和取自events表的计数列，分布取自rating_stats。
+    """
+    row = conn.execute(
+        'SELECT * FROM rating_stats WHERE scope = ? AND scope_id = ?', (scope, scope_id)
+    ).fetchone()
+    totals = row
+    if scope == 'event':
+        totals = conn.execute(
+            'SELECT review_count, content_score_sum, organization_score_sum FROM events WHERE id = ?', (scope_id,)
+        ).fetchone()
+    
+    count = totals['review_count'] if totals else 0
+    stats = {
+        'review_count': count,
+        'avg_content': totals['content_score_sum'] / count if count else 0,
+        'avg_organization': totals['organization_score_sum'] / count if count else 0,
+    }
+    stats['avg_overall'] = (stats['avg_content'] + stats['avg_organization']) / 2
+    for dimension in RATING_DIMENSIONS:
+        stats[f'{dimension}_histogram'] = {
+            score: row[f'{dimension}_{score}'] if row else 0 for score in RATING_SCORES
+        }
+    return stats
+
+# 候补名单：活动报满后报名的学生按先后排队（自增id即排队顺序），有人取消报名或
+# 活动扩容时，在同一个事务里把队首的学生转为正式报名。队首由 (event_id, id) 唯一索引直接取得
+WAITLIST_SQL = '''
+    CREATE TABLE IF NOT EXISTS waitlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (event_id) REFERENCES events (id),
+        FOREIGN KEY (student_id) REFERENCES users (id),
+        UNIQUE(event_id, id),
+        UNIQUE(student_id, event_id)
+    )
+'''
+
+WAITLIST_TRIGGERS_SQL = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_after_delete_waitlist AFTER DELETE ON events
+    BEGIN
+        DELETE FROM waitlist WHERE event_id = OLD.id;
+    END
+    ''',
+)
+
+def create_waitlist(cursor):
+    """创建候补名单表及其触发器"""
+    cursor.execute(WAITLIST_SQL)
+    create_triggers(cursor, WAITLIST_TRIGGERS_SQL)
+    print("✓ 候补名单表创建完成")
+
+# 活动取消后候补名单不会再有人转正，直接清空
+WAITLIST_CANCEL_TRIGGER_SQL = '''
+    CREATE TRIGGER IF NOT EXISTS events_after_cancel_waitlist
+    AFTER UPDATE OF status ON events
+    WHEN NEW.status = 'cancelled'
+    BEGIN
+        DELETE FROM waitlist WHERE event_id = NEW.id;
+    END
+'''
+
+def create_waitlist_cancel_trigger(cursor):
+    """创建取消活动时清空候补名单的触发器，并清理已取消活动遗留的候补记录"""
+    create_triggers(cursor, (WAITLIST_CANCEL_TRIGGER_SQL,))
+    cursor.execute('''
+        DELETE FROM waitlist
+        WHERE event_id IN (SELECT id FROM events WHERE status = 'cancelled')
+    ''')
+    if cursor.rowcount:
+        print(f"✓ 清理 {cursor.rowcount} 条已取消活动的候补记录")
+
+# 场地占用的区间索引：locations给地点编号（去掉首尾空白，不区分大小写），
+# event_slots是R*Tree，每个未取消的活动占一个二维矩形 (地点编号, [starts_at, ends_at])，
+# 查找某地点与某时间段重叠的活动只访问树中相交的节点，活动越来越多时仍是对数级。
+# R*Tree的坐标是32位浮点数，存入时向外取整，查到的候选再用events表的精确起止时间过滤
+LOCATIONS_SQL = '''
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE COLLATE NOCASE
+    )
+'''
+
+EVENT_SLOTS_SQL = '''
+    CREATE VIRTUAL TABLE event_slots USING rtree(
+        id,
+        min_location, max_location,
+        starts_at, ends_at
+    )
+'''
+
+# 写入一个活动的矩形（时间无法解析或活动已取消时不写入）。R*Tree要求下界不大于上界，
+# 早期编辑页只改开始时间、可能留下结束早于开始的活动，这类数据按开始时间计（现在编辑会同时平移结束时间）
+_EVENT_SLOT_INSERT = '''
+        INSERT OR IGNORE INTO locations (name) VALUES (trim(NEW.location));
+        INSERT OR REPLACE INTO event_slots (id, min_location, max_location, starts_at, ends_at)
+        SELECT NEW.id, l.id, l.id, NEW.starts_at, MAX(NEW.starts_at, NEW.ends_at)
+        FROM locations l
+        WHERE l.name = trim(NEW.location)
+        AND NEW.starts_at IS NOT NULL AND NEW.ends_at IS NOT NULL
+        AND NEW.status IS NOT 'cancelled';
+'''
+
+LOCATION_TRIGGERS_SQL = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS events_after_insert_slot AFTER INSERT ON events
+    BEGIN
+        {_EVENT_SLOT_INSERT}
+    END
+    ''',
+    # 起止时间是生成列，UPDATE OF要写它们依赖的date_time/end_time
+    f'''
+    CREATE TRIGGER IF NOT EXISTS events_after_update_slot
+    AFTER UPDATE OF location, date_time, end_time, status ON events
+    BEGIN
+        DELETE FROM event_slots WHERE id = NEW.id;
+        {_EVENT_SLOT_INSERT}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_after_delete_slot AFTER DELETE ON events
+    BEGIN
+        DELETE FROM event_slots WHERE id = OLD.id;
+    END
+    ''',
+)
+
+def create_location_index(cursor):
+    """创建场地占用索引及其触发器；首次创建时从现有活动回填。SQLite不支持R*Tree时返回False"""
+    cursor.execute(LOCATIONS_SQL)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_slots'")
+    exists = cursor.fetchone() is not None
+
+    try:
+        if not exists:
+            cursor.execute(EVENT_SLOTS_SQL)
+            rebuild_location_index(cursor)
+        create_triggers(cursor, LOCATION_TRIGGERS_SQL)
+    except sqlite3.OperationalError as e:
+        # 没有R*Tree扩展时冲突检测退化为按地点扫描events表
+        print(f"创建场地占用索引失败，冲突检测将扫描活动表: {e}")
+        return False
+
+    print("✓ 场地占用索引创建完成")
+    return True
+
+def rebuild_location_index(cursor):
+    """根据活动表重建场地占用索引（回填/修复用），返回索引中的活动数"""
+    cursor.execute('''
+        INSERT OR IGNORE INTO locations (name)
+        SELECT DISTINCT trim(location) FROM events WHERE location IS NOT NULL
+    ''')
+    cursor.execute('DELETE FROM event_slots')
+    cursor.execute('''
+        INSERT INTO event_slots (id, min_location, max_location, starts_at, ends_at)
+        SELECT e.id, l.id, l.id, e.starts_at, MAX(e.starts_at, e.ends_at)
+        FROM events e
+        JOIN locations l ON l.name = trim(e.location)
+        WHERE e.starts_at IS NOT NULL AND e.ends_at IS NOT NULL
+        AND e.status IS NOT 'cancelled'
+    ''')
+    cursor.execute('SELECT COUNT(*) FROM event_slots')
+    return cursor.fetchone()[0]
+
+def has_location_index(conn):
+    """数据库中是否存在场地占用索引"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_slots'"
+    ).fetchone() is not None
+
+def find_location_conflicts(conn, location, starts_at, ends_at, exclude_event_id=None):
+    """返回同一地点与 [starts_at, ends_at) 时间重叠的未取消活动，按开始时间排序
+
+    首尾相接（一个活动结束时另一个开始）不算冲突。
+    """
+    if has_location_index(conn):
+        return conn.execute('''
+            SELECT e.id, e.title, e.date_time, e.end_time, e.starts_at, e.ends_at, e.location,
+                   u.username as club_name
+            FROM locations l
+            JOIN event_slots s ON s.min_location <= l.id AND s.max_location >= l.id
+                               AND s.starts_at < ? AND s.ends_at > ?
+            JOIN events e ON e.id = s.id
+            JOIN users u ON e.club_id = u.id
+            WHERE l.name = trim(?)
+            AND e.starts_at < ? AND e.ends_at > ?
+            AND e.id IS NOT ?
+            ORDER BY e.starts_at, e.id
+        ''', (ends_at, starts_at, location, ends_at, starts_at, exclude_event_id)).fetchall()
+    return conn.execute('''
+        SELECT e.id, e.title, e.date_time, e.end_time, e.starts_at, e.ends_at, e.location,
+               u.username as club_name
+        FROM events e
+        JOIN users u ON e.club_id = u.id
+        WHERE trim(e.location) = trim(?) COLLATE NOCASE
+        AND e.starts_at < ? AND e.ends_at > ?
+        AND e.status IS NOT 'cancelled'
+        AND e.id IS NOT ?
+        ORDER BY e.starts_at, e.id
+    ''', (location, ends_at, starts_at, exclude_event_id)).fetchall()
+
+def find_free_slots(conn, location, window_start, window_end, min_seconds=0):
+    """返回 (占用的活动列表, 空闲时段列表)：地点在 [window_start, window_end) 内的空闲时段，
+    每个时段为 (开始, 结束) 秒数，短于min_seconds的时段不返回
+    """
+    busy = find_location_conflicts(conn, location, window_start, window_end)
+    free = []
+    cursor = window_start
+    for event in busy:
+        if event['starts_at'] - cursor >= max(min_seconds, 1):
+            free.append((cursor, event['starts_at']))
+        cursor = max(cursor, event['ends_at'])
+    if window_end - cursor >= max(min_seconds, 1):
+        free.append((cursor, window_end))
+    return busy, free
+
+# 二级索引定义。索引名带版本后缀（_v1、_v2……），调整索引时新增一个版本的名字，
+# create_indexes()会删除不在当前列表里的旧版本索引；不带版本后缀的索引
+# （如短关键词索引的idx_event_search_bigrams_event）由各自的create_*()函数管理
+INDEX_DEFINITIONS = (
+    # 按活动统计/列出报名，报名趋势按registered_at分组
+    ('idx_registrations_event_v1',
+     'CREATE INDEX IF NOT EXISTS idx_registrations_event_v1 ON registrations (event_id, registered_at, student_id)'),
+    # 活动报告按时间倒序列出评价
+    ('idx_reviews_event_v1',
+     'CREATE INDEX IF NOT EXISTS idx_reviews_event_v1 ON reviews (event_id, reviewed_at)'),
+    # 社团仪表盘、社团资料
+    ('idx_events_club_v2',
+     'CREATE INDEX IF NOT EXISTS idx_events_club_v2 ON events (club_id, starts_at)'),
+    # 学生端列表只看未结束的活动；状态回写按开始时间找到已开始的活动
+    ('idx_events_status_time_v2',
+     'CREATE INDEX IF NOT EXISTS idx_events_status_time_v2 ON events (status, starts_at)'),
+    # 状态回写按结束时间找到已结束的活动
+    ('idx_events_status_end_v1',
+     'CREATE INDEX IF NOT EXISTS idx_events_status_end_v1 ON events (status, ends_at)'),
+    # 收藏页按收藏时间倒序
+    ('idx_favorites_student_v1',
+     'CREATE INDEX IF NOT EXISTS idx_favorites_student_v1 ON favorites (student_id, created_at, event_id)'),
+    ('idx_favorites_event_v1',
+     'CREATE INDEX IF NOT EXISTS idx_favorites_event_v1 ON favorites (event_id)'),
+    # 按分类列出活动（主键以event_id开头，无法按分类查找）
+    ('idx_category_relations_category_v1',
+     'CREATE INDEX IF NOT EXISTS idx_category_relations_category_v1 ON event_category_relations (category_id, event_id)'),
+)
+
+# 迁移4发布时的索引（按date_time排序），只供迁移4使用，不能修改
+INDEX_DEFINITIONS_V1 = (
+    ('idx_registrations_event_v1',
+     'CREATE INDEX IF NOT EXISTS idx_registrations_event_v1 ON registrations (event_id, registered_at, student_id)'),
+    ('idx_reviews_event_v1',
+     'CREATE INDEX IF NOT EXISTS idx_reviews_event_v1 ON reviews (event_id, reviewed_at)'),
+    ('idx_events_club_v1',
+     'CREATE INDEX IF NOT EXISTS idx_events_club_v1 ON events (club_id, date_time)'),
+    ('idx_events_status_time_v1',
+     'CREATE INDEX IF NOT EXISTS idx_events_status_time_v1 ON events (status, date_time)'),
+    ('idx_favorites_student_v1',
+     'CREATE INDEX IF NOT EXISTS idx_favorites_student_v1 ON favorites (student_id, created_at, event_id)'),
+    ('idx_favorites_event_v1',
+     'CREATE INDEX IF NOT EXISTS idx_favorites_event_v1 ON favorites (event_id)'),
+    ('idx_category_relations_category_v1',
+     'CREATE INDEX IF NOT EXISTS idx_category_relations_category_v1 ON event_category_relations (category_id, event_id)'),
+)
+
+def create_indexes(cursor, definitions=INDEX_DEFINITIONS):
+    """创建definitions中的索引（默认为当前版本），并删除不在其中的旧版本索引（名字带版本后缀的）"""
+    wanted = {name for name, _ in definitions}
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name GLOB 'idx_*_v[0-9]*'")
+    for (name,) in cursor.fetchall():
+        if name not in wanted:
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+            print(f"✓ 删除旧索引 {name}")
+    
+    for _, sql in definitions:
+        cursor.execute(sql)
+    print("✓ 索引创建完成")
+
+# 活动全文索引：标题、描述、地点、主办社团名。trigram分词按字符切分，
+# 中文无需分词也能检索；由触发器与events/users保持同步
+SEARCH_INDEX_SQL = '''
+    CREATE VIRTUAL TABLE events_fts USING fts5(
+        title, description, location, club_name,
+        tokenize = 'trigram'
+    )
+'''
+
+SEARCH_TRIGGERS_SQL = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_fts_after_insert AFTER INSERT ON events
+    BEGIN
+        INSERT INTO events_fts (rowid, title, description, location, club_name)
+        VALUES (NEW.id, NEW.title, COALESCE(NEW.description, ''), NEW.location,
+                (SELECT username FROM users WHERE id = NEW.club_id));
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_fts_after_update
+    AFTER UPDATE OF title, description, location, club_id ON events
+    BEGIN
+        UPDATE events_fts
+        SET title = NEW.title,
+            description = COALESCE(NEW.description, ''),
+            location = NEW.location,
+            club_name = (SELECT username FROM users WHERE id = NEW.club_id)
+        WHERE rowid = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_fts_after_delete AFTER DELETE ON events
+    BEGIN
+        DELETE FROM events_fts WHERE rowid = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS users_fts_after_update AFTER UPDATE OF username ON users
+    BEGIN
+        UPDATE events_fts SET club_name = NEW.username
+        WHERE rowid IN (SELECT id FROM events WHERE club_id = NEW.id);
+    END
+    ''',
+)
+
+# trigram分词至少需要3个字符，更短的关键词退化为在全文表上做LIKE匹配
+SEARCH_MIN_TERM_LENGTH = 3
+# 标题、描述、地点、社团名在bm25排序中的权重
+SEARCH_COLUMN_WEIGHTS = (10.0, 1.0, 3.0, 5.0)
+SEARCH_PAGE_SIZE = 20
+
+def create_search_index(cursor):
+    """创建活动全文索引；首次创建时从现有活动回填。SQLite不支持FTS5时返回False"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events_fts'")
+    exists = cursor.fetchone() is not None
+    
+    try:
+        if not exists:
+            cursor.execute(SEARCH_INDEX_SQL)
+            cursor.execute('''
+                INSERT INTO events_fts (rowid, title, description, location, club_name)
+                SELECT e.id, e.title, COALESCE(e.description, ''), e.location, u.username
+                FROM events e
+                LEFT JOIN users u ON e.club_id = u.id
+            ''')
+        create_triggers(cursor, SEARCH_TRIGGERS_SQL)
+    except sqlite3.OperationalError as e:
+        # 旧版本SQLite没有FTS5或trigram分词，搜索退化为LIKE
+        print(f"创建全文索引失败，搜索将使用LIKE匹配: {e}")
+        return False
+    
+    print("✓ 全文索引创建完成")
+    return True
+
+def has_search_index(conn):
+    """数据库中是否存在活动全文索引"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events_fts'"
+    ).fetchone() is not None
+
+# trigram索引查不了1~2个字符的关键词（如“篮球”），这类关键词走二元组表：
+# 每个未结束活动（存储的状态为upcoming/ongoing）的标题、描述、地点、社团名转成小写后
+# 按相邻两个字符切分，一行一个 (二元组, 活动id)。已结束、已取消的活动不在表中，
+# 表的大小只随未结束的活动数增长；状态由后台任务写回completed时由触发器删除
+SEARCH_BIGRAMS_SQL = '''
+    CREATE TABLE IF NOT EXISTS event_search_bigrams (
+        bigram TEXT NOT NULL,
+        event_id INTEGER NOT NULL,
+        PRIMARY KEY (bigram, event_id)
+    ) WITHOUT ROWID
+'''
+# 活动修改、删除时按活动id删除它的二元组
+SEARCH_BIGRAMS_INDEX_SQL = '''
+    CREATE INDEX IF NOT EXISTS idx_event_search_bigrams_event ON event_search_bigrams(event_id)
+'''
+
+def _search_bigrams_insert(condition):
+    """写入满足condition的未结束活动的二元组的SQL
+    
+    各列之间和末尾用空格隔开：关键词不含空白，不会跨列匹配；末尾的空格让每个字符都是
+    某个二元组的首字符，单字关键词按首字符的范围查找。
+    """
+    return f'''
+        INSERT OR IGNORE INTO event_search_bigrams (bigram, event_id)
+        WITH RECURSIVE
+            texts(event_id, text) AS (
+                SELECT e.id, lower(e.title || ' ' || COALESCE(e.description, '') || ' '
+                                   || COALESCE(e.location, '') || ' ' || COALESCE(u.username, '') || ' ')
+                FROM events e
+                LEFT JOIN users u ON u.id = e.club_id
+                WHERE {condition} AND e.status IN ('upcoming', 'ongoing')
+            ),
+            positions(event_id, text, n) AS (
+                SELECT event_id, text, 1 FROM texts
+                UNION ALL
+                SELECT event_id, text, n + 1 FROM positions WHERE n < length(text) - 1
+            )
+        SELECT substr(text, n, 2), event_id FROM positions WHERE substr(text, n, 1) <> ' ';
+    '''
+
+SEARCH_BIGRAM_TRIGGERS_SQL = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS events_bigrams_after_insert AFTER INSERT ON events
+    WHEN NEW.status IN ('upcoming', 'ongoing')
+    BEGIN
+        {_search_bigrams_insert('e.id = NEW.id')}
+    END
+    ''',
+    # 内容变化，或者进入/离开未结束状态时重建该活动的二元组；upcoming到ongoing不需要改动
+    f'''
+    CREATE TRIGGER IF NOT EXISTS events_bigrams_after_update
+    AFTER UPDATE OF title, description, location, club_id, status ON events
+    WHEN OLD.title IS NOT NEW.title OR OLD.description IS NOT NEW.description
+         OR OLD.location IS NOT NEW.location OR OLD.club_id IS NOT NEW.club_id
+         OR (OLD.status IN ('upcoming', 'ongoing')) IS NOT (NEW.status IN ('upcoming', 'ongoing'))
+    BEGIN
+        DELETE FROM event_search_bigrams WHERE event_id = OLD.id;
+        {_search_bigrams_insert('e.id = NEW.id')}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS events_bigrams_after_delete AFTER DELETE ON events
+    BEGIN
+        DELETE FROM event_search_bigrams WHERE event_id = OLD.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS users_bigrams_after_update AFTER UPDATE OF username ON users
+    BEGIN
+        DELETE FROM event_search_bigrams
+        WHERE event_id IN (SELECT id FROM events WHERE club_id = NEW.id);
+        {_search_bigrams_insert('e.club_id = NEW.id')}
+    END
+    ''',
+)
+
+def create_search_bigrams(cursor):
+    """创建短关键词使用的二元组表及其触发器；首次创建时从现有活动回填。
+    SQLite不支持触发器中的WITH子句时返回False"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_search_bigrams'")
+    exists = cursor.fetchone() is not None
+    
+    try:
+        if not exists:
+            cursor.execute(SEARCH_BIGRAMS_SQL)
+            rebuild_search_bigrams(cursor)
+        cursor.execute(SEARCH_BIGRAMS_INDEX_SQL)
+        create_triggers(cursor, SEARCH_BIGRAM_TRIGGERS_SQL)
+    except sqlite3.OperationalError as e:
+        # 旧版本SQLite不支持触发器中的WITH子句，短关键词退化为在全文表上做LIKE匹配
+        cursor.execute('DROP TABLE IF EXISTS event_search_bigrams')
+        print(f"创建短关键词索引失败，1~2个字符的关键词将使用LIKE匹配: {e}")
+        return False
+    
+    print("✓ 短关键词索引创建完成")
+    return True
+
+def rebuild_search_bigrams(cursor):
+    """根据活动表重建二元组表（回填/修复用），返回表中的行数"""
+    cursor.execute('DELETE FROM event_search_bigrams')
+    cursor.execute(_search_bigrams_insert('1'))
+    cursor.execute('SELECT COUNT(*) FROM event_search_bigrams')
+    return cursor.fetchone()[0]
+
+def has_search_bigrams(conn):
+    """数据库中是否存在短关键词使用的二元组表"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_search_bigrams'"
+    ).fetchone() is not None
+
+def _quote_fts_term(term):
+    """把用户输入的词转成FTS5字符串，避免被当作查询语法"""
+    return '"' + term.replace('"', '""') + '"'
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_active_events(conn, query, student_id, page=1, page_size=SEARCH_PAGE_SIZE, use_fts=True,
+                         use_bigrams=True):
+    """搜索未结束的活动，按bm25相关度排序并分页，返回 (活动列表, 总数)
+
+    查询按空白拆分为多个关键词，所有关键词都需匹配；长度不少于3的关键词
+    走全文索引，较短的关键词查二元组表（use_bigrams=False时在全文表上做LIKE过滤）。
+    """
+    terms = query.split()
+    offset = (max(page, 1) - 1) * page_size
+    
+    if not use_fts:
+        # 没有全文索引时的兼容实现
+        conditions = []
+        params = []
+        for term in terms:
+            pattern = f'%{_escape_like(term)}%'
+            conditions.append("(e.title LIKE ? ESCAPE '\\' OR e.description LIKE ? ESCAPE '\\' "
+                              "OR e.location LIKE ? ESCAPE '\\' OR u.username LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 4)
+        where = ' AND '.join(conditions) or '1'
+        base = f'''
+            FROM events_live e
+            JOIN users u ON e.club_id = u.id
+            WHERE {where}
+            AND e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing')
+        '''
+        total = conn.execute('SELECT COUNT(*) ' + base, params).fetchone()[0]
+        events = conn.execute(f'''
+            SELECT e.*, u.username as club_name
+            {base}
+            ORDER BY e.starts_at
+            LIMIT ? OFFSET ?
+        ''', params + [page_size, offset]).fetchall()
+        return annotate_student_events(events, *get_student_event_ids(conn, student_id)), total
+    
+    long_terms = [t for t in terms if len(t) >= SEARCH_MIN_TERM_LENGTH]
+    short_terms = [t for t in terms if len(t) < SEARCH_MIN_TERM_LENGTH]
+    
+    conditions = []
+    params = []
+    if long_terms:
+        conditions.append('events_fts MATCH ?')
+        params.append(' '.join(_quote_fts_term(t) for t in long_terms))
+    for term in short_terms:
+        if not use_bigrams:
+            pattern = f'%{_escape_like(term)}%'
+            conditions.append("(events_fts.title LIKE ? ESCAPE '\\' OR events_fts.description LIKE ? ESCAPE '\\' "
+                              "OR events_fts.location LIKE ? ESCAPE '\\' OR events_fts.club_name LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 4)
+        elif len(term) == 2:
+            conditions.append('e.id IN (SELECT event_id FROM event_search_bigrams WHERE bigram = lower(?))')
+            params.append(term)
+        else:
+            # 单字关键词：以该字开头的二元组
+            conditions.append('e.id IN (SELECT event_id FROM event_search_bigrams '
+                              'WHERE bigram >= lower(?) AND bigram < lower(?))')
+            params.extend([term, term + '\U0010ffff'])
+    where = ' AND '.join(conditions) or '1'
+    # 只有短关键词时从二元组表查到的活动出发：+号让规划器不用状态索引遍历所有未结束的活动
+    stored_status = '+e.stored_status' if short_terms and use_bigrams and not long_terms else 'e.stored_status'
+    
+    base = f'''
+        FROM events_fts
+        JOIN events_live e ON e.id = events_fts.rowid
+        WHERE {where}
+        AND {stored_status} IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing')
+    '''
+    # 只有MATCH时bm25才有意义，否则按时间排序
+    if long_terms:
+        weights = ', '.join(str(w) for w in SEARCH_COLUMN_WEIGHTS)
+        order_by = f'bm25(events_fts, {weights}), e.starts_at, e.id'
+    else:
+        order_by = 'e.starts_at, e.id'
+    
+    total = conn.execute('SELECT COUNT(*) ' + base, params).fetchone()[0]
+    events = conn.execute(f'''
+        SELECT e.*, events_fts.club_name as club_name
+        {base}
+        ORDER BY {order_by}
+        LIMIT ? OFFSET ?
+    ''', params + [page_size, offset]).fetchall()
+    return annotate_student_events(events, *get_student_event_ids(conn, student_id)), total
+
+# 分类缓存：分类列表和各分类的活动数只在活动增删改、状态变化时改变。
+# 缓存放在进程内，失效依据数据库中的代数号（由触发器在相关写入时递增），
+# 多个进程共享同一个数据库文件时也能感知彼此的写入；TTL（秒）兜底
+CATEGORY_CACHE_TTL = 300
+CATEGORY_GENERATION = 'categories'
+
+CACHE_GENERATIONS_SQL = '''
+    CREATE TABLE IF NOT EXISTS cache_generations (
+        name TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL DEFAULT 0
+    )
+'''
+
+CACHE_TRIGGERS_SQL = tuple(
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+    BEGIN
+        UPDATE cache_generations SET generation = generation + 1 WHERE name = '{CATEGORY_GENERATION}';
+    END
+    '''
+    for name, event, table in (
+        ('events_after_insert_categories', 'INSERT', 'events'),
+        ('events_after_delete_categories', 'DELETE', 'events'),
+        ('events_after_update_categories', 'UPDATE OF status, date_time, end_time', 'events'),
+        ('category_relations_after_insert', 'INSERT', 'event_category_relations'),
+        ('category_relations_after_delete', 'DELETE', 'event_category_relations'),
+        ('category_relations_after_update', 'UPDATE', 'event_category_relations'),
+        ('categories_after_insert', 'INSERT', 'event_categories'),
+        ('categories_after_delete', 'DELETE', 'event_categories'),
+        ('categories_after_update', 'UPDATE', 'event_categories'),
+    )
+)
+
+_category_cache = {}
+_category_cache_lock = threading.Lock()
+
+def create_cache_generations(cursor):
+    """创建缓存代数表及递增代数号的触发器"""
+    cursor.execute(CACHE_GENERATIONS_SQL)
+    cursor.execute(
+        'INSERT OR IGNORE INTO cache_generations (name, generation) VALUES (?, 0)',
+        (CATEGORY_GENERATION,)
+    )
+    create_triggers(cursor, CACHE_TRIGGERS_SQL)
+    print("✓ 缓存代数表创建完成")
+
+def _category_generation(conn):
+    """读取分类缓存的当前代数号，表不存在时返回None（不使用缓存）"""
+    try:
+        row = conn.execute(
+            'SELECT generation FROM cache_generations WHERE name = ?', (CATEGORY_GENERATION,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def _cached_category_query(conn, key, loader):
+    """按代数号和过期时间读取分类缓存，未命中时调用loader(conn)重新加载"""
+    generation = _category_generation(conn)
+    if generation is None:
+        return loader(conn)
+    
+    now = time.monotonic()
+    with _category_cache_lock:
+        entry = _category_cache.get(key)
+        if entry and entry['generation'] == generation and entry['expires_at'] > now:
+            return entry['value']
+    
+    value = loader(conn)
+    with _category_cache_lock:
+        _category_cache[key] = {
+            'value': value,
+            'generation': generation,
+            'expires_at': now + CATEGORY_CACHE_TTL,
+        }
+    return value
+
+def _load_categories(conn):
+    """查询分类列表"""
+    return conn.execute('SELECT * FROM event_categories ORDER BY name').fetchall()
+
+def _load_categories_with_event_count(conn):
+    """查询分类及其活动数量"""
+    return conn.execute('''
+        SELECT ec.*, COUNT(ecr.event_id) as event_count
+        FROM event_categories ec
+        LEFT JOIN event_category_relations ecr ON ec.id = ecr.category_id
+        LEFT JOIN events_live e ON ecr.event_id = e.id AND (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+        GROUP BY ec.id
+        ORDER BY ec.name
+    ''').fetchall()
+
+# 列表分页：按 (排序列, id) 做游标分页，每页只取固定条数，
+# 翻页代价与活动总数无关
+DEFAULT_PAGE_SIZE = 18
+MAX_PAGE_SIZE = 60
+
+# 各列表的游标列：(SQL表达式, 结果行中的列名)
+EVENT_KEYSET = (('e.starts_at', 'starts_at'), ('e.id', 'id'))
+FAVORITE_KEYSET = (('f.created_at', 'favorited_at'), ('f.id', 'favorite_id'))
+
+def parse_page_size(value):
+    """把请求中的page_size限制在 1..MAX_PAGE_SIZE"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+def encode_cursor(values):
+    """把上一页最后一行的排序键编码为URL安全的游标"""
+    raw = json.dumps(list(values), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, length):
+    """解析游标，格式不对时返回None（从第一页开始）"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+def keyset_query(sql, params=(), cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                 keys=EVENT_KEYSET, descending=False):
+    """给以WHERE子句结尾的查询追加游标条件、排序和LIMIT（多取一行），返回 (sql, 参数)"""
+    columns = ', '.join(expr for expr, _ in keys)
+    params = list(params)
+    
+    values = decode_cursor(cursor, len(keys))
+    if values is not None:
+        placeholders = ', '.join('?' for _ in keys)
+        sql += f" AND ({columns}) {'<' if descending else '>'} ({placeholders})"
+        params.extend(values)
+    
+    direction = ' DESC' if descending else ''
+    sql += ' ORDER BY ' + ', '.join(expr + direction for expr, _ in keys) + ' LIMIT ?'
+    params.append(page_size + 1)
+    return sql, params
+
+def keyset_page(rows, page_size=DEFAULT_PAGE_SIZE, keys=EVENT_KEYSET):
+    """从keyset_query()的结果中切出本页，返回 (本页结果, 下一页游标)"""
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1][name] for _, name in keys)
+
+def fetch_keyset_page(conn, sql, params=(), cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                      keys=EVENT_KEYSET, descending=False):
+    """执行以WHERE子句结尾的查询，追加游标条件、排序和LIMIT，返回 (本页结果, 下一页游标)
+
+    sql不能包含ORDER BY/LIMIT；keys中的列名必须出现在查询结果中。
+    """
+    sql, params = keyset_query(sql, params, cursor, page_size, keys, descending)
+    return keyset_page(conn.execute(sql, params).fetchall(), page_size, keys)
+
+def add_event_columns(cursor, names, definition='INTEGER NOT NULL DEFAULT 0'):
+    """给活动表添加列（默认是非空整数列，已存在的跳过），返回实际添加的列"""
+    # table_xinfo才会列出生成列
+    cursor.execute("PRAGMA table_xinfo(events)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    added = []
+    for name in names:
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE events ADD COLUMN {name} {definition}')
+            print(f"✓ 添加 {name} 列")
+            added.append(name)
+    return added
+
+def _migrate_event_counters(cursor):
+    if add_event_columns(cursor, EVENT_COUNTER_COLUMNS):
+        fixed = rebuild_event_counters(cursor)
+        print(f"✓ 回填 {fixed} 个活动的计数列")
+
+def _migrate_counter_triggers(cursor):
+    create_counter_triggers(cursor)
+    create_views(cursor, EVENTS_LIVE_VIEW_SQL_V1)
+
+def _migrate_rating_stats(cursor):
+    create_rating_stats(cursor)
+    rebuild_rating_stats(cursor)
+
+def _migrate_event_times(cursor):
+    # 无法解析的时间对应NULL，所以这两列允许为空
+    add_event_columns(cursor, EVENT_TIME_COLUMNS, 'INTEGER')
+    cursor.execute(EVENT_TIMES_BACKFILL_SQL_V1)
+    if cursor.rowcount:
+        print(f"✓ 回填 {cursor.rowcount} 个活动的起止时间")
+    create_triggers(cursor, EVENT_TIME_TRIGGERS_SQL_V1)
+    create_indexes(cursor)
+    create_views(cursor)
+
+def _migrate_event_time_columns(cursor):
+    """把迁移9添加的starts_at/ends_at普通列（触发器回写）换成不能为空的VIRTUAL生成列"""
+    ids = fix_unparseable_event_times(cursor)
+    if ids:
+        print(f"✓ 修正 {len(ids)} 个起止时间无法解析的活动（开始时间取创建时间）: {ids}")
+    cursor.execute("SELECT 1 FROM pragma_table_xinfo('events') WHERE name = 'starts_at' AND hidden = 0")
+    if cursor.fetchone() is not None:
+        # 引用这两列的索引、视图和触发器要先删除才能删列，之后按当前定义重建
+        cursor.execute('''
+            SELECT type, name FROM sqlite_master
+            WHERE type IN ('index', 'view', 'trigger') AND sql IS NOT NULL
+            AND (sql LIKE '%starts_at%' OR sql LIKE '%ends_at%')
+        ''')
+        for object_type, name in cursor.fetchall():
+            cursor.execute(f'DROP {object_type.upper()} IF EXISTS {name}')
+        for name in EVENT_TIME_COLUMNS:
+            cursor.execute(f'ALTER TABLE events DROP COLUMN {name}')
+    for name, definition in EVENT_TIME_COLUMN_DEFINITIONS:
+        add_event_columns(cursor, (name,), definition)
+    create_indexes(cursor)
+    create_views(cursor)
+    if create_location_index(cursor) and ids:
+        rebuild_location_index(cursor)
+
+# 数据库结构迁移：(版本号, 说明, 执行函数)。每条迁移在一个事务中执行，
+# 成功后把 PRAGMA user_version 设为该版本号，已执行过的迁移不会再执行。
+# 迁移只能在末尾追加，不能修改已发布的迁移；调整索引、视图或触发器时
+# 先修改对应的定义，再追加一条调用create_indexes()等函数的迁移。
+# 已发布的迁移大多调用create_counter_triggers()、create_search_index()等函数，执行的是
+# 当前的定义（触发器由create_triggers()先删除再创建）：新数据库在较早的迁移中就得到新定义，
+# 旧数据库由之后追加的迁移重新创建这些对象，两者结果相同。因此修改定义时，较早的迁移
+# 只能引用它执行时已经存在的列和表。只有迁移4的索引和迁移5的视图冻结为发布时的定义
+# （INDEX_DEFINITIONS_V1、EVENTS_LIVE_VIEW_SQL_V1），它们当前的定义用到了迁移9才添加的列。
+# 迁移函数要能在已经部分具备新结构的数据库上重复执行（IF NOT EXISTS、先检查列）
+MIGRATIONS = (
+    (1, '基础表', create_base_tables),
+    (2, '活动计数列', _migrate_event_counters),
+    (3, '报名版本号', lambda cursor: add_event_columns(cursor, EVENT_VERSION_COLUMNS)),
+    (4, '二级索引', lambda cursor: create_indexes(cursor, INDEX_DEFINITIONS_V1)),
+    (5, '计数器触发器和活动状态视图', _migrate_counter_triggers),
+    (6, '活动全文索引', create_search_index),
+    (7, '缓存代数表', create_cache_generations),
+    (8, '评分汇总表', create_rating_stats),
+    (9, '活动起止时间整数列', _migrate_event_times),
+    (10, '候补名单', create_waitlist),
+    (11, '场地占用区间索引', create_location_index),
+    (12, '取消活动时清空候补名单', create_waitlist_cancel_trigger),
+    (13, '短关键词索引', create_search_bigrams),
+    (14, '活动评分汇总只保留分布', _migrate_rating_stats),
+    (15, '活动起止时间改为非空生成列', _migrate_event_time_columns),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn):
+    """数据库当前的结构版本"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate_schema(conn):
+    """执行未完成的迁移，返回执行的迁移数。结构已是最新时只读取一次user_version"""
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return 0
+    
+    applied = 0
+    cursor = conn.cursor()
+    for version, description, migration in MIGRATIONS:
+        # BEGIN IMMEDIATE 先取得写锁，多个进程同时启动时只有一个执行迁移
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"✓ 迁移 {version}：{description}")
+        applied += 1
+    return applied
+
+def upgrade_schema(cursor):
+    """重建索引、触发器、视图、全文索引、短关键词索引、缓存代数表、评分汇总表、候补名单和场地占用索引（批量导入后或修复时使用，可重复执行）"""
+    create_indexes(cursor)
+    create_counter_triggers(cursor)
+    create_views(cursor)
+    create_search_index(cursor)
+    create_search_bigrams(cursor)
+    create_cache_generations(cursor)
+    create_rating_stats(cursor)
+    create_waitlist(cursor)
+    create_waitlist_cancel_trigger(cursor)
+    create_location_index(cursor)
 
 def insert_initial_categories(cursor):
     """插入初始分类数据"""
@@ -389,24 +1818,24 @@ def update_event_statuses():
     conn = get_db_connection()
     
     # 获取当前时间
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    now = event_epoch(datetime.now())
     
     try:
         # 更新已开始但未标记为进行中的活动
         conn.execute('''
             UPDATE events 
             SET status = 'ongoing' 
-            WHERE datetime(date_time) <= datetime(?) 
-            AND datetime(end_time) > datetime(?)
-            AND status = 'upcoming'
+            WHERE status = 'upcoming'
+            AND starts_at <= ?
+            AND ends_at > ?
         ''', (now, now))
         
         # 更新已结束的活动
         conn.execute('''
             UPDATE events 
             SET status = 'completed' 
-            WHERE datetime(end_time) <= datetime(?)
-            AND status IN ('upcoming', 'ongoing')
+            WHERE status IN ('upcoming', 'ongoing')
+            AND ends_at <= ?
         ''', (now,))
         
         conn.commit()
@@ -456,7 +1885,7 @@ def get_event_by_id(event_id):
     """根据活动ID获取活动信息"""
     conn = get_db_connection()
     event = conn.execute(
-        'SELECT * FROM events WHERE id = ?', (event_id,)
+        'SELECT * FROM events_live WHERE id = ?', (event_id,)
     ).fetchone()
     conn.close()
     return event
@@ -465,61 +1894,171 @@ def get_events_by_club(club_id):
     """获取社团发布的所有活动"""
     conn = get_db_connection()
     events = conn.execute(
-        'SELECT * FROM events WHERE club_id = ? ORDER BY date_time', (club_id,)
+        'SELECT * FROM events_live WHERE club_id = ? ORDER BY starts_at', (club_id,)
     ).fetchall()
     conn.close()
     return events
 
 def get_categories():
-    """获取所有分类"""
+    """获取所有分类（带缓存）"""
     conn = get_db_connection()
-    categories = conn.execute('SELECT * FROM event_categories ORDER BY name').fetchall()
+    categories = _cached_category_query(conn, 'categories', _load_categories)
     conn.close()
     return categories
 
 def get_categories_with_event_count():
-    """获取所有分类及其活动数量"""
+    """获取所有分类及其活动数量（带缓存）"""
     conn = get_db_connection()
-    categories = conn.execute('''
-        SELECT ec.*, COUNT(ecr.event_id) as event_count
-        FROM event_categories ec
-        LEFT JOIN event_category_relations ecr ON ec.id = ecr.category_id
-        LEFT JOIN events e ON ecr.event_id = e.id AND (e.status = 'upcoming' OR e.status = 'ongoing')
-        GROUP BY ec.id
-        ORDER BY ec.name
-    ''').fetchall()
+    categories = _cached_category_query(conn, 'categories_with_event_count', _load_categories_with_event_count)
     conn.close()
     return categories
 
-def get_events_by_category(category_id, student_id=None):
-    """根据分类获取活动"""
+# 当前学生已报名、已收藏的活动id和候补位置：每个请求各查询一次（按 (student_id, event_id) 唯一索引），
+# 结果保存在g中；列表页据此标注is_registered、is_favorited、waitlist_position，不再对每一行执行相关子查询
+STUDENT_REGISTERED_IDS_SQL = 'SELECT event_id FROM registrations WHERE student_id = ?'
+STUDENT_FAVORITED_IDS_SQL = 'SELECT event_id FROM favorites WHERE student_id = ?'
+# 候补位置 = 同一活动中排在自己前面（含自己）的人数，按 (event_id, id) 索引计数
+STUDENT_WAITLIST_SQL = '''
+    SELECT w.event_id,
+           (SELECT COUNT(*) FROM waitlist ahead
+            WHERE ahead.event_id = w.event_id AND ahead.id <= w.id) as position
+    FROM waitlist w
+    WHERE w.student_id = ?
+'''
+
+def get_student_event_ids(conn, student_id):
+    """返回 (已报名id集合, 已收藏id集合, {候补活动id: 第几位})，同一请求内只查询一次"""
+    cache = g.setdefault('_student_event_ids', {}) if has_app_context() else {}
+    if student_id not in cache:
+        registered = {row[0] for row in conn.execute(STUDENT_REGISTERED_IDS_SQL, (student_id,))}
+        favorited = {row[0] for row in conn.execute(STUDENT_FAVORITED_IDS_SQL, (student_id,))}
+        waitlist = {row[0]: row[1] for row in conn.execute(STUDENT_WAITLIST_SQL, (student_id,))}
+        cache[student_id] = (registered, favorited, waitlist)
+    return cache[student_id]
+
+def forget_student_event_ids(student_id):
+    """报名或收藏变化后丢弃本请求中已加载的id集合"""
+    if has_app_context():
+        g.get('_student_event_ids', {}).pop(student_id, None)
+
+def annotate_student_events(rows, registered, favorited, waitlist=None):
+    """把活动行转成dict并加上is_registered、is_favorited、waitlist_position（不在候补名单中为None）"""
+    if not rows:
+        return []
+    # dict(row)会按列名逐个查找，按位置zip要快得多
+    columns = rows[0].keys()
+    events = []
+    for row in rows:
+        event = dict(zip(columns, row))
+        event['is_registered'] = int(event['id'] in registered)
+        event['is_favorited'] = int(event['id'] in favorited)
+        event['waitlist_position'] = waitlist.get(event['id']) if waitlist else None
+        events.append(event)
+    return events
+
+def get_events_by_category(category_id, student_id=None, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """根据分类获取活动（游标分页），返回 (活动列表, 下一页游标)"""
     conn = get_db_connection()
     
+    events, next_cursor = fetch_keyset_page(conn, '''
+        SELECT e.*, u.username as club_name
+        FROM events_live e
+        JOIN users u ON e.club_id = u.id
+        JOIN event_category_relations ecr ON e.id = ecr.event_id
+        WHERE ecr.category_id = ? AND (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+    ''', (category_id,), cursor, page_size)
     if student_id:
-        events = conn.execute('''
-            SELECT e.*, u.username as club_name, 
-                   (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count,
-                   (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id AND r.student_id = ?) as is_registered,
-                   (SELECT COUNT(*) FROM favorites f WHERE f.event_id = e.id AND f.student_id = ?) as is_favorited
-            FROM events e
+        events = annotate_student_events(events, *get_student_event_ids(conn, student_id))
+    
+    conn.close()
+    return events, next_cursor
+
+def get_student_dashboard(conn, student_id, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """用一条SQL取出学生仪表盘的全部数据
+    
+    返回dict：events（可报名活动的一页，按 (时间, id) 游标分页）、next_cursor、events_total、
+    registered_events、reviewable_events（已结束、已报名且未评价）、reviewed_events_count。
+    已报名活动只查询一次，可评价活动从中筛选；活动行带is_registered、is_favorited、waitlist_position，
+    收藏和候补位置在同一条SQL中按 (student_id, event_id) 唯一索引逐行取得。
+    """
+    # 没有游标时从最早的活动开始
+    after = decode_cursor(cursor, len(EVENT_KEYSET)) or (-2 ** 63, 0)
+    rows = conn.execute('''
+        WITH available AS (
+            SELECT e.*, u.username as club_name
+            FROM events_live e
             JOIN users u ON e.club_id = u.id
-            JOIN event_category_relations ecr ON e.id = ecr.event_id
-            WHERE ecr.category_id = ? AND (e.status = 'upcoming' OR e.status = 'ongoing')
-            ORDER BY e.date_time
-        ''', (student_id, student_id, category_id)).fetchall()
-    else:
-        events = conn.execute('''
+            WHERE (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+            AND (e.starts_at, e.id) > (?, ?)
+            ORDER BY e.starts_at, e.id
+            LIMIT ?
+        ),
+        registered AS (
             SELECT e.*, u.username as club_name,
-                   (SELECT COUNT(*) FROM registrations r WHERE r.event_id = e.id) as registered_count
-            FROM events e
+                   EXISTS (SELECT 1 FROM reviews rev
+                           WHERE rev.event_id = e.id AND rev.student_id = r.student_id) as has_reviewed
+            FROM registrations r
+            JOIN events_live e ON e.id = r.event_id
             JOIN users u ON e.club_id = u.id
-            JOIN event_category_relations ecr ON e.id = ecr.event_id
-            WHERE ecr.category_id = ? AND (e.status = 'upcoming' OR e.status = 'ongoing')
-            ORDER BY e.date_time
-        ''', (category_id,)).fetchall()
+            WHERE r.student_id = ?
+        ),
+        summary AS (
+            SELECT (SELECT COUNT(*) FROM events_live e
+                    WHERE (e.stored_status IN ('upcoming', 'ongoing') AND e.status IN ('upcoming', 'ongoing'))
+                   ) as events_total,
+                   (SELECT COUNT(DISTINCT rev.event_id)
+                    FROM reviews rev
+                    JOIN events_live e ON rev.event_id = e.id
+                    WHERE rev.student_id = ? AND e.status = 'completed') as reviewed_events_count
+        ),
+        my_waitlist AS (
+            SELECT w.event_id,
+                   (SELECT COUNT(*) FROM waitlist ahead
+                    WHERE ahead.event_id = w.event_id AND ahead.id <= w.id) as position
+            FROM waitlist w
+            WHERE w.student_id = ?
+        ),
+        sections AS (
+            SELECT 1 as section, 0 as status_order, available.*, 0 as has_reviewed
+            FROM available
+            UNION ALL
+            SELECT 2 as section,
+                   CASE status
+                       WHEN 'ongoing' THEN 1
+                       WHEN 'upcoming' THEN 2
+                       WHEN 'completed' THEN 3
+                       ELSE 4
+                   END as status_order,
+                   registered.*
+            FROM registered
+        )
+        -- 汇总只有一行，LEFT JOIN保证没有任何活动时也能取到两个计数
+        SELECT summary.*, sections.*,
+               f.event_id IS NOT NULL as favorited, my_waitlist.position as waitlist_position
+        FROM summary
+        LEFT JOIN sections ON 1
+        LEFT JOIN favorites f ON f.student_id = ? AND f.event_id = sections.id
+        LEFT JOIN my_waitlist ON my_waitlist.event_id = sections.id
+        ORDER BY sections.section, sections.status_order, sections.starts_at, sections.id
+    ''', (*after, page_size + 1, student_id, student_id, student_id, student_id)).fetchall()
     
-    conn.close()
-    return events
+    # 已报名的活动都在第二部分中，报名id、收藏id和候补位置都不必另外查询
+    registered_ids = {row['id'] for row in rows if row['section'] == 2}
+    favorited_ids = {row['id'] for row in rows if row['favorited']}
+    waitlist = {row['id']: row['waitlist_position'] for row in rows if row['waitlist_position'] is not None}
+    rows = annotate_student_events(rows, registered_ids, favorited_ids, waitlist)
+    available = [row for row in rows if row['section'] == 1]
+    registered = [row for row in rows if row['section'] == 2]
+    events, next_cursor = keyset_page(available, page_size)
+    return {
+        'events': events,
+        'next_cursor': next_cursor,
+        'events_total': rows[0]['events_total'],
+        'registered_events': registered,
+        'reviewable_events': [row for row in registered
+                              if row['status'] == 'completed' and not row['has_reviewed']],
+        'reviewed_events_count': rows[0]['reviewed_events_count'],
+    }
 
 def is_event_favorited(student_id, event_id):
     """检查活动是否被收藏"""
@@ -531,6 +2070,135 @@ def is_event_favorited(student_id, event_id):
     conn.close()
     return favorite is not None
 
+class RegistrationOutcome(Enum):
+    """报名结果"""
+    OK = 'ok'                  # 报名成功
+    DUPLICATE = 'duplicate'    # 已报名过
+    FULL = 'full'              # 人数已满
+    WAITLISTED = 'waitlisted'  # 人数已满，已加入候补名单
+    CLOSED = 'closed'          # 已开始、已结束或已取消
+    NOT_FOUND = 'not_found'    # 活动不存在
+    BUSY = 'busy'              # 高峰模式下排队已满或等待超时，结果未知
+
+def register_for_event(conn, student_id, event_id, waitlist=True):
+    """在一个写事务中完成报名，返回RegistrationOutcome
+
+    BEGIN IMMEDIATE先取得写锁，并发报名依次执行；容量、状态和重复报名的检查
+    都放在同一条INSERT ... SELECT里，成功时只需一条语句。插入失败时才在同一
+    事务中查询具体原因；人数已满时（waitlist为真）在同一事务中加入候补名单。
+    连接上已有未提交的事务时抛出异常（见begin_immediate()）。
+    """
+    begin_immediate(conn)
+    try:
+        outcome = register_in_transaction(conn, student_id, event_id, waitlist)
+        if outcome in (RegistrationOutcome.OK, RegistrationOutcome.WAITLISTED):
+            conn.commit()
+            forget_student_event_ids(student_id)
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    return outcome
+
+def register_in_transaction(conn, student_id, event_id, waitlist=True):
+    """报名的检查和写入，在调用方已开启的写事务中执行，不提交
+
+    返回OK或WAITLISTED时已写入报名或候补记录，其他结果不写任何数据。
+    直接报名成功时删除该学生在这个活动上的候补记录（之前排过队、后来有了空位）。
+    """
+    cursor = conn.execute('''
+        INSERT INTO registrations (student_id, event_id)
+        SELECT ?, e.id
+        FROM events_live e
+        WHERE e.id = ?
+        AND e.status = 'upcoming'
+        AND e.registered_count < e.max_participants
+        AND NOT EXISTS (
+            SELECT 1 FROM registrations r WHERE r.student_id = ? AND r.event_id = e.id
+        )
+    ''', (student_id, event_id, student_id))
+    
+    if cursor.rowcount == 1:
+        conn.execute(
+            'DELETE FROM waitlist WHERE student_id = ? AND event_id = ?', (student_id, event_id)
+        )
+        return RegistrationOutcome.OK
+    
+    event = conn.execute('''
+        SELECT e.status, e.registered_count, e.max_participants,
+               EXISTS (
+                   SELECT 1 FROM registrations r WHERE r.student_id = ? AND r.event_id = e.id
+               ) as is_registered
+        FROM events_live e
+        WHERE e.id = ?
+    ''', (student_id, event_id)).fetchone()
+    
+    if event is None:
+        return RegistrationOutcome.NOT_FOUND
+    if event['is_registered']:
+        return RegistrationOutcome.DUPLICATE
+    if event['status'] != 'upcoming':
+        return RegistrationOutcome.CLOSED
+    if not waitlist:
+        return RegistrationOutcome.FULL
+    # 已在候补名单中时保持原来的位置
+    conn.execute(
+        'INSERT OR IGNORE INTO waitlist (event_id, student_id) VALUES (?, ?)', (event_id, student_id)
+    )
+    return RegistrationOutcome.WAITLISTED
+
+def promote_waitlist(conn, event_id):
+    """按排队顺序把候补学生转为正式报名，直到没有空位或队列为空，返回转正的学生id列表
+
+    只在调用方已开启的写事务中使用，与释放名额的操作一起提交。
+    """
+    promoted = []
+    while True:
+        head = conn.execute('''
+            SELECT w.id, w.student_id
+            FROM waitlist w
+            JOIN events_live e ON e.id = w.event_id
+            WHERE w.event_id = ?
+            AND e.status = 'upcoming'
+            AND e.registered_count < e.max_participants
+            ORDER BY w.id
+            LIMIT 1
+        ''', (event_id,)).fetchone()
+        if head is None:
+            return promoted
+        conn.execute('DELETE FROM waitlist WHERE id = ?', (head[0],))
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO registrations (student_id, event_id) VALUES (?, ?)', (head[1], event_id)
+        )
+        # 队首已经是正式报名时没有占用空位，继续看下一位
+        if cursor.rowcount == 1:
+            promoted.append(head[1])
+
+def withdraw_registration(conn, student_id, event_id):
+    """在一个写事务中取消报名并让候补队首转正，返回转正的学生id列表；未报名时返回None"""
+    begin_immediate(conn)
+    try:
+        cursor = conn.execute(
+            'DELETE FROM registrations WHERE student_id = ? AND event_id = ?', (student_id, event_id)
+        )
+        promoted = promote_waitlist(conn, event_id) if cursor.rowcount else None
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    forget_student_event_ids(student_id)
+    return promoted
+
+def remove_from_waitlist(conn, student_id, event_id):
+    """退出候补名单，返回是否在名单中"""
+    cursor = conn.execute(
+        'DELETE FROM waitlist WHERE student_id = ? AND event_id = ?', (student_id, event_id)
+    )
+    conn.commit()
+    forget_student_event_ids(student_id)
+    return cursor.rowcount > 0
+
 def add_favorite(student_id, event_id):
     """添加收藏"""
     conn = get_db_connection()
@@ -0,0 +1,159 @@
+# registration_queue.py
+"""报名高峰模式：报名请求进入进程内的准入队列，由一个写线程按批在同一个事务中提交（group commit），
+提交后逐一通知等待的请求
+
+开放报名的瞬间大量请求同时争抢SQLite唯一的写锁，逐个BEGIN IMMEDIATE/COMMIT时，
+排不上的请求在busy_timeout中反复退避，超时就报"database is locked"。高峰模式下只有写线程写报名，
+一批最多batch_size条、第一条入队后最多再等max_delay_ms毫秒凑批，每批只取一次写锁、只提交一次。
+每条报名在各自的SAVEPOINT中执行，一条失败不影响同批的其他报名；容量和重复报名的检查与
+models.register_for_event()相同，同一批中后面的报名能看到前面的写入，不会超员。
+
+开启: 设置环境变量 REGISTRATION_SURGE_MODE=1（或create_app({'REGISTRATION_SURGE_MODE': True})）
+队列在进程内存中，多进程部署（serve.py）时每个worker各有一个写线程，worker之间仍通过写锁排队。
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import models
+from models import RegistrationOutcome
+
+class PendingRegistration:
+    """队列中的一条报名请求，写线程处理后设置outcome或error并通知等待者"""
+
+    __slots__ = ('student_id', 'event_id', 'waitlist', 'outcome', 'error', 'abandoned', 'done')
+
+    def __init__(self, student_id, event_id, waitlist):
+        self.student_id = student_id
+        self.event_id = event_id
+        self.waitlist = waitlist
+        self.outcome = None
+        self.error = None
+        self.abandoned = False
+        self.done = threading.Event()
+
+class RegistrationQueue:
+    """报名准入队列和批量提交的写线程
+
+    写线程在第一次提交报名时启动，使用自己的数据库连接；fork出的子进程没有这个线程，
+    在子进程中第一次提交时重新启动。
+    """
+
+    def __init__(self, database=None, batch_size=64, max_delay_ms=5, max_pending=2000, timeout=10):
+        self.database = database
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._queue = queue.Queue(self.max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0       # 已提交的批数
+        self.committed = 0     # 已处理的报名数
+        self.rejected = 0      # 队列已满被拒绝的报名数
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='registration-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, student_id, event_id, waitlist=True, timeout=None):
+        """提交一条报名并等待写线程处理，返回RegistrationOutcome
+
+        队列已满或等待超过timeout秒时返回BUSY。超时的报名若已被写线程取出，仍可能报名成功。
+        """
+        self._ensure_writer()
+        item = PendingRegistration(student_id, event_id, waitlist)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return RegistrationOutcome.BUSY
+        if not item.done.wait(self.timeout if timeout is None else timeout):
+            item.abandoned = True
+            return RegistrationOutcome.BUSY
+        if item.error is not None:
+            raise item.error
+        return item.outcome
+
+    def stats(self):
+        """返回写线程的统计数据"""
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'committed': self.committed,
+                'rejected': self.rejected,
+                'pending': self._queue.qsize(),
+                'avg_batch_size': round(self.committed / self.batches, 2) if self.batches else 0,
+            }
+
+    def _collect(self):
+        """取出一批报名：阻塞等待第一条，之后最多再等max_delay秒或凑满batch_size条"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """写线程主循环"""
+        conn = None
+        while True:
+            batch = [item for item in self._collect() if not item.abandoned]
+            if not batch:
+                continue
+            try:
+                if conn is None:
+                    conn = models._connect(self.database)
+                self._commit_batch(conn, batch)
+            except Exception as e:
+                # 整批失败（如取写锁超时），连接可能已不可用，下一批重新连接
+                print(f"❌ 报名批量提交失败: {e}")
+                for item in batch:
+                    item.outcome = None
+                    item.error = e
+                if conn is not None:
+                    conn.force_close()
+                    conn = None
+            else:
+                with self._lock:
+                    self.batches += 1
+                    self.committed += len(batch)
+            for item in batch:
+                item.done.set()
+
+    @staticmethod
+    def _commit_batch(conn, batch):
+        """在一个写事务中处理一批报名，每条报名各用一个SAVEPOINT"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for item in batch:
+                conn.execute('SAVEPOINT registration')
+                try:
+                    item.outcome = models.register_in_transaction(
+                        conn, item.student_id, item.event_id, item.waitlist
+                    )
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO registration')
+                    item.error = e
+                conn.execute('RELEASE registration')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -0,0 +1,49 @@
+# repair_counters.py
+import sqlite3
+import sys
+from models import DATABASE, migrate_schema, upgrade_schema, rebuild_event_counters, rebuild_rating_stats
+from models import rebuild_event_times, rebuild_location_index, has_location_index
+from models import rebuild_search_bigrams, has_search_bigrams
+
+def main():
+    print("开始校验活动计数列...")
+    
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    
+    try:
+        # 先把表结构迁移到最新版本，再重建触发器等派生结构
+        migrate_schema(conn)
+        upgrade_schema(cursor)
+        
+        # 按报名表和评价表重新计算，只更新有偏差的活动
+        fixed = rebuild_event_counters(cursor)
+        # 评分汇总整体重算
+        rating_rows = rebuild_rating_stats(cursor)
+        # 起止时间的整数列
+        fixed_times = rebuild_event_times(cursor)
+        # 场地占用索引整体重建
+        slot_rows = rebuild_location_index(cursor) if has_location_index(conn) else 0
+        # 短关键词的二元组表整体重建
+        bigram_rows = rebuild_search_bigrams(cursor) if has_search_bigrams(conn) else 0
+        conn.commit()
+        
+        if fixed:
+            print(f"✓ 已修正 {fixed} 个活动的计数")
+        else:
+            print("✓ 所有活动计数均正确")
+        if fixed_times:
+            print(f"✓ 已修正 {fixed_times} 个活动的起止时间")
+        print(f"✓ 已重算 {rating_rows} 条评分汇总")
+        print(f"✓ 已重建 {slot_rows} 个活动的场地占用索引")
+        print(f"✓ 已重建 {bigram_rows} 条短关键词索引")
+        return 0
+    except Exception as e:
+        print(f"❌ 修复计数失败: {e}")
+        conn.rollback()
+        return 1
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# serve.py
+"""预先fork的多进程HTTP服务：主进程调用create_app()完成一次性初始化并监听端口，
+再fork出N个worker共享同一个监听socket，各worker用多线程处理请求。
+worker之间通过WAL模式的SQLite文件共享数据，进程内的缓存和指标各自独立。
+
+用法: python serve.py [--host 0.0.0.0] [--port 5000] [--workers 4]
+安装了gunicorn时也可以: gunicorn -w 4 --threads 8 --preload 'app:create_app({"STATUS_UPDATER": False})'
+（gunicorn没有指定的worker，这样部署时活动状态只在启动时写回一次，页面显示的状态不受影响）
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+
+from werkzeug.serving import make_server
+
+def run_worker(app, sock):
+    """worker进程：在继承来的监听socket上处理请求，收到SIGTERM退出"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+def spawn_worker(app, sock, on_start=None):
+    """fork一个worker，on_start在子进程中、开始处理请求之前调用"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            if on_start:
+                on_start()
+            run_worker(app, sock)
+        finally:
+            os._exit(1)
+    return pid
+
+def serve(app, host='0.0.0.0', port=5000, workers=4, log=print, status_updater=None):
+    """启动workers个worker进程并看护：worker异常退出时重新fork，收到SIGINT/SIGTERM时全部停止
+    
+    主进程要反复fork，不能运行后台线程（fork时其他线程持有的锁会留在子进程中，永远无法释放）。
+    status_updater只在0号worker中fork之后启动，0号worker退出后由重新fork的0号worker接替。
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    def spawn(slot):
+        return spawn_worker(app, sock, status_updater if slot == 0 else None)
+    
+    # worker进程id -> 编号
+    children = {spawn(slot): slot for slot in range(workers)}
+    log(f"✓ 已启动 {workers} 个worker，监听 http://{host}:{sock.getsockname()[1]}")
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid)
+        if not stopping:
+            log(f"❌ worker {pid} 异常退出（状态 {status}），重新启动")
+            children[spawn(slot)] = slot
+    sock.close()
+    log("服务已停止")
+
+def main():
+    parser = argparse.ArgumentParser(description='校园活动系统多进程服务')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--quiet', action='store_true', help='不输出访问日志')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("❌ 当前系统不支持fork，请使用 python app.py 启动单进程服务")
+        return 1
+    if args.quiet:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    from app import create_app, start_status_updater
+    try:
+        # 状态回写线程不在主进程中启动，由serve()在一个worker中启动
+        app = create_app({'STATUS_UPDATER': False})
+    except RuntimeError as e:
+        print(f"❌ 启动失败: {e}")
+        return 1
+    serve(app, args.host, args.port, args.workers, status_updater=start_status_updater)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
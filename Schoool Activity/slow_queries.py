@@ -0,0 +1,147 @@
+# slow_queries.py
+"""慢查询日志：超过阈值的SQL连同参数、耗时、所在路由和EXPLAIN QUERY PLAN写入JSONL文件（按大小轮转）
+
+开启: 设置环境变量 SLOW_QUERY_LOG=slow_queries.jsonl（阈值 SLOW_QUERY_THRESHOLD_MS，默认100毫秒）
+统计: python slow_queries.py slow_queries.jsonl [--top 20] [--sort total|count|max|avg]
+"""
+import argparse
+import glob
+import json
+import logging
+import logging.handlers
+import sqlite3
+import sys
+from datetime import datetime
+
+try:
+    from flask import has_request_context, request
+except ImportError:
+    def has_request_context():
+        return False
+    request = None
+
+EXPLAIN_KEYWORDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+def normalize_sql(sql):
+    """合并空白，便于按语句归类"""
+    return ' '.join(sql.split())
+
+class SlowQueryLog:
+    """把慢查询写入按大小轮转的JSONL文件"""
+
+    def __init__(self, path, threshold_ms=100, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.logger = logging.getLogger(f'slow_queries.{path}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+
+    def record(self, conn, sql, parameters, elapsed):
+        """记录一条慢查询（由models在每条SQL执行后调用）"""
+        if elapsed < self.threshold:
+            return
+        try:
+            entry = {
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'elapsed_ms': round(elapsed * 1000, 3),
+                'sql': normalize_sql(sql),
+                'params': self._safe_params(sql, parameters),
+                'route': None,
+                'plan': self._explain(conn, sql, parameters),
+            }
+            if has_request_context():
+                entry['route'] = request.endpoint
+                entry['method'] = request.method
+                entry['path'] = request.path
+            self.logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"记录慢查询失败: {e}")
+
+    @staticmethod
+    def _safe_params(sql, parameters):
+        """参数转成可序列化的形式；涉及密码的语句不记录参数值"""
+        if parameters is None:
+            return None
+        if isinstance(parameters, dict):
+            values = dict(parameters)
+        else:
+            values = list(parameters)
+        if 'password' in sql.lower():
+            if isinstance(values, dict):
+                return {key: '***' for key in values}
+            return ['***'] * len(values)
+        return values
+
+    @staticmethod
+    def _explain(conn, sql, parameters):
+        """在同一连接上取得查询计划（直接调用sqlite3的execute，不经过统计游标）"""
+        stripped = sql.strip()
+        if parameters is None or not stripped.split(None, 1)[0].upper().startswith(EXPLAIN_KEYWORDS):
+            return None
+        try:
+            rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + stripped, parameters).fetchall()
+        except sqlite3.Error as e:
+            return [f'EXPLAIN失败: {e}']
+        return [row[3] for row in rows]
+
+def read_entries(path):
+    """读取日志文件及其轮转出的旧文件"""
+    for filename in sorted(glob.glob(path + '.*')) + [path]:
+        try:
+            with open(filename, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+        except FileNotFoundError:
+            continue
+
+def rank_statements(entries):
+    """按SQL归类，统计次数、总耗时、平均和最大耗时、涉及的路由"""
+    stats = {}
+    for entry in entries:
+        item = stats.setdefault(entry['sql'], {
+            'sql': entry['sql'], 'count': 0, 'total': 0.0, 'max': 0.0, 'routes': {}, 'plan': None,
+        })
+        item['count'] += 1
+        item['total'] += entry['elapsed_ms']
+        if entry['elapsed_ms'] >= item['max']:
+            item['max'] = entry['elapsed_ms']
+            item['plan'] = entry.get('plan')
+        route = entry.get('route') or '(脚本)'
+        item['routes'][route] = item['routes'].get(route, 0) + 1
+    for item in stats.values():
+        item['avg'] = item['total'] / item['count']
+    return list(stats.values())
+
+def main():
+    parser = argparse.ArgumentParser(description='按耗时统计慢查询日志')
+    parser.add_argument('path', help='慢查询日志文件（会同时读取轮转出的 .1 .2 ... 文件）')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--sort', choices=('total', 'count', 'max', 'avg'), default='total')
+    args = parser.parse_args()
+
+    ranked = sorted(rank_statements(read_entries(args.path)), key=lambda item: item[args.sort], reverse=True)
+    if not ranked:
+        print("没有慢查询记录")
+        return 0
+
+    for index, item in enumerate(ranked[:args.top], 1):
+        routes = ', '.join(f'{route}×{count}' for route, count in
+                           sorted(item['routes'].items(), key=lambda pair: -pair[1]))
+        print(f"{index}. 总计 {item['total']:.1f}ms  次数 {item['count']}  "
+              f"平均 {item['avg']:.1f}ms  最大 {item['max']:.1f}ms")
+        print(f"   路由: {routes}")
+        print(f"   SQL: {item['sql'][:300]}")
+        for detail in item['plan'] or []:
+            print(f"      {detail}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())